@@ -0,0 +1,256 @@
+"""
+Measures how fast the emulator runs, to catch regressions before they ship.
+
+    PYTHONPATH=src python -m benchmarks.run --output results.json
+    PYTHONPATH=src python -m benchmarks.run --compare baseline.json
+
+Covers CPU throughput (cycles and instructions per second, with and without
+compiled blocks), headless frames per second, every opcode handler on its
+own and drawing a frame with Emulator._render_tilemap. Every measurement is
+the best of a few repeats, which is far less noisy than the mean on a busy
+host. Comparing exits with status 1 if anything got slower than the
+threshold.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import time
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, List, Optional, Sequence
+
+import pyboy.cpu
+from pyboy.__about__ import __version__
+from pyboy.cpu import CPU
+from pyboy.emulator import Emulator
+from pyboy.opcodes import cb_instruction_table, instruction_table
+
+# Fills the tile data and OAM with a pattern and turns the sprites on, so
+# frames draw the background and sprites, then copies 256 bytes and runs an
+# ALU loop forever. WORKLOAD is where the loop starts, after the setup.
+WORKLOAD = 0x124
+PROGRAM = bytearray(0x8000)
+PROGRAM[0x100:0x135] = bytes([
+    0x31, 0xF0, 0xDF,                    # LD SP,0xDFF0
+    0x21, 0x00, 0x80,                    # LD HL,0x8000
+    0x7D, 0x22, 0x7C, 0xFE, 0x98,        # LD A,L; LD (HL+),A; LD A,H; CP 0x98
+    0x20, 0xF9,                          # JR NZ,-7
+    0x21, 0x00, 0xC0,                    # LD HL,0xC000
+    0x7D, 0x22, 0xFE, 0x9F, 0x20, 0xFA,  # LD A,L; LD (HL+),A; CP 0x9F; JR NZ,-6
+    0x3E, 0xC0, 0xE0, 0x46,              # LD A,0xC0; LDH (46),A - OAM DMA
+    0x3E, 0xE4, 0xE0, 0x47, 0xE0, 0x48,  # LD A,0xE4; LDH (47),A; LDH (48),A - palettes
+    0x3E, 0x93, 0xE0, 0x40,              # LD A,0x93; LDH (40),A - sprites on
+    0x21, 0x00, 0xC0,                    # LD HL,0xC000
+    0x11, 0x00, 0xC1,                    # LD DE,0xC100
+    0x0E, 0x00,                          # LD C,0
+    0xCD, 0x00, 0x02,                    # CALL 0x200
+    0xCD, 0x00, 0x03,                    # CALL 0x300
+    0xC3, 0x24, 0x01,                    # JP 0x124
+])
+# LD A,(HL+); LD (DE),A; INC DE; DEC C; JR NZ,-6; RET
+PROGRAM[0x200:0x207] = bytes([0x2A, 0x12, 0x13, 0x0D, 0x20, 0xFA, 0xC9])
+# LD B,100; ADD A,B; XOR C; RLCA; SWAP A; INC C; SUB 3; AND 0x7F; OR D; DEC B; JR NZ,-15; RET
+PROGRAM[0x300:0x311] = bytes([0x06, 100, 0x80, 0xA9, 0x07, 0xCB, 0x37, 0x0C, 0xD6, 3,
+                              0xE6, 0x7F, 0xB2, 0x05, 0x20, 0xF1, 0xC9])
+
+
+@dataclass
+class BenchmarkResult:
+    name: str
+    value: float
+    unit: str
+    higher_is_better: bool
+
+
+def _best_time(run: Callable[[], None], repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _cpu() -> CPU:
+    cpu = CPU(logging.getLogger(__name__))
+    cpu.load_program(bytes(PROGRAM))
+    cpu.set_addresses(WORKLOAD, 0xDFF0)
+    return cpu
+
+
+def _emulator() -> Emulator:
+    emulator = Emulator(logging.getLogger(__name__), headless=True)
+    emulator._cpu.load_program(bytes(PROGRAM))
+    # Run the setup, then a whole frame with the sprites on
+    while emulator._cpu._state.memory._ppu.lcdc != 0x93:
+        emulator.step_frame()
+    emulator.step_frame()
+    return emulator
+
+
+def benchmark_cpu(cycles: int, repeat: int) -> List[BenchmarkResult]:
+    """CPU.run_n_cycles with only the interpreter, then with compiled blocks."""
+    results = []
+    for mode in ('interpreter', 'blocks'):
+        cpu = _cpu()
+        threshold = pyboy.cpu.BLOCK_COMPILE_THRESHOLD
+        if mode == 'interpreter':
+            pyboy.cpu.BLOCK_COMPILE_THRESHOLD = 1 << 62
+        try:
+            # Warm up the decoded instructions and blocks, like in a long run
+            cpu.run_n_cycles(cycles // 10)
+            seconds = _best_time(lambda: cpu.run_n_cycles(cycles), repeat)
+        finally:
+            pyboy.cpu.BLOCK_COMPILE_THRESHOLD = threshold
+
+        if mode == 'interpreter':
+            # Blocks don't count instructions, so use the interpreter's count for both
+            instructions_per_cycle = cpu._steps / cpu._scheduler.cycles
+        results.append(BenchmarkResult(f'cpu.{mode}.cycles_per_second', cycles / seconds, 'cycles/s', True))
+        results.append(BenchmarkResult(f'cpu.{mode}.mips', cycles * instructions_per_cycle / seconds / 1e6, 'MIPS', True))
+    return results
+
+
+def benchmark_frames(frames: int, repeat: int) -> List[BenchmarkResult]:
+    """Emulator.step_frame, headless, drawing the background and sprites."""
+    emulator = _emulator()
+
+    def run():
+        for _ in range(frames):
+            emulator.step_frame()
+
+    return [BenchmarkResult('frames.headless.fps', frames / _best_time(run, repeat), 'frames/s', True)]
+
+
+def benchmark_opcodes(number: int, repeat: int) -> List[BenchmarkResult]:
+    """
+    Every registered handler called on its own, with 16-bit operands and HL
+    pointing into WRAM. PC, SP and HL are reset before every call so jumps,
+    pushes and pops stay in place, the reset is measured and subtracted.
+    """
+    cpu = _cpu()
+    logger = cpu._logger
+    state = cpu._state
+
+    def loop(handler, instruction):
+        for _ in range(number):
+            state.pc = 0x0100
+            state.SP = 0xDFF0
+            state.HL = 0xC000
+            handler(logger, cpu, instruction)
+
+    overhead = _best_time(lambda: loop(lambda *_: None, (0x00,)), repeat)
+    results = []
+    for prefix, table in (('', instruction_table), ('cb.', cb_instruction_table)):
+        for opcode, entry in sorted(table.items()):
+            if prefix:
+                instruction = (0xCB, opcode)
+            else:
+                instruction = (opcode, 0x00, 0xC0)[:1 + entry.operand_count]
+            seconds = _best_time(lambda: loop(entry.handler, instruction), repeat)
+            state._halted = False
+            results.append(BenchmarkResult(f'opcodes.{prefix}{opcode:02X}', max(seconds - overhead, 0) / number * 1e9, 'ns', False))
+    return results
+
+
+def benchmark_render(frames: int, repeat: int) -> List[BenchmarkResult]:
+    """Emulator._render_tilemap at the default scaling, without a window."""
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    import pygame
+
+    from pyboy.renderer import SCREEN_HEIGHT, SCREEN_WIDTH
+
+    emulator = _emulator()
+
+    pygame.display.init()
+    try:
+        screen = pygame.display.set_mode((SCREEN_WIDTH * emulator._scaling_factor, SCREEN_HEIGHT * emulator._scaling_factor))
+        emulator._frame_surface = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT), 0, screen)
+
+        def run():
+            for _ in range(frames):
+                emulator._render_tilemap(screen, emulator._cpu)
+
+        seconds = _best_time(run, repeat)
+    finally:
+        pygame.display.quit()
+    return [BenchmarkResult('render.tilemap', seconds / frames * 1e6, 'us', False)]
+
+
+def run_benchmarks(cycles: int = 2_000_000, frames: int = 60, opcode_calls: int = 2000, repeat: int = 5,
+                   only: Optional[Sequence[str]] = None) -> Dict:
+    """Runs the benchmarks named in only (all by default) and returns the report that is written as JSON."""
+    benchmarks = {
+        'cpu': lambda: benchmark_cpu(cycles, repeat),
+        'frames': lambda: benchmark_frames(frames, repeat),
+        'opcodes': lambda: benchmark_opcodes(opcode_calls, repeat),
+        'render': lambda: benchmark_render(frames, repeat),
+    }
+    results = []
+    for name in only or benchmarks:
+        results += benchmarks[name]()
+
+    return {
+        'pyboy': __version__,
+        'python': f'{platform.python_implementation()} {platform.python_version()}',
+        'machine': platform.machine(),
+        'results': {result.name: asdict(result) for result in results},
+    }
+
+
+def compare(report: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """
+    Returns a line for every result more than threshold (a fraction) worse
+    than in the baseline. Results missing from either are skipped.
+    """
+    regressions = []
+    for name, result in report['results'].items():
+        before = baseline['results'].get(name)
+        if before is None or not before['value'] or not result['value']:
+            continue
+        if result['higher_is_better']:
+            change = before['value'] / result['value'] - 1
+        else:
+            change = result['value'] / before['value'] - 1
+        if change > threshold:
+            regressions.append(f"{name}: {before['value']:.6g} -> {result['value']:.6g} {result['unit']} ({change:.0%} slower)")
+    return regressions
+
+
+def main(arguments: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.run')
+    parser.add_argument('-o', '--output', help='write the results to this JSON file')
+    parser.add_argument('-c', '--compare', metavar='BASELINE', help='JSON file from an earlier run to compare against')
+    parser.add_argument('-t', '--threshold', type=float, default=0.1, help='fraction slower than the baseline that counts as a regression')
+    parser.add_argument('-b', '--benchmark', action='append', choices=['cpu', 'frames', 'opcodes', 'render'], help='run only these')
+    parser.add_argument('--cycles', type=int, default=2_000_000)
+    parser.add_argument('--frames', type=int, default=60)
+    parser.add_argument('--opcode-calls', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=5)
+
+    arguments = parser.parse_args(arguments)
+
+    report = run_benchmarks(arguments.cycles, arguments.frames, arguments.opcode_calls, arguments.repeat, arguments.benchmark)
+    for name, result in report['results'].items():
+        if not name.startswith('opcodes.'):
+            print(f"{name:32} {result['value']:12.6g} {result['unit']}")
+
+    if arguments.output:
+        with open(arguments.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if arguments.compare:
+        with open(arguments.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, arguments.threshold)
+        for regression in regressions:
+            print(regression)
+        if regressions:
+            return 1
+        print(f'No regressions against {arguments.compare}')
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -9,6 +9,7 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('-r', '--rom-file', required=False, default='rtc3test.gb')
     parser.add_argument('-d', '--debug', required=False, action='store_true')
+    parser.add_argument('-u', '--unthrottled', required=False, action='store_true', help='run as fast as possible instead of in realtime')
 
     arguments = parser.parse_args()
 
@@ -28,7 +29,7 @@ if __name__ == '__main__':
 
     emulator = Emulator(logger, arguments.debug)
     emulator.load_rom_file(arguments.rom_file)
-    emulator.run()
+    emulator.run(arguments.unthrottled)
 
     """
     instruction_operand_count = {0x00: 0x0, 0xC3: 2, 0x21: 2, 0x47: 0, 0x11: 2, 0x0E: 1, 0x12:0, 0x1C: 0, 0x20: 1, 0x2A: 0, 0x14: 0}
@@ -0,0 +1,157 @@
+"""
+Runs many headless emulator instances across a pool of worker processes.
+
+    python -m pyboy.batch roms/*.gb --frames 600 --processes 8
+
+Each job is a ROM, optionally with a seed used to fill WRAM with random
+garbage (like real hardware at power on) and an input script. The ROMs are
+read once and handed to the workers through shared memory.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import random
+from dataclasses import asdict, dataclass, field
+from multiprocessing import Pool, shared_memory
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from pyboy.emulator import Emulator
+
+
+@dataclass
+class BatchJob:
+    rom: str
+    seed: Optional[int] = None
+    # Buttons to hold from a frame on, until the next entry, e.g. {60: ['start'], 70: []}
+    inputs: Dict[int, List[str]] = field(default_factory=dict)
+
+
+@dataclass
+class BatchResult:
+    rom: str
+    seed: Optional[int]
+    cycles: int = 0
+    state_hash: Optional[str] = None
+    registers: Optional[Dict[str, int]] = None
+    framebuffer: Optional[bytes] = None
+    error: Optional[str] = None
+
+
+# ROMs by shared memory name, attached once per worker process and kept open
+# for its life, so the emulators read them in place
+_worker_roms: Dict[str, Tuple[shared_memory.SharedMemory, memoryview]] = {}
+
+
+def _attach_rom(name: str, size: int) -> memoryview:
+    attached = _worker_roms.get(name)
+    if attached is None:
+        # Workers share the resource tracker of the parent, which owns and
+        # unlinks the block, the workers only need it mapped
+        block = shared_memory.SharedMemory(name=name)
+        attached = _worker_roms[name] = (block, block.buf[:size].toreadonly())
+    return attached[1]
+
+
+def _run_job(task: Tuple[BatchJob, str, int, Optional[int], Optional[int], bool]) -> BatchResult:
+    job, rom_name, rom_size, frames, cycles, with_framebuffer = task
+    result = BatchResult(job.rom, job.seed)
+
+    try:
+        emulator = Emulator(logging.getLogger(__name__), headless=True)
+        cpu = emulator._cpu
+        cpu.load_program(_attach_rom(rom_name, rom_size))
+
+        if job.seed is not None:
+            cpu._state.memory._ram[:] = random.Random(job.seed).randbytes(0x2000)
+
+        start = cpu._scheduler.cycles
+        if cycles is not None:
+            cpu.run_n_cycles(cycles)
+        else:
+            for frame in range(frames or 0):
+                if frame in job.inputs:
+                    emulator.set_buttons(job.inputs[frame])
+                emulator.step_frame()
+        result.cycles = cpu._scheduler.cycles - start
+
+        state = cpu._state
+        result.state_hash = hashlib.sha1(cpu.save_state()).hexdigest()
+        result.registers = {
+            'pc': state.pc, 'sp': state.SP, 'a': state.A, 'f': state.get_flags_byte(),
+            'b': state.B, 'c': state.C, 'd': state.D, 'e': state.E, 'h': state.H, 'l': state.L,
+        }
+        if with_framebuffer:
+            result.framebuffer = emulator.framebuffer.tobytes()
+    except Exception as e:
+        result.error = f'{type(e).__name__}: {e}'
+
+    return result
+
+
+def run_batch(
+    jobs: Sequence[BatchJob],
+    frames: Optional[int] = None,
+    cycles: Optional[int] = None,
+    framebuffers: bool = False,
+    processes: Optional[int] = None,
+) -> List[BatchResult]:
+    """
+    Runs every job headless for a budget of either frames or cycles and returns
+    the results in the same order as jobs. Input scripts only apply when
+    running frames.
+    """
+    if (frames is None) == (cycles is None):
+        raise Exception('Exactly one of frames and cycles must be given!')
+
+    blocks: Dict[str, shared_memory.SharedMemory] = {}
+    sizes: Dict[str, int] = {}
+    try:
+        for job in jobs:
+            if job.rom in blocks:
+                continue
+            with open(job.rom, 'rb') as f:
+                rom = f.read()
+            block = blocks[job.rom] = shared_memory.SharedMemory(create=True, size=max(len(rom), 1))
+            block.buf[:len(rom)] = rom
+            sizes[job.rom] = len(rom)
+
+        tasks = [(job, blocks[job.rom].name, sizes[job.rom], frames, cycles, framebuffers) for job in jobs]
+        with Pool(processes) as pool:
+            return pool.map(_run_job, tasks, chunksize=1)
+    finally:
+        for block in blocks.values():
+            block.close()
+            block.unlink()
+
+
+def main(arguments: Optional[Sequence[str]] = None):
+    parser = argparse.ArgumentParser(prog='python -m pyboy.batch')
+    parser.add_argument('roms', nargs='+')
+    budget = parser.add_mutually_exclusive_group(required=True)
+    budget.add_argument('-f', '--frames', type=int)
+    budget.add_argument('-c', '--cycles', type=int)
+    parser.add_argument('-s', '--seeds', type=int, default=0, help='run every ROM once per seed 0..N-1 instead of once without a seed')
+    parser.add_argument('-i', '--inputs', help='JSON file with an input script, {"frame": ["button", ...]}')
+    parser.add_argument('-p', '--processes', type=int)
+    parser.add_argument('--framebuffers', action='store_true', help='include the final framebuffers, hex encoded')
+
+    arguments = parser.parse_args(arguments)
+
+    inputs: Dict[int, List[str]] = {}
+    if arguments.inputs:
+        with open(arguments.inputs) as f:
+            inputs = {int(frame): buttons for frame, buttons in json.load(f).items()}
+
+    seeds = list(range(arguments.seeds)) if arguments.seeds else [None]
+    jobs = [BatchJob(rom, seed, inputs) for rom in arguments.roms for seed in seeds]
+
+    for result in run_batch(jobs, arguments.frames, arguments.cycles, arguments.framebuffers, arguments.processes):
+        output = asdict(result)
+        if result.framebuffer is not None:
+            output['framebuffer'] = result.framebuffer.hex()
+        print(json.dumps(output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,481 @@
+"""
+Compiles basic blocks of ROM code into Python functions.
+
+A block starts at a PC and follows straight-line code up to and including
+the first instruction that changes the control flow. The handlers of the
+instructions in it are inlined into a single generated function, with their
+CPUState register accesses rewritten to local variables that are loaded once
+on entry and written back once on exit. Handlers that can't be rewritten
+(they pass the state or CPU on to other functions) are called as usual,
+with the registers written back before and reloaded after.
+
+The generated function keeps the interpreter's timing exactly: it counts
+cycles per instruction, publishes them to the scheduler before any memory
+access and stops after any instruction that reaches the next deadline, just
+like the run loop does.
+"""
+import ast
+import copy
+import inspect
+import textwrap
+from typing import Callable, Dict, List, Optional
+
+from pyboy import opcodes
+from pyboy.opcodes import decode_instruction, handle_unknown_opcode
+
+# Number of times a PC has to be reached before its block is compiled
+BLOCK_COMPILE_THRESHOLD = 16
+
+# Longest block, in instructions
+MAX_BLOCK_LENGTH = 32
+
+# Instructions that end a block
+BLOCK_TERMINATORS = frozenset([
+    0xC3, 0xC2, 0xCA, 0xD2, 0xDA, 0xE9,              # JP
+    0x18, 0x20, 0x28, 0x30, 0x38,                    # JR
+    0xCD, 0xC4, 0xCC, 0xD4, 0xDC,                    # CALL
+    0xC9, 0xC0, 0xC8, 0xD0, 0xD8, 0xD9,              # RET, RETI
+    0xC7, 0xCF, 0xD7, 0xDF, 0xE7, 0xEF, 0xF7, 0xFF,  # RST
+    0x76, 0x10, 0xFB,                                # HALT, STOP, EI
+])
+
+# Instructions that only read memory and change nothing but registers and
+# the PC. A block made of only these that jumps back to its own start is a
+# polling loop, waiting for an event or interrupt to change memory.
+IDLE_LOOP_OPCODES = frozenset([
+    0x00, 0x07, 0x0F, 0x17, 0x1F, 0x2F, 0x37, 0x3F,              # NOP, rotates of A, CPL, SCF, CCF
+    0x03, 0x0B, 0x13, 0x1B, 0x23, 0x2B, 0x33, 0x3B,              # INC/DEC rr
+    0x04, 0x05, 0x0C, 0x0D, 0x14, 0x15, 0x1C, 0x1D, 0x24, 0x25,  # INC/DEC r
+    0x2C, 0x2D, 0x3C, 0x3D,
+    0x06, 0x0E, 0x16, 0x1E, 0x26, 0x2E, 0x3E,                    # LD r,n
+    0x0A, 0x1A, 0x2A, 0x3A, 0xF0, 0xF2, 0xFA,                    # LD A,(rr), LDH A,(n), LD A,(C), LD A,(nn)
+    *[opcode for opcode in range(0x40, 0x80) if not 0x70 <= opcode <= 0x77],  # LD r,r and LD r,(HL)
+    *range(0x80, 0xC0),                                          # ALU A,r
+    0xC6, 0xCE, 0xD6, 0xDE, 0xE6, 0xEE, 0xF6, 0xFE,              # ALU A,n
+    0x18, 0x20, 0x28, 0x30, 0x38, 0xC3, 0xC2, 0xCA, 0xD2, 0xDA,  # JR, JP
+])
+# Reads through a register pair, by opcode
+POINTER_READS = {
+    0x0A: 'BC', 0x1A: 'DE', 0x2A: 'HL', 0x3A: 'HL', 0xF2: 'C',
+    **{opcode: 'HL' for opcode in range(0x46, 0xC0, 8) if not 0x70 <= opcode <= 0x77},
+}
+# I/O registers computed from the cycle count when read, which polling them
+# would see change without any event: DIV, TIMA and the mode in STAT
+CYCLE_DEPENDENT_ADDRESSES = frozenset([0xFF04, 0xFF05, 0xFF41])
+
+# CPUState attributes kept in locals, by attribute and by property
+REGISTER_LOCALS = {
+    '_a': '_r_a', '_b': '_r_b', '_c': '_r_c', '_d': '_r_d', '_e': '_r_e', '_h': '_r_h', '_l': '_r_l',
+    '_sp': '_r_sp', 'zf': '_r_zf', 'nf': '_r_nf', 'hf': '_r_hf', 'cf': '_r_cf',
+}
+MASKED_PROPERTIES = {'A': '_a', 'B': '_b', 'C': '_c', 'D': '_d', 'E': '_e', 'H': '_h', 'L': '_l'}
+PAIR_PROPERTIES = {'BC': ('_b', '_c'), 'DE': ('_d', '_e'), 'HL': ('_h', '_l')}
+# The SP setter doesn't mask its value
+RAW_PROPERTIES = {'SP': '_sp'}
+# CPUState attributes that are left on the state
+STATE_ATTRIBUTES = frozenset(['ime', '_halted', '_delay_enable_ime', 'enable_interrupts_after_next_instruction'])
+
+
+class CannotInline(Exception):
+    pass
+
+
+class _HandlerInliner(ast.NodeTransformer):
+    """Rewrites the body of a handler for one decoded instruction to work on block locals."""
+
+    def __init__(self, instruction: tuple):
+        self._instruction = instruction
+        self._state_aliases = set()
+        self.registers = set()
+        self.accesses_memory = False
+        self.uses_scheduler = False
+        self.uses_logger = False
+        self.uses_pc = False
+        self.returns = False
+
+    def inline(self, function: ast.FunctionDef) -> List[ast.stmt]:
+        if [argument.arg for argument in function.args.args] != ['logger', 'cpu', 'instruction']:
+            raise CannotInline()
+        if not _returns_last(function.body):
+            raise CannotInline()
+
+        body = []
+        for statement in function.body:
+            if (isinstance(statement, ast.Assign) and len(statement.targets) == 1
+                    and isinstance(statement.targets[0], ast.Name) and self._is_state(statement.value)):
+                self._state_aliases.add(statement.targets[0].id)
+                continue
+            if isinstance(statement, ast.Expr) and isinstance(statement.value, ast.Constant):
+                # Docstring
+                continue
+
+            # The tree is cached per handler, rewrite a copy of it
+            result = self.visit(copy.deepcopy(statement))
+            body.extend(result if isinstance(result, list) else [result])
+        return body
+
+    def _is_state(self, node: ast.AST) -> bool:
+        if isinstance(node, ast.Name):
+            return node.id in self._state_aliases
+        return (isinstance(node, ast.Attribute) and node.attr == '_state'
+                and isinstance(node.value, ast.Name) and node.value.id == 'cpu')
+
+    def _register(self, attribute: str) -> ast.Name:
+        self.registers.add(attribute)
+        return ast.Name(REGISTER_LOCALS[attribute], ast.Load())
+
+    def _load(self, attribute: str) -> ast.expr:
+        if attribute in REGISTER_LOCALS:
+            return self._register(attribute)
+        if attribute in MASKED_PROPERTIES:
+            return self._register(MASKED_PROPERTIES[attribute])
+        if attribute in RAW_PROPERTIES:
+            return self._register(RAW_PROPERTIES[attribute])
+        if attribute in PAIR_PROPERTIES:
+            high, low = PAIR_PROPERTIES[attribute]
+            return ast.BinOp(ast.BinOp(self._register(high), ast.LShift(), ast.Constant(8)), ast.BitOr(), self._register(low))
+        if attribute == 'pc':
+            self.uses_pc = True
+            return ast.Name('_r_pc', ast.Load())
+        if attribute in STATE_ATTRIBUTES:
+            return ast.Attribute(ast.Name('state', ast.Load()), attribute, ast.Load())
+        raise CannotInline()
+
+    def _store(self, attribute: str, value: ast.expr) -> List[ast.stmt]:
+        def assign(name: str, value: ast.expr) -> ast.Assign:
+            return ast.Assign([ast.Name(name, ast.Store())], value)
+
+        def masked(value: ast.expr, mask: int) -> ast.expr:
+            return ast.BinOp(value, ast.BitAnd(), ast.Constant(mask))
+
+        if attribute in REGISTER_LOCALS or attribute in RAW_PROPERTIES:
+            attribute = RAW_PROPERTIES.get(attribute, attribute)
+            self._register(attribute)
+            return [assign(REGISTER_LOCALS[attribute], value)]
+        if attribute in MASKED_PROPERTIES:
+            attribute = MASKED_PROPERTIES[attribute]
+            self._register(attribute)
+            if not (isinstance(value, ast.Name) and value.id in REGISTER_LOCALS.values() and value.id != '_r_sp'):
+                value = masked(value, 0xFF)
+            return [assign(REGISTER_LOCALS[attribute], value)]
+        if attribute in PAIR_PROPERTIES:
+            high, low = PAIR_PROPERTIES[attribute]
+            self._register(high)
+            self._register(low)
+            return [
+                assign('_t', masked(value, 0xFFFF)),
+                assign(REGISTER_LOCALS[high], ast.BinOp(ast.Name('_t', ast.Load()), ast.RShift(), ast.Constant(8))),
+                assign(REGISTER_LOCALS[low], masked(ast.Name('_t', ast.Load()), 0xFF)),
+            ]
+        if attribute == 'pc':
+            self.uses_pc = True
+            return [assign('_r_pc', value)]
+        if attribute in STATE_ATTRIBUTES:
+            return [ast.Assign([ast.Attribute(ast.Name('state', ast.Load()), attribute, ast.Store())], value)]
+        raise CannotInline()
+
+    def _state_target(self, targets: List[ast.expr]) -> Optional[str]:
+        if len(targets) != 1:
+            if any(isinstance(target, ast.Attribute) for target in targets):
+                raise CannotInline()
+            return None
+
+        target = targets[0]
+        if isinstance(target, ast.Attribute) and self._is_state(target.value):
+            return target.attr
+        return None
+
+    def visit_Assign(self, node: ast.Assign):
+        attribute = self._state_target(node.targets)
+        if attribute is None:
+            return self.generic_visit(node)
+        return self._store(attribute, self.visit(node.value))
+
+    def visit_AugAssign(self, node: ast.AugAssign):
+        attribute = self._state_target([node.target])
+        if attribute is None:
+            return self.generic_visit(node)
+        return self._store(attribute, ast.BinOp(self._load(attribute), node.op, self.visit(node.value)))
+
+    def visit_Attribute(self, node: ast.Attribute):
+        if self._is_state(node.value):
+            if node.attr == 'memory':
+                raise CannotInline()
+            return self._load(node.attr)
+
+        # state.memory.read / state.memory.write
+        if (isinstance(node.value, ast.Attribute) and node.value.attr == 'memory'
+                and self._is_state(node.value.value) and node.attr in ('read', 'write')):
+            self.accesses_memory = True
+            return ast.Name('_' + node.attr, ast.Load())
+
+        if isinstance(node.value, ast.Name) and node.value.id == 'cpu':
+            if node.attr == '_scheduler':
+                self.uses_scheduler = True
+                return ast.Name('scheduler', ast.Load())
+            raise CannotInline()
+
+        return self.generic_visit(node)
+
+    def visit_Subscript(self, node: ast.Subscript):
+        if isinstance(node.value, ast.Name) and node.value.id == 'instruction':
+            if (isinstance(node.slice, ast.Constant) and isinstance(node.slice.value, int)
+                    and -len(self._instruction) <= node.slice.value < len(self._instruction)):
+                return ast.Constant(self._instruction[node.slice.value])
+            raise CannotInline()
+        return self.generic_visit(node)
+
+    def visit_Name(self, node: ast.Name):
+        if node.id in ('cpu', 'instruction') or node.id in self._state_aliases or node.id.startswith('_'):
+            raise CannotInline()
+        if node.id == 'logger':
+            self.uses_logger = True
+        return node
+
+    def visit_Return(self, node: ast.Return):
+        # A cycle count, only ever the last thing a handler does (see _returns_last)
+        self.returns = True
+        value = self.visit(node.value) if node.value is not None else ast.Constant(None)
+        return ast.Assign([ast.Name('_returned', ast.Store())], value)
+
+    def _unsupported(self, node):
+        raise CannotInline()
+
+    visit_Yield = visit_YieldFrom = visit_Global = visit_Nonlocal = _unsupported
+    visit_FunctionDef = visit_AsyncFunctionDef = visit_ClassDef = visit_Lambda = _unsupported
+    visit_AnnAssign = visit_NamedExpr = _unsupported
+
+
+def _returns_last(body: List[ast.stmt]) -> bool:
+    """Checks that nothing in body can run after a return statement in it."""
+    for index, statement in enumerate(body):
+        if index == len(body) - 1:
+            if isinstance(statement, ast.If):
+                return _returns_last(statement.body) and _returns_last(statement.orelse)
+            if isinstance(statement, ast.Return):
+                return True
+        if any(isinstance(node, ast.Return) for node in ast.walk(statement)):
+            return False
+    return True
+
+
+_handler_trees: Dict[Callable, Optional[ast.FunctionDef]] = {}
+
+
+def _handler_tree(handler: Callable) -> Optional[ast.FunctionDef]:
+    if handler not in _handler_trees:
+        try:
+            source = getattr(handler, 'source', None) or inspect.getsource(handler)
+            tree = ast.parse(textwrap.dedent(source)).body[0]
+            _handler_trees[handler] = tree if isinstance(tree, ast.FunctionDef) else None
+        except (OSError, TypeError, SyntaxError):
+            _handler_trees[handler] = None
+    return _handler_trees[handler]
+
+
+_inlined: Dict[tuple, Optional[_HandlerInliner]] = {}
+
+
+def _inline(handler: Callable, instruction: tuple) -> Optional[_HandlerInliner]:
+    key = (handler, instruction)
+    if key not in _inlined:
+        _inlined[key] = _inline_uncached(handler, instruction)
+    return _inlined[key]
+
+
+def _inline_uncached(handler: Callable, instruction: tuple) -> Optional[_HandlerInliner]:
+    tree = _handler_tree(handler)
+    if tree is None or not hasattr(ast, 'unparse'):
+        # ast.unparse is new in Python 3.9, on 3.8 blocks call every handler
+        return None
+
+    inliner = _HandlerInliner(instruction)
+    try:
+        body = inliner.inline(tree)
+    except CannotInline:
+        return None
+
+    inliner.lines = ast.unparse(ast.fix_missing_locations(ast.Module(body, []))).splitlines() if body else []
+    return inliner
+
+
+def _indent(lines: List[str], level: int) -> List[str]:
+    return [' ' * (4 * level) + line for line in lines]
+
+
+def _idle_loop_pointers(instructions: List[tuple], pc: int) -> Optional[List[str]]:
+    """
+    Returns the register pairs the block reads memory through if it is a
+    polling loop, a block of IDLE_LOOP_OPCODES ending in a jump back to pc,
+    otherwise None.
+    """
+    handler, instruction, next_pc, _ = instructions[-1]
+    if instruction[0] in (0x18, 0x20, 0x28, 0x30, 0x38):
+        target = (next_pc + (instruction[1] ^ 0x80) - 0x80) & 0xFFFF
+    elif instruction[0] in (0xC3, 0xC2, 0xCA, 0xD2, 0xDA):
+        target = instruction[1] | (instruction[2] << 8)
+    else:
+        return None
+    if target != pc:
+        return None
+
+    pointers = []
+    for handler, instruction, next_pc, _ in instructions:
+        opcode = instruction[0]
+        if opcode == 0xCB:
+            # Only BIT b,r and BIT b,(HL)
+            if not 0x40 <= instruction[1] < 0x80:
+                return None
+            if instruction[1] & 0x07 == 0x06:
+                pointers.append('HL')
+        elif opcode not in IDLE_LOOP_OPCODES:
+            return None
+        elif opcode == 0xF0 and 0xFF00 | instruction[1] in CYCLE_DEPENDENT_ADDRESSES:
+            return None
+        elif opcode == 0xFA and instruction[1] | (instruction[2] << 8) in CYCLE_DEPENDENT_ADDRESSES:
+            return None
+        elif opcode in POINTER_READS:
+            pointers.append(POINTER_READS[opcode])
+    return sorted(set(pointers))
+
+
+def _idle_loop_lines(pc: int, pointers: List[str]) -> List[str]:
+    """
+    Code run after a polling loop block. If an iteration came back to pc
+    with every register as it was, nothing but an event can make the next
+    iterations do anything else, so they are skipped up to the last one
+    that would finish before the deadline. The rest is run as usual.
+    """
+    addresses = {
+        'BC': '(_r_b << 8) | _r_c', 'DE': '(_r_d << 8) | _r_e', 'HL': '(_r_h << 8) | _r_l', 'C': '0xFF00 | _r_c',
+    }
+    entry = ', '.join(REGISTER_LOCALS[attribute] for attribute in sorted(REGISTER_LOCALS))
+    conditions = [f'not _stopped and _cycles < _limit and _next == 0x{pc:04X} and ({entry}) == _entry']
+    conditions += [f'({addresses[pointer]}) not in CYCLE_DEPENDENT_ADDRESSES' for pointer in pointers]
+    return [
+        'if ' + ' and '.join(conditions) + ':',
+        '    _period = _cycles - _entry_cycles',
+        '    _cycles += (_limit - 1 - _cycles) // _period * _period',
+    ]
+
+
+def compile_block(memory, pc: int) -> Optional[Callable]:
+    """
+    Compiles the basic block starting at pc into a function
+    block(cpu, state, scheduler, end) that runs it, or returns None if there
+    is nothing to compile at pc. The block returns True if it stopped before
+    its last instruction because a deadline or end was reached.
+
+    The block stays within the 16 KiB ROM region pc is in, so that it only
+    depends on a single ROM bank.
+    """
+    region_end = (pc & 0xC000) + 0x4000
+    namespace = dict(vars(opcodes))
+    namespace['CYCLE_DEPENDENT_ADDRESSES'] = CYCLE_DEPENDENT_ADDRESSES
+    instructions = []
+
+    address = pc
+    while len(instructions) < MAX_BLOCK_LENGTH and address < region_end:
+        handler, instruction, _, length, cycle_count = decode_instruction(memory, address)
+        if handler is handle_unknown_opcode or address + length > region_end:
+            break
+
+        instructions.append((handler, instruction, address + length, cycle_count))
+        address += length
+        if instruction[0] in BLOCK_TERMINATORS:
+            break
+
+    if not instructions:
+        return None
+
+    pointers = _idle_loop_pointers(instructions, pc)
+
+    registers = set()
+    needs_memory = needs_logger = False
+    body: List[str] = []
+    for index, (handler, instruction, next_pc, cycle_count) in enumerate(instructions):
+        body.append(f'# {next_pc - (len(instruction)):04X}: ' + ' '.join(f'{byte:02X}' for byte in instruction))
+
+        inliner = _inline(handler, instruction)
+        if inliner is not None:
+            registers |= inliner.registers
+            needs_memory |= inliner.accesses_memory
+            needs_logger |= inliner.uses_logger
+            side_effects = inliner.accesses_memory or inliner.uses_scheduler
+
+            if inliner.uses_pc:
+                body.append(f'_r_pc = 0x{next_pc:04X}')
+            if side_effects:
+                body.append('scheduler.cycles = _cycles')
+            if inliner.returns:
+                body.append('_returned = None')
+            body.extend(inliner.lines)
+            body.append(f'_cycles += _returned or {cycle_count}' if inliner.returns else f'_cycles += {cycle_count}')
+            if side_effects:
+                body.append('_limit = min(scheduler.next_deadline, end)')
+            next_pc_source = '_r_pc' if inliner.uses_pc else f'0x{next_pc:04X}'
+        else:
+            namespace[f'_handler_{index}'] = handler
+            namespace[f'_instruction_{index}'] = instruction
+            needs_logger = True
+            body.append('{writeback}')
+            body.append(f'state.pc = 0x{next_pc:04X}')
+            body.append('scheduler.cycles = _cycles')
+            body.append(f'_cycles += _handler_{index}(logger, cpu, _instruction_{index}) or {cycle_count}')
+            body.append('{reload}')
+            body.append('_limit = min(scheduler.next_deadline, end)')
+            next_pc_source = 'state.pc'
+
+        if index < len(instructions) - 1:
+            body.append('if _cycles >= _limit:')
+            body.append(f'    _next = {next_pc_source}')
+            body.append('    _stopped = True')
+            body.append('    break')
+        else:
+            body.append(f'_next = {next_pc_source}')
+            body.append('break')
+
+    idle_loop = []
+    if pointers is not None:
+        # Keep every register in a local so the state at the start and end of
+        # an iteration can be compared, see _idle_loop_lines
+        registers |= set(REGISTER_LOCALS)
+        idle_loop = _idle_loop_lines(pc, pointers)
+
+    locals_ = sorted(registers)
+    reload = [f'{REGISTER_LOCALS[attribute]} = state.{attribute}' for attribute in locals_]
+    writeback = [f'state.{attribute} = {REGISTER_LOCALS[attribute]}' for attribute in locals_]
+
+    lines = []
+    for line in body:
+        if line == '{writeback}':
+            lines.extend(writeback)
+        elif line == '{reload}':
+            lines.extend(reload)
+        else:
+            lines.append(line)
+
+    name = f'block_{pc:04x}'
+    source = '\n'.join([
+        f'def {name}(cpu, state, scheduler, end):',
+        *_indent(['logger = cpu._logger'] if needs_logger else [], 1),
+        *_indent(['_read = state.memory.read', '_write = state.memory.write'] if needs_memory else [], 1),
+        *_indent(reload, 1),
+        '    _cycles = scheduler.cycles',
+        '    _limit = min(scheduler.next_deadline, end)',
+        '    _stopped = False',
+        *_indent(['_entry = (' + ', '.join(REGISTER_LOCALS[attribute] for attribute in locals_) + ')',
+                  '_entry_cycles = _cycles'] if idle_loop else [], 1),
+        '    while True:',
+        *_indent(lines, 2),
+        *_indent(idle_loop, 1),
+        *_indent(writeback, 1),
+        '    state.pc = _next',
+        '    scheduler.cycles = _cycles',
+        '    return _stopped',
+    ])
+
+    exec(compile(source, f'<{name}>', 'exec'), namespace)
+    block = namespace[name]
+    block.source = source
+    return block
@@ -0,0 +1,376 @@
+"""
+Cartridges and their memory bank controllers (MBCs), picked by the
+cartridge type in the header at 0x147.
+
+The ROM is split into 16 KiB banks and the cartridge RAM into 8 KiB banks
+once, as memoryviews, up front. Writes to the MBC registers only pick which
+of them are mapped at 0x0000-0x3FFF, 0x4000-0x7FFF and 0xA000-0xBFFF, which
+Memory then points its page tables at; nothing is copied and reads never do
+any bank arithmetic.
+
+Battery-backed RAM can be kept in a save file, which is mapped into memory
+so that writes to the RAM go straight to it. The mapping is only flushed to
+disk from flush, which Emulator calls once per frame, and only when the
+RAM has been written to since the last flush. Memory catches the first
+write after a flush in a write handler and maps the RAM directly again
+from then on, see Memory._write_cartridge_ram.
+
+The MBC3 clock isn't ticked either, its time follows from the cycle count
+whenever it is latched or written, see RTC.
+"""
+import mmap
+import os
+from typing import Dict, List, Optional, Tuple, Type, Union
+
+from pyboy.rom import RomData
+from pyboy.scheduler import CPU_FREQUENCY, Scheduler
+
+ROM_BANK_SIZE = 0x4000
+RAM_BANK_SIZE = 0x2000
+
+# RAM size code in the header at 0x149 -> size in bytes
+RAM_SIZES = {0x00: 0, 0x01: 0x800, 0x02: 0x2000, 0x03: 0x8000, 0x04: 0x20000, 0x05: 0x10000}
+
+# Each clock counter (seconds, minutes, hours, days) carries into the next
+# when it reaches its modulus. A value written out of range counts on up to
+# the limit of its bits instead and wraps to 0 without carrying. The day
+# counter is 9 bits and sets the carry flag when it overflows
+RTC_COUNTERS = ((60, 0x40), (60, 0x40), (24, 0x20), (512, 0x200))
+# Bits of the registers that are kept when written
+RTC_MASKS = (0x3F, 0x3F, 0x1F, 0xFF, 0xC1)
+
+
+class RTC:
+    """
+    The MBC3 real-time clock, registers 0x08-0x0C: seconds, minutes, hours,
+    the low 8 bits of the day counter and DH, with bit 8 of the day counter,
+    halt in bit 6 and the day carry in bit 7.
+
+    The counters are kept as they were at the cycle count in _base_cycle,
+    with the cycles into the current second in _fraction. They are only
+    brought up to date when latched or written, unless the clock is halted.
+    """
+
+    def __init__(self, scheduler: Scheduler):
+        self._scheduler = scheduler
+        self._counters = [0, 0, 0, 0]
+        self._fraction = 0
+        self._base_cycle = scheduler.cycles
+        self.halted = False
+        self.carry = False
+        self.latched = bytearray(5)
+        self._latch = 0xFF
+
+    @property
+    def state(self) -> Tuple[bytes, int, bytes, int]:
+        """The clock as (registers, cycles into the second, latched registers, last latch write), for save states."""
+        registers = bytes(self._registers())
+        return registers, self._fraction, bytes(self.latched), self._latch
+
+    @state.setter
+    def state(self, state: Tuple[bytes, int, bytes, int]):
+        registers, self._fraction, latched, self._latch = state
+        seconds, minutes, hours, days, dh = registers
+        self._counters = [seconds, minutes, hours, days | (dh & 0x01) << 8]
+        self._base_cycle = self._scheduler.cycles
+        self.halted = bool(dh & 0x40)
+        self.carry = bool(dh & 0x80)
+        self.latched[:] = latched
+
+    def advance(self, seconds: float):
+        """Moves the time forward by seconds without running the CPU, unless the clock is halted."""
+        self._update()
+        if not self.halted:
+            self._tick(int(seconds * CPU_FREQUENCY))
+
+    def write_latch(self, value: int):
+        # Writing 0 and then 1 copies the time into the registers that are read
+        if self._latch == 0x00 and value == 0x01:
+            self.latched[:] = self._registers()
+        self._latch = value
+
+    def read(self, register: int) -> int:
+        return self.latched[register - 0x08]
+
+    def write(self, register: int, value: int):
+        self._update()
+        index = register - 0x08
+        value &= RTC_MASKS[index]
+        if register == 0x08:
+            # Writing the seconds also resets the part of a second that has passed
+            self._fraction = 0
+        if register == 0x0B:
+            self._counters[3] = self._counters[3] & 0x100 | value
+        elif register == 0x0C:
+            self._counters[3] = self._counters[3] & 0xFF | (value & 0x01) << 8
+            self.halted = bool(value & 0x40)
+            self.carry = bool(value & 0x80)
+        else:
+            self._counters[index] = value
+        self.latched[index] = value
+
+    def _update(self):
+        if not self.halted:
+            self._tick(self._scheduler.cycles - self._base_cycle)
+        self._base_cycle = self._scheduler.cycles
+
+    def _tick(self, cycles: int):
+        count, self._fraction = divmod(self._fraction + cycles, CPU_FREQUENCY)
+        counters = self._counters
+        for index, (modulus, limit) in enumerate(RTC_COUNTERS):
+            if not count:
+                return
+            value = counters[index]
+            if value >= modulus:
+                if count < limit - value:
+                    counters[index] = value + count
+                    return
+                count -= limit - value
+                value = 0
+            counters[index], count = (value + count) % modulus, (value + count) // modulus
+        if count:
+            # The carry stays set until cleared
+            self.carry = True
+
+    def _registers(self) -> bytearray:
+        self._update()
+        seconds, minutes, hours, days = self._counters
+        return bytearray((seconds, minutes, hours, days & 0xFF, days >> 8 | self.halted << 6 | self.carry << 7))
+
+
+class Cartridge:
+    """
+    A cartridge without an MBC, 32 KiB of ROM and RAM that's always mapped.
+
+    rom_bank0, rom_bank and ram_bank are the banks mapped at 0x0000-0x3FFF,
+    0x4000-0x7FFF and 0xA000-0xBFFF, ram_bank is None while the RAM is
+    disabled or there is none, in which case reads and writes go through
+    read_ram and write_ram instead. MBCs keep their registers in ram_enabled,
+    bank1, bank2 and mode, and derive the banks from them in _update_banks.
+    """
+    rom: RomData
+    ram: Union[bytearray, mmap.mmap]
+    rom_banks: List[memoryview]
+    ram_banks: List[memoryview]
+    rom_bank0: int
+    rom_bank: int
+    ram_bank: Optional[int]
+
+    def __init__(self, rom: RomData, ram_size: int = 0, battery: bool = False, save_file: Optional[str] = None):
+        self.rom = rom
+        self.battery = battery
+        # Anything smaller than a bank still gets a whole bank of RAM
+        ram_size = max(ram_size, RAM_BANK_SIZE) if ram_size else 0
+        if battery and ram_size and save_file is not None:
+            self.ram = _map_save_file(save_file, ram_size)
+        else:
+            self.ram = bytearray(ram_size)
+        self.has_save_file = isinstance(self.ram, mmap.mmap)
+
+        rom_view = memoryview(rom)
+        self.rom_banks = [rom_view[start:start + ROM_BANK_SIZE]
+                          for start in range(0, max(len(rom), 2 * ROM_BANK_SIZE), ROM_BANK_SIZE)]
+        self._ram_view = memoryview(self.ram)
+        self.ram_banks = [self._ram_view[start:start + RAM_BANK_SIZE] for start in range(0, len(self.ram), RAM_BANK_SIZE)]
+
+        self.ram_enabled = False
+        self.bank1 = 1
+        self.bank2 = 0
+        self.mode = 0
+        self._update_banks()
+        # The clock of cartridges that have one, see RTC
+        self.rtc: Optional[RTC] = None
+        # Whether the RAM has been written to since the last flush, only
+        # tracked for RAM kept in a save file
+        self.dirty = False
+
+    @property
+    def registers(self) -> Tuple[int, int, int, int]:
+        """The MBC registers as (ram_enabled, bank1, bank2, mode), for save states."""
+        return int(self.ram_enabled), self.bank1, self.bank2, self.mode
+
+    @registers.setter
+    def registers(self, registers: Tuple[int, int, int, int]):
+        ram_enabled, self.bank1, self.bank2, self.mode = registers
+        self.ram_enabled = bool(ram_enabled)
+        self._update_banks()
+
+    def write(self, address: int, value: int):
+        """Handles a write to 0x0000-0x7FFF, where the MBC registers are."""
+        pass
+
+    def read_ram(self, address: int) -> int:
+        """Handles a read from 0xA000-0xBFFF while no RAM bank is mapped."""
+        return 0xFF
+
+    def write_ram(self, address: int, value: int):
+        """Handles a write to 0xA000-0xBFFF while no RAM bank is mapped."""
+        pass
+
+    def flush(self):
+        """Writes the RAM to the save file, if it has been written to since the last flush."""
+        if self.dirty:
+            self.ram.flush()
+            self.dirty = False
+
+    def close(self):
+        """Flushes and closes the save file, if there is one. The RAM can't be used after."""
+        if self.has_save_file:
+            self.flush()
+            for bank in self.ram_banks:
+                bank.release()
+            self._ram_view.release()
+            self.ram.close()
+
+    def _enable_ram(self, value: int):
+        self.ram_enabled = value & 0x0F == 0x0A
+
+    def _update_banks(self):
+        self.rom_bank0 = 0
+        self.rom_bank = 1
+        self.ram_bank = 0 if self.ram_banks else None
+
+    def _ram_bank(self, bank: int) -> Optional[int]:
+        if not self.ram_enabled or not self.ram_banks:
+            return None
+        return bank % len(self.ram_banks)
+
+
+class MBC1(Cartridge):
+    """
+    Up to 2 MiB of ROM and 32 KiB of RAM. bank1 holds the low 5 bits of
+    the ROM bank and bank2 two more bits, which go to the RAM bank and the
+    bank at 0x0000 instead in mode 1.
+    """
+
+    def write(self, address: int, value: int):
+        if address < 0x2000:
+            self._enable_ram(value)
+        elif address < 0x4000:
+            # Bank 0 can't be selected at 0x4000, it becomes bank 1
+            self.bank1 = value & 0x1F or 1
+        elif address < 0x6000:
+            self.bank2 = value & 0x03
+        else:
+            self.mode = value & 0x01
+        self._update_banks()
+
+    def _update_banks(self):
+        banks = len(self.rom_banks)
+        self.rom_bank0 = (self.bank2 << 5) % banks if self.mode else 0
+        self.rom_bank = ((self.bank2 << 5) | self.bank1) % banks
+        self.ram_bank = self._ram_bank(self.bank2 if self.mode else 0)
+
+
+class MBC3(Cartridge):
+    """
+    Up to 2 MiB of ROM and 32 KiB of RAM. bank1 is the ROM bank, 1-127, and
+    bank2 selects the RAM bank, 0-3, or a clock register, 0x08-0x0C, at
+    0xA000-0xBFFF.
+    """
+
+    def write(self, address: int, value: int):
+        if address < 0x2000:
+            self._enable_ram(value)
+        elif address < 0x4000:
+            self.bank1 = value & 0x7F or 1
+        elif address < 0x6000:
+            self.bank2 = value & 0x0F
+        else:
+            if self.rtc is not None:
+                self.rtc.write_latch(value)
+            return
+        self._update_banks()
+
+    def read_ram(self, address: int) -> int:
+        if self.ram_enabled and self.rtc is not None and 0x08 <= self.bank2 <= 0x0C:
+            return self.rtc.read(self.bank2)
+        return 0xFF
+
+    def write_ram(self, address: int, value: int):
+        if self.ram_enabled and self.rtc is not None and 0x08 <= self.bank2 <= 0x0C:
+            self.rtc.write(self.bank2, value)
+
+    def _update_banks(self):
+        self.rom_bank0 = 0
+        self.rom_bank = self.bank1 % len(self.rom_banks)
+        self.ram_bank = self._ram_bank(self.bank2) if self.bank2 < 0x08 else None
+
+
+class MBC5(Cartridge):
+    """
+    Up to 8 MiB of ROM and 128 KiB of RAM. bank1 is the 9 bit ROM bank, where
+    bank 0 can be mapped at 0x4000 as well, and bank2 the RAM bank.
+    """
+
+    def write(self, address: int, value: int):
+        if address < 0x2000:
+            self._enable_ram(value)
+        elif address < 0x3000:
+            self.bank1 = (self.bank1 & 0x100) | value
+        elif address < 0x4000:
+            self.bank1 = (self.bank1 & 0xFF) | ((value & 0x01) << 8)
+        elif address < 0x6000:
+            self.bank2 = value & 0x0F
+        else:
+            return
+        self._update_banks()
+
+    def _update_banks(self):
+        self.rom_bank0 = 0
+        self.rom_bank = self.bank1 % len(self.rom_banks)
+        self.ram_bank = self._ram_bank(self.bank2)
+
+
+# Cartridge type at 0x147 -> MBC, whether it has RAM, whether that RAM has a
+# battery and whether it has a clock
+CARTRIDGE_TYPES: Dict[int, Tuple[Type[Cartridge], bool, bool, bool]] = {
+    0x00: (Cartridge, False, False, False),
+    0x01: (MBC1, False, False, False),
+    0x02: (MBC1, True, False, False),
+    0x03: (MBC1, True, True, False),
+    0x08: (Cartridge, True, False, False),
+    0x09: (Cartridge, True, True, False),
+    0x0F: (MBC3, False, True, True),
+    0x10: (MBC3, True, True, True),
+    0x11: (MBC3, False, False, False),
+    0x12: (MBC3, True, False, False),
+    0x13: (MBC3, True, True, False),
+    0x19: (MBC5, False, False, False),
+    0x1A: (MBC5, True, False, False),
+    0x1B: (MBC5, True, True, False),
+    0x1C: (MBC5, False, False, False),
+    0x1D: (MBC5, True, False, False),
+    0x1E: (MBC5, True, True, False),
+}
+
+
+def _map_save_file(path: str, size: int) -> mmap.mmap:
+    # Creates the file if there is none yet, or grows it, filled with zeros
+    with open(path, 'a+b') as f:
+        if os.fstat(f.fileno()).st_size < size:
+            f.truncate(size)
+        return mmap.mmap(f.fileno(), size)
+
+
+def create_cartridge(logger, rom: RomData, scheduler: Scheduler, save_file: Optional[str] = None) -> Cartridge:
+    """
+    Creates the cartridge for rom as described by its header, with its RAM
+    kept in save_file if it has a battery and its clock running on
+    scheduler if it has one.
+    """
+    cartridge_type = rom[0x147] if len(rom) > 0x149 else 0x00
+    if cartridge_type not in CARTRIDGE_TYPES:
+        logger.warning(f'Unsupported cartridge type {cartridge_type:02X}, running it without an MBC')
+        cartridge_type = 0x00
+
+    mbc, has_ram, battery, has_rtc = CARTRIDGE_TYPES[cartridge_type]
+    if mbc is Cartridge:
+        # Without an MBC the RAM is always there, test ROMs and programs
+        # without a proper header use it as scratch space
+        return Cartridge(rom, RAM_BANK_SIZE, battery, save_file)
+
+    cartridge = mbc(rom, RAM_SIZES.get(rom[0x149], 0) if has_ram else 0, battery, save_file)
+    if has_rtc:
+        cartridge.rtc = RTC(scheduler)
+    return cartridge
@@ -1,9 +1,32 @@
+import copy
 from dataclasses import dataclass
-from typing import Optional
-
-from pyboy.opcodes import check_interrupts, execute_opcode, instruction_table
+from functools import partial
+from typing import Dict, List, Optional, Tuple
+
+from pyboy import savestate
+from pyboy.blocks import BLOCK_COMPILE_THRESHOLD, BLOCK_TERMINATORS, compile_block
+from pyboy.cartridge import create_cartridge
+from pyboy.opcodes import check_interrupts, decode_instruction
+from pyboy.ppu import CYCLES_PER_LINE, DRAWING_REGISTERS, LINES_PER_FRAME, PPU
+from pyboy.rom import as_rom
+from pyboy.scheduler import CPU_FREQUENCY, Scheduler
 from pyboy.timer import Timer
 
+# Number of cycles it takes to draw one frame, 144 visible lines plus 10 lines
+# of VBlank, which at CPU_FREQUENCY makes about 59.73 frames per second
+CYCLES_PER_FRAME = CYCLES_PER_LINE * LINES_PER_FRAME
+
+# Cycles an OAM DMA transfer takes, one byte every 4 cycles, during which OAM
+# can't be accessed
+DMA_CYCLES = 160 * 4
+
+# Page ranges of VRAM and WRAM, including echo RAM, that forks share, see Memory.fork
+SHARED_PAGES = ((0x80, 0xA0), (0xC0, 0xFE))
+
+# Joypad buttons in the order of their bits, directions in the low nibble and
+# actions in the high nibble
+JOYPAD_BUTTONS = ('right', 'left', 'up', 'down', 'a', 'b', 'select', 'start')
+
 
 class IdleLoopException(Exception):
     pass
@@ -16,28 +39,48 @@ class Memory:
     #_tma: int
     #_tack_enabled: bool
     _timer: Timer
-    _ly: int
-    _ly_cycles: int
+    _ppu: PPU
  
     def _on_timer_overflow(self):
         current_if = self.read(0xFF0F)
         self.write(0xFF0F, current_if | 0x4)
 
-    def __init__(self, logger, rom_data: bytes):
+    def _request_interrupt(self, flag: int):
+        self.write(0xFF0F, self.read(0xFF0F) | flag)
+
+    def __init__(self, logger, rom_data: bytes, scheduler: Optional[Scheduler] = None, address_space=None,
+                 save_file: Optional[str] = None):
         self._logger = logger
-        self._rom_data = list(rom_data)
-        self._ram = [0] * 0x2000
-        self._vram = bytearray(0x2000)
-        self._hram = [0x0] * 0x7F
-        self._iohram = bytearray(0x100)
-        self._external_ram = bytearray(0x2000)  # 8 KB
-        self._oam = [0] * 0xA0 
-        self._timer = Timer(self._on_timer_overflow)
-        self._interrupt_enable = 0x00
-        self._ly = 0
-        self._ly_cycles = 0
-        self._lcdc = 0
-        self._stat = 0
+        self._scheduler = scheduler or Scheduler()
+        # Everything but the cartridge lives in one flat 64 KiB buffer, so the
+        # whole address space can be copied or hashed in one go. The regions
+        # in it are available as views through _vram, _ram, _oam, _iohram and
+        # _hram. Any writable 64 KiB buffer can be passed in instead, such as
+        # a row of a NumPy array holding the memory of many instances
+        self._address_space = bytearray(0x10000) if address_space is None else address_space
+        # The cartridge ROM and RAM are banked, so they get buffers of their
+        # own. The ROM is used as is, a mapped ROM file isn't copied, and
+        # battery-backed RAM is kept in save_file, if given
+        self._cartridge = create_cartridge(logger, as_rom(rom_data), self._scheduler, save_file)
+        self._rom_data = self._cartridge.rom
+        self._external_ram = self._cartridge.ram
+        self._timer = Timer(self._on_timer_overflow, self._scheduler)
+        self._ppu = PPU(self, self._scheduler, self._request_interrupt)
+        # Pressed buttons, one bit each in the order of JOYPAD_BUTTONS
+        self._joypad_buttons = 0
+        self._address_space[0xFF00] = 0x10
+        # BGP as left by the boot ROM, LCDC is kept by the PPU
+        self._address_space[0xFF47] = 0xFC
+        # ROM banks mapped at 0x0000-0x3FFF and 0x4000-0x7FFF, see _map_cartridge
+        self._rom_banks = (0, 1)
+        # Cycle at which the last OAM DMA transfer is done
+        self._dma_end = 0
+        # Source (buffer, base) of pages that are still shared with a fork,
+        # indexed by page, see fork()
+        self._shared_pages: List[Optional[tuple]] = [None] * 0x100
+        # View of VRAM while all its pages read from one buffer, see _read_vram
+        self._vram_view: Optional[memoryview] = None
+        self._build_page_tables()
         #self._div = 0
         #self._div_divider_bit = 9
         #self._tima = 0
@@ -47,123 +90,352 @@ class Memory:
 
 
 
-    def read(self, address: int) -> int:
-        if 0x0000 <= address <= 0x7FFF:
-            return self._rom_data[address]
-        elif 0x8000 <= address <= 0x9FFF:
-            return self._vram[address - 0x8000]
-        elif 0xC000 <= address <= 0xDFFF:
-            return self._ram[address - 0xC000]
-        elif 0xFE00 <= address <= 0xFE9F:
-            return self._oam[address - 0xFE00]
-        elif 0xA000 <= address <= 0xBFFF:
-            return self._external_ram[address - 0xA000]
-        elif 0xFEA0 <= address <= 0xFEFF:
-            return 0
-        elif 0xFF00 <= address <= 0xFF7F:
-            if address == 0xFF04:
-                return self._timer.DIV
-            elif address == 0xFF40:
-                return self._lcdc
-            elif address == 0xFF41:
-                raise NotImplementedError()
-            elif address == 0xFF00:
-                return 0b11011111
-            elif address == 0xFF05:
-                return self._timer.TIMA
-            elif address == 0xFF06:
-                return self._timer.TMA
-            elif address == 0xFF07:
-                return self._timer.TAC
-            elif address == 0xFF44:
-                return self._ly
+    def _build_page_tables(self):
+        """
+        Sets up the 256-entry page tables indexed by address >> 8.
+
+        A page is either backed directly by a buffer, stored as (buffer, base)
+        so that the byte lives at buffer[address - base], or it is None and the
+        access goes through the page's handler instead.
+        """
+        self._read_pages = [None] * 0x100
+        self._write_pages = [None] * 0x100
+        self._read_handlers = [None] * 0x100
+        self._write_handlers = [None] * 0x100
+
+        self._write_handlers[0x00:0x80] = [self._write_rom] * 0x80
+        self._read_pages[0x80:0xA0] = [(self._address_space, 0x0000)] * 0x20
+        self._write_handlers[0x80:0xA0] = [self._write_vram] * 0x20
+        self._read_handlers[0xA0:0xC0] = [self._read_cartridge_ram] * 0x20
+        self._write_handlers[0xA0:0xC0] = [self._write_cartridge_ram] * 0x20
+        self._map_cartridge()
+        self._read_pages[0xC0:0xE0] = self._write_pages[0xC0:0xE0] = [(self._address_space, 0x0000)] * 0x20
+        # Echo RAM mirrors 0xC000-0xDDFF
+        self._read_pages[0xE0:0xFE] = self._write_pages[0xE0:0xFE] = [(self._address_space, 0x2000)] * 0x1E
+        self._read_handlers[0xFE] = self._read_oam
+        self._write_handlers[0xFE] = self._write_oam
+        self._read_handlers[0xFF] = self._read_high
+        self._write_handlers[0xFF] = self._write_high
+
+        self._io_read_handlers = {
+            0xFF00: self._read_joypad,
+            0xFF04: lambda: self._timer.DIV,
+            0xFF05: lambda: self._timer.TIMA,
+            0xFF06: lambda: self._timer.TMA,
+            0xFF07: lambda: self._timer.TAC,
+            0xFF40: lambda: self._ppu.lcdc,
+            0xFF41: self._ppu.read_stat,
+            0xFF44: lambda: self._ppu.ly,
+        }
+        self._io_write_handlers = {
+            0xFF00: self._write_joypad,
+            0xFF04: lambda value: setattr(self._timer, 'DIV', value),
+            0xFF05: lambda value: setattr(self._timer, 'TIMA', value),
+            0xFF06: lambda value: setattr(self._timer, 'TMA', value),
+            0xFF07: lambda value: setattr(self._timer, 'TAC', value),
+            0xFF0F: self._write_if,
+            0xFF40: self._ppu.write_lcdc,
+            0xFF41: self._ppu.write_stat,
+            0xFF44: self._ppu.write_ly,
+            0xFF45: self._ppu.write_lyc,
+            0xFF46: self._write_dma,
+        }
+        for address in DRAWING_REGISTERS:
+            self._io_write_handlers[address] = partial(self._ppu.write_drawing_register, address)
+
+    def _map_cartridge(self):
+        # Points the ROM and cartridge RAM pages at the banks the MBC selects
+        cartridge = self._cartridge
+        self._read_pages[0x00:0x40] = [(cartridge.rom_banks[cartridge.rom_bank0], 0x0000)] * 0x40
+        self._read_pages[0x40:0x80] = [(cartridge.rom_banks[cartridge.rom_bank], 0x4000)] * 0x40
+        if cartridge.ram_bank is None:
+            self._read_pages[0xA0:0xC0] = self._write_pages[0xA0:0xC0] = [None] * 0x20
+        else:
+            self._read_pages[0xA0:0xC0] = [(cartridge.ram_banks[cartridge.ram_bank], 0xA000)] * 0x20
+            # RAM in a save file is only written to directly once it is dirty
+            if cartridge.dirty or not cartridge.has_save_file:
+                self._write_pages[0xA0:0xC0] = self._read_pages[0xA0:0xC0]
             else:
-                return self._iohram[address - 0xFF00]
-        elif 0xFF80 <= address <= 0xFFFE:
-            return self._hram[address - 0xFF80]
-        elif address == 0xFFFF:
-            return self._interrupt_enable
+                self._write_pages[0xA0:0xC0] = [None] * 0x20
+        if (cartridge.rom_bank0, cartridge.rom_bank) != self._rom_banks:
+            # The CPU picks up the new banks for its instruction cache and
+            # blocks on the next fetch, make running blocks stop to let it
+            self._rom_banks = (cartridge.rom_bank0, cartridge.rom_bank)
+            self._scheduler.request_service()
+
+    def _map_page(self, page: int):
+        # Same mapping as _build_page_tables, for a single page of VRAM, WRAM,
+        # echo RAM or above
+        if page < 0xA0:
+            self._read_pages[page] = (self._address_space, 0x0000)
+            self._write_pages[page] = None
+            self._write_handlers[page] = self._write_vram
+        elif page < 0xE0:
+            self._read_pages[page] = self._write_pages[page] = (self._address_space, 0x0000)
+        elif page < 0xFE:
+            # Echo RAM mirrors 0xC000-0xDDFF
+            self._read_pages[page] = self._write_pages[page] = (self._address_space, 0x2000)
+        elif page == 0xFE:
+            self._read_handlers[page] = self._read_oam
+            self._write_handlers[page] = self._write_oam
         else:
-            return 0xFF
+            self._read_handlers[page] = self._read_high
+            self._write_handlers[page] = self._write_high
+
+    def fork(self, scheduler: Scheduler) -> 'Memory':
+        """
+        Creates a copy of this memory that runs on scheduler.
+
+        The ROM is shared as is. VRAM and WRAM are shared copy-on-write: both
+        this memory and the fork keep reading the current buffers and copy a
+        page into a buffer of their own on the first write to it. OAM, IO and
+        HRAM are only 512 bytes and copied right away, and so is cartridge
+        RAM, whose pages move around with the RAM bank.
+        """
+        self._timer._sync()
+        self._share_pages()
+
+        fork = Memory(self._logger, self._rom_data, scheduler)
+        fork._address_space[0xFE00:] = self._address_space[0xFE00:]
+        fork._external_ram[:] = self._external_ram
+        fork._cartridge.registers = self._cartridge.registers
+        if self._cartridge.rtc is not None:
+            fork._cartridge.rtc.state = self._cartridge.rtc.state
+        fork._map_cartridge()
+        fork._shared_pages[0x80:0xE0] = self._shared_pages[0x80:0xE0]
+        for start, end in SHARED_PAGES:
+            fork._read_pages[start:end] = self._read_pages[start:end]
+            fork._write_pages[start:end] = [None] * (end - start)
+            fork._write_handlers[start:end] = [fork._write_shared_page] * (end - start)
+        fork._vram_view = None
+
+        fork._joypad_buttons = self._joypad_buttons
+        fork._dma_end = self._dma_end
+        ppu = fork._ppu
+        ppu.framebuffer[:] = self._ppu.framebuffer
+        ppu.lcdc = self._ppu.lcdc
+        ppu.stat = self._ppu.stat
+        ppu._window_line = self._ppu._window_line
+        ppu.set_line(self._ppu.ly, self._ppu.line_start)
+
+        timer = fork._timer
+        timer._div_counter = self._timer._div_counter
+        timer._tima = self._timer._tima
+        timer._tma = self._timer._tma
+        timer.TAC = self._timer._tac
+        return fork
+
+    def _share_pages(self):
+        # Freeze the buffers the pages currently read from; from now on writes
+        # first copy the page into fresh buffers
+        address_space = self._address_space
+        self._address_space = bytearray(0x10000)
+        self._address_space[0xFE00:] = address_space[0xFE00:]
+
+        # Pages that are already shared keep reading from where they did
+        for page in [*range(0x80, 0xA0), *range(0xC0, 0xE0)]:
+            if self._shared_pages[page] is None:
+                self._shared_pages[page] = self._read_pages[page] = (address_space, 0x0000)
+                if 0xC0 <= page < 0xDE:
+                    self._read_pages[page + 0x20] = (address_space, 0x2000)
+
+        for start, end in SHARED_PAGES:
+            self._write_pages[start:end] = [None] * (end - start)
+            self._write_handlers[start:end] = [self._write_shared_page] * (end - start)
+        self._vram_view = None
+
+    def _write_shared_page(self, address: int, value: int):
+        page = address >> 8
+        self._unshare_page(page - 0x20 if page >= 0xE0 else page)
+        self.write(address, value)
+
+    def _unshare_page(self, page: int):
+        buffer, base = self._shared_pages[page]
+        start = page << 8
+        self._address_space[start:start + 0x100] = buffer[start - base:start - base + 0x100]
+
+        self._shared_pages[page] = None
+        self._vram_view = None
+        self._map_page(page)
+        if 0xC0 <= page < 0xDE:
+            self._map_page(page + 0x20)
+
+    def _unshare_pages(self, start: int = 0x80, end: int = 0xE0):
+        if self._shared_pages[start:end].count(None) == end - start:
+            return
+        for page in range(start, end):
+            if self._shared_pages[page] is not None:
+                self._unshare_page(page)
+
+    @property
+    def _vram(self) -> memoryview:
+        self._unshare_pages(0x80, 0xA0)
+        return memoryview(self._address_space)[0x8000:0xA000]
+
+    def _read_vram(self):
+        """
+        Returns VRAM as it reads, without unsharing it from forks like _vram
+        does. Only a copy if some of its pages have been unshared and some not.
+        """
+        view = self._vram_view
+        if view is None:
+            pages = self._read_pages[0x80:0xA0]
+            buffer = pages[0][0]
+            if any(page[0] is not buffer for page in pages):
+                return b''.join(buffer[address:address + 0x100] for (buffer, _), address in zip(pages, range(0x8000, 0xA000, 0x100)))
+            view = self._vram_view = memoryview(buffer)[0x8000:0xA000]
+        return view
+
+    @property
+    def _ram(self) -> memoryview:
+        self._unshare_pages(0xC0, 0xE0)
+        return memoryview(self._address_space)[0xC000:0xE000]
+
+    @property
+    def _oam(self) -> memoryview:
+        return memoryview(self._address_space)[0xFE00:0xFEA0]
+
+    @property
+    def _iohram(self) -> memoryview:
+        return memoryview(self._address_space)[0xFF00:0xFF80]
+
+    @property
+    def _hram(self) -> memoryview:
+        return memoryview(self._address_space)[0xFF80:0xFFFF]
+
+    def read(self, address: int) -> int:
+        # Addresses wrap around like on the 16-bit bus, SP can run past either end
+        address &= 0xFFFF
+        page = self._read_pages[address >> 8]
+        if page is not None:
+            return page[0][address - page[1]]
+        return self._read_handlers[address >> 8](address)
 
     def write(self, address: int, value: int):
-        value &= 0xFF
-
-        #print(f'Writing {value:0X} to {address:02X}')
-
-        if 0x8000 <= address <= 0x9FFF:
-            self._vram[address - 0x8000] = value
-
-        elif 0xFE00 <= address <= 0xFE9F:
-            self._oam[address - 0xFE00] = value
-        
-        elif 0xA000 <= address <= 0xBFFF:
-            self._external_ram[address - 0xA000] = value
-
-        elif 0xFEA0 <= address <= 0xFEFF:
-            pass
-
-        elif 0x2000 <= address <= 0x3FFF:
-            # For now, no MBC support → just ignore the write
-            self._logger.debug(f"Ignored ROM bank switch: {value}")
-        
-        elif 0xC000 <= address <= 0xDFFF:
-            self._ram[address - 0xC000] = value
-
-        elif 0xFF00 <= address <= 0xFF7F:
-            if address == 0xFF04:
-                self._timer.DIV = value
-            #TAC
-            elif address == 0xFF07:
-                self._timer.TAC = value
-            elif address == 0xFF05:
-                self._timer.TIMA = value
-                
-            elif address == 0xFF06:
-                self._timer.TMA = value
-
-            elif address == 0xFF44:
-                self._ly = 0
-            elif address == 0xFF40:
-                self._lcdc = value
-
-            elif address == 0xFFF00:
-                raise NotImplementedError()
-
-            elif address == 0xFF41:
-                self._stat = value
-            
-            elif address == 0xFF0F:
-                self._iohram[address - 0xFF00] = value
-            else:
-                self._iohram[address - 0xFF00] = value
-        
-        elif 0xFF80 <= address <= 0xFFFE:
-            self._hram[address - 0xFF80] = value
-        elif 0xE000 <= address <= 0xFDFF:
-            self.write(address - 0x2000, value)
-        elif address == 0xFFFF:
-            self._interrupt_enable = value
-        #elif 0xFEA0 <= address <= 0xFEFF:
-        #    pass  # Ignore writes
-        elif 0x0000 <= address <= 0x7FFF:
-            pass
+        address &= 0xFFFF
+        page = self._write_pages[address >> 8]
+        if page is not None:
+            page[0][address - page[1]] = value & 0xFF
         else:
-            raise Exception(f'Writing {value} to to an unknown memory area (address {address:02X})!')
+            self._write_handlers[address >> 8](address, value & 0xFF)
 
-    def add_cycles(self, count: int):
-        self._ly_cycles += count
-        if self._ly_cycles > 456:
-            self._ly_cycles -= 456
-            self._ly = (self._ly + 1) % 154
+    def _write_rom(self, address: int, value: int):
+        # ROM can't be written to, these are writes to the MBC registers
+        self._cartridge.write(address, value)
+        self._map_cartridge()
 
-            if self._ly == 144:
-                # VBlank startar vid scanline 144
-                if_reg = self.read(0xFF0F)
-                self.write(0xFF0F, if_reg | 0x01)  # Sätt VBlank-flagga
-
-        self._timer.add_cycles(count)
+    def _read_cartridge_ram(self, address: int) -> int:
+        return self._cartridge.read_ram(address)
 
+    def _write_cartridge_ram(self, address: int, value: int):
+        cartridge = self._cartridge
+        if cartridge.ram_bank is None:
+            cartridge.write_ram(address, value)
+        else:
+            # The first write to RAM in a save file since the last flush
+            cartridge.dirty = True
+            self._map_cartridge()
+            self.write(address, value)
+
+    def flush(self):
+        """Writes battery-backed cartridge RAM to its save file, if it has been written to since the last flush."""
+        if self._cartridge.dirty:
+            self._cartridge.flush()
+            # Catch the next write again
+            self._map_cartridge()
+
+    def close(self):
+        """Flushes and closes the save file of the cartridge, if there is one."""
+        self._cartridge.close()
+
+    def _write_vram(self, address: int, value: int):
+        if self._address_space[address] == value:
+            return
+        self._address_space[address] = value
+        self._ppu.frame_changed = True
+        if address < 0x9800:
+            self._ppu.dirty_tiles[(address - 0x8000) >> 4] = 1
+
+    def _read_oam(self, address: int) -> int:
+        if address <= 0xFE9F:
+            if self._scheduler.cycles < self._dma_end:
+                return 0xFF
+            return self._address_space[address]
+        return 0
+
+    def _write_oam(self, address: int, value: int):
+        if address <= 0xFE9F and self._scheduler.cycles >= self._dma_end and self._address_space[address] != value:
+            self._address_space[address] = value
+            self._ppu.frame_changed = True
+
+    def _write_dma(self, value: int):
+        # The 160 bytes from value << 8 on are copied into OAM in one go, they
+        # always lie within one page. OAM reads 0xFF and ignores writes until
+        # the transfer would be done
+        self._address_space[0xFF46] = value
+        page = value - 0x20 if value >= 0xE0 else value
+        if self._read_pages[page] is None:
+            # Cartridge RAM that is disabled, missing or a clock register
+            read = self._read_handlers[page]
+            start = page << 8
+            data = bytes(read(address) for address in range(start, start + 0xA0))
+        else:
+            buffer, base = self._read_pages[page]
+            start = (page << 8) - base
+            data = buffer[start:start + 0xA0]
+        if self._address_space[0xFE00:0xFEA0] != data:
+            self._address_space[0xFE00:0xFEA0] = data
+            self._ppu.frame_changed = True
+        self._dma_end = self._scheduler.cycles + DMA_CYCLES
+
+    def _read_high(self, address: int) -> int:
+        if address >= 0xFF80:
+            return self._address_space[address]
+
+        handler = self._io_read_handlers.get(address)
+        if handler is not None:
+            return handler()
+        return self._address_space[address]
+
+    def _write_high(self, address: int, value: int):
+        if 0xFF80 <= address <= 0xFFFE:
+            self._address_space[address] = value
+        elif address == 0xFFFF:
+            self._address_space[0xFFFF] = value
+            self._scheduler.request_service()
+        else:
+            handler = self._io_write_handlers.get(address)
+            if handler is not None:
+                handler(value)
+            else:
+                self._address_space[address] = value
+
+    def _read_joypad(self) -> int:
+        select = self._address_space[0xFF00]
+        value = 0xC0 | select | 0x0F
+        if not select & 0x10:
+            value &= ~(self._joypad_buttons & 0x0F)
+        if not select & 0x20:
+            value &= ~(self._joypad_buttons >> 4)
+        return value
+
+    def _write_joypad(self, value: int):
+        self._address_space[0xFF00] = value & 0x30
+
+    def set_joypad(self, buttons: int):
+        """Sets the pressed buttons as a bit mask in the order of JOYPAD_BUTTONS."""
+        if buttons & ~self._joypad_buttons:
+            # Joypad interrupt on any newly pressed button
+            self.write(0xFF0F, self.read(0xFF0F) | 0x10)
+        self._joypad_buttons = buttons
+
+    def _write_if(self, value: int):
+        self._address_space[0xFF0F] = value
+        self._scheduler.request_service()
+
+    def next_vblank(self) -> int:
+        """Returns the cycle at which LY next becomes 144, the start of VBlank."""
+        return self._ppu.next_vblank()
 
     @property
     def DIV(self):
@@ -171,7 +443,7 @@ class Memory:
 
     @property
     def CYCLES(self):
-        return self._ly_cycles
+        return self._scheduler.cycles - self._ppu.line_start
     
 
 
@@ -352,100 +624,195 @@ class CPU:
         self._debug = debug
         self._steps = 0
 
-        if state is not None:
-            raise NotImplementedError("Loading of state is not implemented!")
+        # Decoded instructions per (ROM bank, PC >> 14), indexed by PC within
+        # the 16 KiB bank. A bank can be mapped at either 0x0000 or 0x4000,
+        # so it gets an entry for each. ROM can't be written to, so entries
+        # stay valid until a new program is loaded. Code running from RAM is
+        # never cached and is decoded again on every fetch.
+        self._banked_instructions: Dict[Tuple[int, int], List[Optional[tuple]]] = {}
+        self._reset_blocks()
+
+        if state is None:
+            state = CPUState()
+        self._state = state
 
-        self._state = CPUState()
+        # A state that already has memory attached brings its clock along
+        memory = getattr(state, 'memory', None)
+        self._scheduler = memory._scheduler if memory is not None else Scheduler()
 
     def set_addresses(self, pc: int = 0x0100, sp: int = 0xFFFE):
         self._state.pc = pc
         self._state._sp = sp
 
-    def load_program(self, data: bytes, address: int = 0):
-        self._state.memory = Memory(self._logger, data)
+    def load_program(self, data: bytes, address: int = 0, address_space=None, save_file: Optional[str] = None):
+        self._state.memory = Memory(self._logger, data, self._scheduler, address_space, save_file)
+        self.invalidate_instruction_cache()
+
+    def fork(self) -> 'CPU':
+        """
+        Creates a new CPU that continues from exactly where this one is.
+
+        The ROM and the decoded instruction cache are shared, and RAM is shared
+        copy-on-write, see Memory.fork.
+        """
+        fork = CPU(self._logger, debug=self._debug)
+        fork._banked_instructions = self._banked_instructions
+        fork._resuming_block = self._resuming_block
+        fork._scheduler.cycles = self._scheduler.cycles
+
+        fork._state = copy.copy(self._state)
+        fork._state.memory = self._state.memory.fork(fork._scheduler)
+        fork._scheduler.request_service()
+        return fork
+
+    def save_state(self) -> bytes:
+        return savestate.save_state(self)
+
+    def load_state(self, data: bytes):
+        savestate.load_state(self, data)
+
+    def invalidate_instruction_cache(self, start: int = 0x0000, end: int = 0x7FFF):
+        # Instructions can be up to three bytes long, so an instruction starting
+        # just before start may cover it as well. The range applies to every
+        # bank mapped there
+        if start <= 0x0000 and end >= 0x7FFF:
+            self._banked_instructions = {}
+        else:
+            for instructions in self._banked_instructions.values():
+                for address in range(max(start - 2, 0), min(end, 0x7FFF) + 1):
+                    instructions[address & 0x3FFF] = None
+
+        # Blocks can be much longer, so drop them all
+        self._reset_blocks()
+
+    def _reset_blocks(self):
+        # Compiled blocks per (bank, PC >> 14), like _banked_instructions.
+        # Blocks continue at absolute addresses, so one compiled for a bank at
+        # 0x0000 can't run where it is mapped at 0x4000. Each entry is the
+        # number of times the PC has been reached until it gets compiled,
+        # then the block or False if there is nothing to compile there.
+        self._banked_blocks: Dict[Tuple[int, int], List] = {}
+        self._resuming_block = False
+        # Instructions and blocks of the banks mapped at 0x0000-0x3FFF and
+        # 0x4000-0x7FFF, for Memory._rom_banks as it was when mapped
+        self._mapped_banks = None
+        self._mapped_instructions: List[List[Optional[tuple]]] = []
+        self._fixed_blocks: List = []
+        self._mapped_blocks: List = []
 
     def run_next_instruction(self):
-        instruction = self._get_next_instruction()
-        cycles = execute_opcode(self, self._logger, instruction)
-        return cycles
+        handler, instruction, _, _, cycle_count = self._get_next_instruction()
+        return handler(self._logger, self, instruction) or cycle_count
 
     def run_n_cycles(self, number: int = 1):
-        cycles_run = 0
-        while cycles_run < number:
-            ei = self._state.ime
-            
+        logger = self._logger
+        state = self._state
+        scheduler = self._scheduler
+        end = scheduler.cycles + number
+
+        while scheduler.cycles < end:
             #TODO: Protect against HLT bug?
-            if self._state._halted:
-                check_interrupts(self._logger, self)
-                if self._state._halted:
-                    cycle_count = 4
-                    self._state.memory.add_cycles(4)
-                    cycles_run += 4
-                    continue
+            if state._halted:
+                # Only an event can raise the interrupt that ends HALT, so go
+                # straight to the next one (or end), still in steps of 4 cycles
+                scheduler.cycles += max(4, (min(scheduler.next_deadline, end) - scheduler.cycles + 3) & ~3)
             else:
-                instruction = self._get_next_instruction()
-                cycle_count = execute_opcode(self, self._logger, instruction)
-
-            #if ei:
-            #    print(f"==> IME ENABLED efter nästa instruktion @ PC={self._state.pc:04X}")
-            #    self._state.enable_interrupts_after_next_instruction = False
-            #    self._state.ime = True
-            if self._state._delay_enable_ime:
-                self._logger.info(f'{self._state.pc} - ime: delay_enable_ime is set to True')
-                self._state._delay_enable_ime = False
-                self._state.enable_interrupts_after_next_instruction = True
-            elif self._state.enable_interrupts_after_next_instruction:
-                self._logger.info(f'{self._state.pc} - ime: enable_interrupts_after_next_instruction is set to True')
-                self._state.enable_interrupts_after_next_instruction = False
-                self._state.ime = True
-
-
-            for _ in range(cycle_count):
-                self._state.memory.add_cycles(1)
-            #self._state.memory.add_cycles(cycle_count)
-            #self._logger.info(f'Cycles at {self._state.memory.CYCLES!')
-            cycles_run += cycle_count
-            
-            check_interrupts(self._logger, self)
+                # Run instructions back to back until an event is due or
+                # something (EI, writes to IE/IF, ...) asks to be serviced
+                while True:
+                    pc = state.pc
+                    if pc < 0x8000 and not self._debug:
+                        if state.memory._rom_banks is not self._mapped_banks:
+                            self._map_banks(state.memory._rom_banks)
+                        if pc < 0x4000:
+                            blocks = self._fixed_blocks
+                        else:
+                            blocks = self._mapped_blocks
+                            pc -= 0x4000
+
+                        block = blocks[pc]
+                        if block.__class__ is int:
+                            if self._resuming_block:
+                                block = None
+                            elif block < BLOCK_COMPILE_THRESHOLD:
+                                blocks[pc] = block + 1
+                                block = None
+                            else:
+                                block = blocks[pc] = compile_block(state.memory, state.pc) or False
+
+                        if block:
+                            # A block that stops halfway leaves the PC in the middle of
+                            # it, don't start compiling new blocks from there
+                            self._resuming_block = block(self, state, scheduler, end)
+                            if scheduler.cycles >= scheduler.next_deadline or scheduler.cycles >= end:
+                                break
+                            continue
+
+                    handler, instruction, _, _, cycle_count = self._get_next_instruction()
+                    scheduler.cycles += handler(logger, self, instruction) or cycle_count
+                    if self._resuming_block and instruction[0] in BLOCK_TERMINATORS:
+                        self._resuming_block = False
+                    if scheduler.cycles >= scheduler.next_deadline or scheduler.cycles >= end:
+                        break
+
+                if state._delay_enable_ime:
+                    logger.info(f'{state.pc} - ime: delay_enable_ime is set to True')
+                    state._delay_enable_ime = False
+                    state.enable_interrupts_after_next_instruction = True
+                elif state.enable_interrupts_after_next_instruction:
+                    logger.info(f'{state.pc} - ime: enable_interrupts_after_next_instruction is set to True')
+                    state.enable_interrupts_after_next_instruction = False
+                    state.ime = True
+
+            scheduler.service()
+            if state.enable_interrupts_after_next_instruction:
+                # IME is set after the next instruction, so come back after it
+                scheduler.request_service()
+
+            check_interrupts(logger, self)
+
+    def run_frame(self):
+        """
+        Runs until the start of the next VBlank, when a whole frame has been drawn.
+
+        Frames always end at VBlank rather than after a fixed number of
+        cycles, so the cycles the last instruction of one frame runs past it
+        are taken from the next.
+        """
+        self.run_n_cycles(self._state.memory.next_vblank() - self._scheduler.cycles)
+
+    def _map_banks(self, banks: tuple):
+        self._mapped_banks = banks
+        self._mapped_instructions = [self._banked_instructions.setdefault(key, [None] * 0x4000) for key in zip(banks, (0, 1))]
+        self._fixed_blocks, self._mapped_blocks = [self._banked_blocks.setdefault(key, [0] * 0x4000) for key in zip(banks, (0, 1))]
 
     def _get_next_instruction(self):
         self._steps += 1
-        instruction = []
-        remaining_operand_count = 0
-
-        while len(instruction) == 0 or remaining_operand_count > 0:
-            b = self._state.memory.read(self._state.pc)
-
-            #self._logger.debug(
-            #    f"{hex(self._state.pc)}: {self._state.memory.read(self._state.pc):02X}"
-            #)
-            if not instruction:
-                if self._debug:
-                    if self._previous_pc != self._state.pc:
-                        self._previous_pc = self._state.pc
-                        self._previous_pc_count = 0
-                    else:
-                        self._previous_pc_count += 1
-
-                    if self._previous_pc_count > 10:
-                        raise IdleLoopException('Code is jumping to the same address, probably end of program!')
-
-                # Handle CB prefix instructions
-                if b == 0xCB:
-                    instruction.append(0xCB)
-                    self._state.pc += 1
-                    instruction.append(self._state.memory.read(self._state.pc))
-                    self._state.pc += 1
-                    return instruction
-                else:
-                    #print(f'PC: 0x{self._state.pc:02X}')
-                    if b not in instruction_table:
-                        raise Exception(f"Unsupported instruction {b:0X}")
-                instruction.append(b)
-                remaining_operand_count = instruction_table[b].operand_count
+        pc = self._state.pc
+
+        if self._debug:
+            if self._previous_pc != pc:
+                self._previous_pc = pc
+                self._previous_pc_count = 0
             else:
-                instruction.append(b)
-                remaining_operand_count -= 1
+                self._previous_pc_count += 1
+
+            if self._previous_pc_count > 10:
+                raise IdleLoopException('Code is jumping to the same address, probably end of program!')
+
+        if pc < 0x8000:
+            memory = self._state.memory
+            if memory._rom_banks is not self._mapped_banks:
+                self._map_banks(memory._rom_banks)
+            instructions = self._mapped_instructions[pc >> 14]
+            entry = instructions[pc & 0x3FFF]
+            if entry is None:
+                entry = decode_instruction(memory, pc)
+                # Don't cache instructions whose operands reach into another bank
+                if (pc & 0x3FFF) + entry[3] <= 0x4000:
+                    instructions[pc & 0x3FFF] = entry
+        else:
+            entry = decode_instruction(self._state.memory, pc)
 
-            self._state.pc += 1
-        return instruction
+        self._state.pc = (pc + entry[3]) & 0xFFFF
+        return entry
@@ -1,23 +1,36 @@
+import os
 import time
-import pygame
-from typing import List
-from pyboy.cpu import CPU, IdleLoopException
-import readline
+from typing import Iterable, List
+
+import numpy as np
+
+from pyboy.cpu import CPU_FREQUENCY, CYCLES_PER_FRAME, CPU, JOYPAD_BUTTONS, IdleLoopException
+from pyboy.renderer import SCREEN_HEIGHT, SCREEN_WIDTH
+from pyboy.rom import load_rom
 
 
 """
     Gearboy visar en vit rad längst upp i början innan något körs
 """
 
+# Seconds per emulated frame, about 1/59.73
+FRAME_TIME = CYCLES_PER_FRAME / CPU_FREQUENCY
+# Most frames in a row that realtime mode skips drawing when falling behind
+MAX_FRAME_SKIP = 4
+
 class Emulator:
-    def __init__(self, logger, debug: bool = False, scaling_factor: int=5):
+    def __init__(self, logger, debug: bool = False, scaling_factor: int=5, headless: bool = False):
         self._logger = logger
         self._debug = debug
+        self._headless = headless
         self._breakpoints: List[int] = []
         self._scaling_factor = scaling_factor
 
         self._cpu = CPU(logger=self._logger, debug=self._debug)
         self._cpu.set_addresses()
+        # Whether the last frame step_frame ran may differ from the one before,
+        # headless runs can skip looking at frames that didn't change
+        self.frame_changed = True
 
         self._PALETTE = [
             (255, 255, 255),  # White
@@ -25,16 +38,63 @@ class Emulator:
             (96, 96, 96),     # Dark gray
             (0, 0, 0),        # Black
         ]
+        self._palette = np.array(self._PALETTE, dtype=np.uint8)
 
     def load_rom_file(self, filepath: str):
-        rom_data: bytes
-
-        with open(filepath, "rb") as f:
-            rom_data = f.read()
-
-        self._cpu.load_program(rom_data)
+        """Loads the ROM at filepath, battery-backed RAM is kept in a .sav file next to it."""
+        self._cpu.load_program(load_rom(filepath), save_file=os.path.splitext(filepath)[0] + '.sav')
+
+    def step_frame(self):
+        """Runs until the start of the next VBlank, by when the whole frame has been drawn into framebuffer."""
+        self._cpu.run_frame()
+        memory = self._cpu._state.memory
+        self.frame_changed = memory._ppu.end_frame()
+        memory.flush()
+
+    def close(self):
+        """Writes battery-backed RAM to the save file and closes it, the emulator can't be used after."""
+        self._cpu._state.memory.close()
+
+    @property
+    def framebuffer(self) -> np.ndarray:
+        """
+        The last rendered frame as a (144, 160) uint8 array of shades, 0 is white and 3 is black.
+
+        The array is updated in place, one line at a time as the PPU draws
+        them, copy it to keep a frame around.
+        """
+        return self._cpu._state.memory._ppu.framebuffer
+
+    def set_buttons(self, buttons: Iterable[str]):
+        """Holds down the given buttons, by name from JOYPAD_BUTTONS, and releases all others."""
+        mask = 0
+        for button in buttons:
+            if button not in JOYPAD_BUTTONS:
+                raise Exception(f'Unknown button {button}!')
+            mask |= 1 << JOYPAD_BUTTONS.index(button)
+        self._cpu._state.memory.set_joypad(mask)
+
+    def advance_clock(self, seconds: float):
+        """Moves the cartridge's real-time clock forward by seconds without running anything."""
+        rtc = self._cpu._state.memory._cartridge.rtc
+        if rtc is None:
+            raise Exception('The cartridge has no clock!')
+        rtc.advance(seconds)
+
+    def fork(self) -> 'Emulator':
+        fork = Emulator(self._logger, self._debug, self._scaling_factor, self._headless)
+        fork._cpu = self._cpu.fork()
+        return fork
+
+    def save_state(self) -> bytes:
+        return self._cpu.save_state()
+
+    def load_state(self, data: bytes):
+        self._cpu.load_state(data)
 
     def _wait_for_command(self):
+        import readline
+
         while True:
             print(
                 f"ZF: {self._cpu._state.zf}, NF: {self._cpu._state.nf}, CF: {self._cpu._state.cf}"
@@ -112,59 +172,32 @@ class Emulator:
 
             else:
                 print(f"Invalid command {command}!")
-    def _get_tile_pixels(self, cpu, tile_id):
-        pixels = []
+    def _render_tilemap(self, screen, cpu):
+        import pygame
 
-        # Läs LCDC-register (0xFF40)
-        lcdc = cpu._state.memory.read(0xFF40)
-        unsigned_ids = (lcdc & 0x10) != 0  # Bit 4: Tile data select
+        framebuffer = cpu._state.memory._ppu.framebuffer
+        pygame.surfarray.blit_array(self._frame_surface, self._palette[framebuffer].swapaxes(0, 1))
+        pygame.transform.scale(self._frame_surface, screen.get_size(), screen)
 
-        # Korrekt base address beroende på tile ID-typ
-        if unsigned_ids:
-            base_address = 0x8000 + (tile_id * 16)
-        else:
-            tile_id_signed = tile_id if tile_id < 128 else tile_id - 256
-            base_address = 0x8210 + (tile_id_signed * 16)
+    def run(self, unthrottled: bool = False):
+        """
+        Runs the ROM in a window until it is closed, in realtime at 59.73
+        frames per second by default. When the host can't keep up, drawing
+        frames is skipped (at most MAX_FRAME_SKIP in a row) to catch up.
 
-        for row in range(8):
-            low = cpu._state.memory.read(base_address + row * 2)
-            high = cpu._state.memory.read(base_address + row * 2 + 1)
-            pixel_row = []
+        Unthrottled runs the emulation as fast as possible and only draws as
+        many frames as there would have been in realtime.
 
-            for bit in reversed(range(8)):
-                color = ((high >> bit) & 1) << 1 | ((low >> bit) & 1)
-                pixel_row.append(color)
-            pixels.append(pixel_row)
+        Closing the window closes the emulator as well, see close().
+        """
+        if self._headless:
+            raise Exception('Cannot run with a display in headless mode, use step_frame() instead!')
 
-        return pixels
+        import pygame
 
-    
-    def _render_tilemap(self, screen, cpu):
-        
-        tilemap_base= 0x9C00 if (cpu._state.memory.read(0xFF40) & 0x08) else 0x9800
-        lcdc = cpu._state.memory.read(0xFF40)
-        if (lcdc & 0x80) == 0:
-            return
-        for y in range(18):
-            for x in range(20):
-                tilemap_address = tilemap_base + (y * 32) + x
-                tile_id = cpu._state.memory.read(tilemap_address)
-                tile_pixels = self._get_tile_pixels(cpu, tile_id)
-
-                for row in range(8):
-                    for col in range(8):
-                        color = self._PALETTE[tile_pixels[row][col]]
-                        rect = pygame.Rect(
-                            (x * 8 + col) * self._scaling_factor,
-                            (y * 8 + row) * self._scaling_factor,
-                            self._scaling_factor,
-                            self._scaling_factor
-                        )
-                        pygame.draw.rect(screen, color, rect)
-
-    def run(self):
         pygame.init()
-        self._screen = pygame.display.set_mode((160*self._scaling_factor, 144*self._scaling_factor))
+        self._screen = pygame.display.set_mode((SCREEN_WIDTH*self._scaling_factor, SCREEN_HEIGHT*self._scaling_factor))
+        self._frame_surface = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT), 0, self._screen)
         pygame.display.set_caption("pyboy")
 
         if self._debug:
@@ -177,24 +210,44 @@ class Emulator:
                 return
             except Exception as e:
                 raise
+            finally:
+                self.close()
             return
-        clock = pygame.time.Clock()
+        # Host time at which the next frame is due
+        next_frame = time.perf_counter()
+        skipped_frames = 0
 
         running = True
         while running:
-            # Todo, run right amount of cycles per frame instead
-            self._cpu.run_n_cycles(70224)
+            self._cpu.run_frame()
+            self._cpu._state.memory.flush()
 
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
                     running = False
 
+            now = time.perf_counter()
+            if unthrottled:
+                if now < next_frame:
+                    continue
+                next_frame = now + FRAME_TIME
+            else:
+                next_frame += FRAME_TIME
+                if now > next_frame and skipped_frames < MAX_FRAME_SKIP:
+                    skipped_frames += 1
+                    continue
+                if now > next_frame + MAX_FRAME_SKIP * FRAME_TIME:
+                    # Too far behind to ever catch up, start over from now
+                    next_frame = now
 
-            self._screen.fill((255, 255, 255))
+            skipped_frames = 0
             self._render_tilemap(self._screen, self._cpu)
             pygame.display.flip()
 
+            if not unthrottled:
+                delay = next_frame - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
 
-            clock.tick(60)
-
+        self.close()
         pygame.quit()
\ No newline at end of file
@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-from typing import Callable, Dict
+from typing import Callable, Dict, Tuple
 
 
 @dataclass
@@ -10,8 +10,8 @@ class Instruction:
     cycle_count: int
 
 
-instruction_table: Dict[str, Instruction] = {}
-cb_instruction_table: Dict[str, Instruction] = {}
+instruction_table: Dict[int, Instruction] = {}
+cb_instruction_table: Dict[int, Instruction] = {}
 
 
 def register_cb_instruction(instruction: int, operand_count: int, cycle_count: int = 4):
@@ -77,24 +77,43 @@ def check_interrupts(logger, cpu):
 
 
 def execute_opcode(self, logger, instruction):
-    entry = None
     if instruction[0] == 0xCB:
-        if instruction[1] not in cb_instruction_table:
-            raise Exception(f"Unknown cb opcode {instruction[1]:01X}")
-        entry = cb_instruction_table[instruction[1]]
-
-    elif instruction[0] in instruction_table:
-        entry = instruction_table[instruction[0]]
+        handler, _, cycle_count = cb_instruction_dispatch[instruction[1]]
     else:
-        raise Exception(f"Unknown opcode {instruction[0]:04X}")
+        handler, _, cycle_count = instruction_dispatch[instruction[0]]
 
     # TODO: NÄR MINNET LÄSES FRÅN FF00+80 så är värdet fel!
-    # print(f'Will run {entry.handler.__name__}!')
-    cycle_count = entry.handler(logger, self, instruction) or entry.cycle_count
-    return cycle_count
-    # print(f'Done running {entry.handler.__name__}!')
-    # if new_address != old_address:
-    #    print(f'{self._state.pc:02X} - Jumped from {old_address:02X} to {new_address:02X}!')
+    return handler(logger, self, instruction) or cycle_count
+
+
+def decode_instruction(memory, address: int) -> tuple:
+    """
+    Decodes the instruction at address into a tuple of
+    (handler, instruction, operand, length, cycle_count), where operand is
+    the immediate value with both bytes already combined (None if there is none).
+    """
+    opcode = memory.read(address)
+
+    # Handle CB prefix instructions
+    if opcode == 0xCB:
+        cb_opcode = memory.read((address + 1) & 0xFFFF)
+        handler, _, cycle_count = cb_instruction_dispatch[cb_opcode]
+        return (handler, (0xCB, cb_opcode), None, 2, cycle_count)
+
+    handler, operand_count, cycle_count = instruction_dispatch[opcode]
+    operand = None
+    if operand_count == 1:
+        operand = memory.read((address + 1) & 0xFFFF)
+        instruction = (opcode, operand)
+    elif operand_count == 2:
+        low = memory.read((address + 1) & 0xFFFF)
+        high = memory.read((address + 2) & 0xFFFF)
+        operand = low | (high << 8)
+        instruction = (opcode, low, high)
+    else:
+        instruction = (opcode,)
+
+    return (handler, instruction, operand, 1 + operand_count, cycle_count)
 
 
 def push(state, low_byte: int, high_byte: int):
@@ -115,98 +134,71 @@ def pop(state) -> tuple[int, int]:
     return (low, high)
 
 
-@register_cb_instruction(0x1B, 0, 8)
-def handle_cb_rr_e(logger, cpu, instruction):
-    handle_cb_generic_rr(cpu._state, "E")
+# Operands of the 8-bit register instruction families, in the order given by
+# the low three bits of their opcodes
+REGISTER_OPERANDS = ("B", "C", "D", "E", "H", "L", "(HL)", "A")
+
+# CPUState attribute backing each 8-bit register
+REGISTER_ATTRIBUTES = {"A": "_a", "B": "_b", "C": "_c", "D": "_d", "E": "_e", "H": "_h", "L": "_l"}
 
 
-def handle_generic_sbc_a(state, register_name):
-    value = None
+def specialize_handler(template: str, name: str, register_name: str, **substitutions) -> Callable:
+    """
+    Generates the handler `name` from template for one register (or "(HL)").
+
+    The template is the handler body operating on `state`. It reads its operand
+    with {load} and writes `result` back with {store}, which are substituted
+    with direct CPUState attribute or memory accesses, so the generated handler
+    does no register lookups by name at runtime.
+    """
     if register_name == "(HL)":
-        value = state.memory.read(state.HL)
+        prologue = "    address = (state._h << 8) | state._l\n"
+        load = "state.memory.read(address)"
+        store = "state.memory.write(address, result)"
     else:
-        value = getattr(state, register_name)
+        prologue = ""
+        attribute = REGISTER_ATTRIBUTES[register_name]
+        load = f"state.{attribute}"
+        store = f"state.{attribute} = result"
+
+    body = template.format(load=load, store=store, **substitutions)
+    source = f"def {name}(logger, cpu, instruction):\n    state = cpu._state\n{prologue}{body}"
+
+    namespace: Dict[str, Callable] = {}
+    exec(compile(source, f"<{name}>", "exec"), globals(), namespace)
+    handler = namespace[name]
+    # Kept for the block compiler, inspect can't find the source of generated code
+    handler.source = source
+    return handler
+
+
+def register_family(register: Callable, name: str, template: str, opcodes: range, cycle_count: int,
+                    hl_cycle_count: int, **substitutions):
+    """Specializes template for each of REGISTER_OPERANDS and registers it under opcodes."""
+    for opcode, register_name in zip(opcodes, REGISTER_OPERANDS):
+        if register_name == "(HL)":
+            handler = specialize_handler(template, f"{name}_hl_mem", register_name, **substitutions)
+            register(opcode, 0, hl_cycle_count)(handler)
+        else:
+            handler = specialize_handler(template, f"{name}_{register_name.lower()}", register_name, **substitutions)
+            register(opcode, 0, cycle_count)(handler)
 
-    carry = state.cf
 
-    result = state.A - value - carry
+SBC_A_TEMPLATE = """
+    value = {load}
+    carry = state.cf
+    a = state._a
+    result = a - value - carry
 
     state.zf = 1 if (result & 0xFF) == 0 else 0
     state.nf = 1
-    state.hf = 1 if (state.A & 0xF) < ((value & 0xF) + carry) else 0
+    state.hf = 1 if (a & 0xF) < ((value & 0xF) + carry) else 0
     state.cf = 1 if result < 0 else 0
 
-    state.A = result & 0xFF
-
-
-@register_instruction(0x98, 0, 4)
-def handle_sbc_a_b(logger, cpu, instruction):
-    handle_generic_sbc_a(cpu._state, "B")
-
-
-@register_instruction(0x99, 0, 4)
-def handle_sbc_a_c(logger, cpu, instruction):
-    handle_generic_sbc_a(cpu._state, "C")
-
-
-@register_instruction(0x9A, 0, 4)
-def handle_sbc_a_d(logger, cpu, instruction):
-    handle_generic_sbc_a(cpu._state, "D")
-
-
-@register_instruction(0x9B, 0, 4)
-def handle_sbc_a_e(logger, cpu, instruction):
-    handle_generic_sbc_a(cpu._state, "E")
-
-
-@register_instruction(0x9C, 0, 4)
-def handle_sbc_a_h(logger, cpu, instruction):
-    handle_generic_sbc_a(cpu._state, "H")
-
-
-@register_instruction(0x9D, 0, 4)
-def handle_sbc_a_l(logger, cpu, instruction):
-    handle_generic_sbc_a(cpu._state, "L")
-
-
-@register_instruction(0x9E, 0, 4)
-def handle_sbc_a_hl_mem(logger, cpu, instruction):
-    handle_generic_sbc_a(cpu._state, "(HL)")
-
-
-@register_instruction(0x9F, 0, 4)
-def handle_sbc_a_a(logger, cpu, instruction):
-    handle_generic_sbc_a(cpu._state, "A")
-
-
-@register_cb_instruction(0x19, 0, 8)
-def handle_cb_rr_c(logger, cpu, instruction):
-    old_carry = cpu._state.cf
-    value = cpu._state.C
-
-    new_carry = value & 0x01
-    result = (value >> 1) | (old_carry << 7)
-
-    cpu._state.C = result
-    cpu._state.zf = 1 if result == 0 else 0
-    cpu._state.nf = 0
-    cpu._state.hf = 0
-    cpu._state.cf = new_carry
-
-
-@register_cb_instruction(0x1A, 0, 8)
-def handle_cb_rr_d(logger, cpu, instruction):
-    old_carry = cpu._state.cf
-    value = cpu._state.D
-
-    new_carry = value & 0x01
-    result = (value >> 1) | (old_carry << 7)
+    state._a = result & 0xFF
+"""
 
-    cpu._state.D = result
-    cpu._state.zf = 1 if result == 0 else 0
-    cpu._state.nf = 0
-    cpu._state.hf = 0
-    cpu._state.cf = new_carry
+register_family(register_instruction, "handle_sbc_a", SBC_A_TEMPLATE, range(0x98, 0xA0), 4, 4)
 
 
 @register_instruction(0x0, 0, 4)
@@ -214,66 +206,19 @@ def handle_nop(logger, cpu, instruction):
     pass
 
 
-def handle_cb_generic_rlc(state, register_name):
-    old_bit7 = None
-    result = None
-
-    if register_name == "(HL)":
-        value = state.memory.read(state.HL)
-        old_bit7 = (value >> 7) & 0x01
-        result = ((value << 1) & 0xFF) | old_bit7
-        state.memory.write(state.HL, result)
-    else:
-        value = getattr(state, register_name)
-        old_bit7 = (value >> 7) & 0x01
-        result = ((value << 1) & 0xFF) | old_bit7
-        setattr(state, register_name, result)
+CB_RLC_TEMPLATE = """
+    value = {load}
+    old_bit7 = (value >> 7) & 0x01
+    result = ((value << 1) & 0xFF) | old_bit7
+    {store}
 
-    # state.B = result
     state.cf = old_bit7
     state.nf = 0
     state.hf = 0
     state.zf = 1 if result == 0 else 0
+"""
 
-
-@register_cb_instruction(0x00, 8)
-def handle_cb_rlcb(logger, cpu, instruction):
-    handle_cb_generic_rlc(cpu._state, "B")
-
-
-@register_cb_instruction(0x01, 8)
-def handle_cb_rlcc(logger, cpu, instruction):
-    handle_cb_generic_rlc(cpu._state, "C")
-
-
-@register_cb_instruction(0x02, 8)
-def handle_cb_rlcd(logger, cpu, instruction):
-    handle_cb_generic_rlc(cpu._state, "D")
-
-
-@register_cb_instruction(0x03, 8)
-def handle_cb_rlce(logger, cpu, instruction):
-    handle_cb_generic_rlc(cpu._state, "E")
-
-
-@register_cb_instruction(0x04, 0, 8)
-def handle_cb_rlch(logger, cpu, instruction):
-    handle_cb_generic_rlc(cpu._state, "H")
-
-
-@register_cb_instruction(0x05, 0, 8)
-def handle_cb_rlcl(logger, cpu, instruction):
-    handle_cb_generic_rlc(cpu._state, "L")
-
-
-@register_cb_instruction(0x06, 0, 16)
-def handle_cb_rlc_hl_mem(logger, cpu, instruction):
-    handle_cb_generic_rlc(cpu._state, "(HL)")
-
-
-@register_cb_instruction(0x07, 0, 8)
-def handle_cb_rlc_a(logger, cpu, instruction):
-    handle_cb_generic_rlc(cpu._state, "A")
+register_family(register_cb_instruction, "handle_cb_rlc", CB_RLC_TEMPLATE, range(0x00, 0x08), 8, 16)
 
 
 @register_instruction(0x1F, 0, 4)
@@ -321,7 +266,7 @@ def handle_daa(logger, cpu, instruction):
 def handle_stop(logger, cpu, instruction):
     logger.debug("STOP instruction executed")
     # STOP är två bytes: 0x10 + nästa byte (som oftast är 0x00)
-    cpu._state.pc += 1  # hoppa över extra byte
+    cpu._state.pc = (cpu._state.pc + 1) & 0xFFFF  # hoppa över extra byte
     # Ingen flagga sätts, ingen effekt på register — bara ignorera
 
 
@@ -404,80 +349,30 @@ def handle_inc_hl(logger, cpu, instruction):
     cpu._state.HL = (cpu._state.HL + 1) & 0xFFFF
 
 
-def handle_generic_inc(state, register_name):
-    old_value = None
-    new_value = None
+INC_TEMPLATE = """
+    value = {load}
+    result = (value + 1) & 0xFF
+    {store}
 
-    if register_name == "(HL)":
-        old_value = state.memory.read(state.HL)
-        new_value = (old_value + 1) & 0xFF
-        state.memory.write(state.HL, new_value)
-    else:
-        old_value = getattr(state, register_name)
-        new_value = (old_value + 1) & 0xFF
-        setattr(state, register_name, new_value)
-
-    state.zf = 1 if new_value == 0 else 0
+    state.zf = 1 if result == 0 else 0
     state.nf = 0
-    state.hf = 1 if (old_value & 0x0F) == 0x0F else 0
-
-
-@register_instruction(0x3C, 0, 4)
-def handle_inc_a(logger, cpu, instruction):
-    handle_generic_inc(cpu._state, "A")
-
-
-@register_instruction(0x0C, 0, 4)
-def handle_inc_c(logger, cpu, instruction):
-    handle_generic_inc(cpu._state, "C")
-
-
-@register_instruction(0x04, 0, 4)
-def handle_inc_b(logger, cpu, instruction):
-    handle_generic_inc(cpu._state, "B")
-
-
-@register_instruction(0x2C, 0, 4)
-def handle_inc_l(logger, cpu, instruction):
-    handle_generic_inc(cpu._state, "L")
-
-
-@register_instruction(0x24, 0, 4)
-def handle_inc_h(logger, cpu, instruction):
-    handle_generic_inc(cpu._state, "_h")
-
-
-@register_instruction(0x34, 0, 12)
-def handle_inc_hl_mem(logger, cpu, instruction):
-    handle_generic_inc(cpu._state, "(HL)")
+    state.hf = 1 if (value & 0x0F) == 0x0F else 0
+"""
 
+register_family(register_instruction, "handle_inc", INC_TEMPLATE, range(0x04, 0x40, 8), 4, 12)
 
-def handle_generic_dec(state, register_name):
-    old_value = None
-    new_value = None
 
-    if register_name == "(HL)":
-        old_value = state.memory.read(state.HL)
-        new_value = (old_value - 1) & 0xFF
-        state.memory.write(state.HL, new_value)
-    else:
-        old_value = getattr(state, register_name)
-        new_value = (old_value - 1) & 0xFF
-        setattr(state, register_name, new_value)
+DEC_TEMPLATE = """
+    value = {load}
+    result = (value - 1) & 0xFF
+    {store}
 
-    state.zf = 1 if new_value == 0 else 0
+    state.zf = 1 if result == 0 else 0
     state.nf = 1
-    state.hf = 1 if (old_value & 0x0F) == 0 else 0
-
+    state.hf = 1 if (value & 0x0F) == 0 else 0
+"""
 
-@register_instruction(0x3D, 0, 4)
-def handle_dec_a(logger, cpu, instruction):
-    handle_generic_dec(cpu._state, "A")
-
-
-@register_instruction(0x35, 0, 12)
-def handle_dec_hl_mem(logger, cpu, instruction):
-    handle_generic_dec(cpu._state, "(HL)")
+register_family(register_instruction, "handle_dec", DEC_TEMPLATE, range(0x05, 0x40, 8), 4, 12)
 
 
 @register_instruction(0x1A, 0, 8)
@@ -490,11 +385,6 @@ def handle_ld_mem_de_a(logger, cpu, instruction):
     cpu._state.memory.write(cpu._state.DE, cpu._state.A)
 
 
-@register_instruction(0x1C, 0, 4)
-def handle_inc_e(logger, cpu, instruction):
-    handle_generic_inc(cpu._state, "E")
-
-
 @register_instruction(0x30, 1, 12)
 def handle_jr_nc_r8(logger, cpu, instruction):
     value = instruction[1]
@@ -514,7 +404,7 @@ def handle_jr_nz(logger, cpu, instruction):
         value = value - 0x100
 
     if not cpu._state.zf:
-        cpu._state.pc += value
+        cpu._state.pc = (cpu._state.pc + value) & 0xFFFF
     else:
         return 8
 
@@ -526,7 +416,7 @@ def handle_jr_c(logger, cpu, instruction):
         value = value - 0x100
 
     if cpu._state.cf:
-        cpu._state.pc += value
+        cpu._state.pc = (cpu._state.pc + value) & 0xFFFF
     else:
         return 8
 
@@ -538,7 +428,7 @@ def handle_jr_z(logger, cpu, instruction):
         value = value - 0x100
 
     if cpu._state.zf:
-        cpu._state.pc += value
+        cpu._state.pc = (cpu._state.pc + value) & 0xFFFF
     else:
         return 8
 
@@ -549,59 +439,19 @@ def handle_ld_hdl_a(logger, cpu, instruction):
     cpu._state.HL = (cpu._state.HL - 1) & 0xFFFF
 
 
-def handle_generic_sub_a(state, register_name):
-    value = None
-    if register_name == "(HL)":
-        value = state.memory.read(state.HL)
-    else:
-        value = getattr(state, register_name)
+SUB_A_TEMPLATE = """
+    value = {load}
+    a = state._a
+    result = a - value
 
-    result = state.A - value
     state.zf = 1 if (result & 0xFF) == 0 else 0
     state.nf = 1
-    state.hf = 1 if (state.A & 0xF) < (value & 0xF) else 0
-    state.cf = 1 if state.A < value else 0
-    state.A = result & 0xFF
-
-
-@register_instruction(0x90, 0, 4)
-def handle_sub_a_b(logger, cpu, instruction):
-    handle_generic_sub_a(cpu._state, "B")
-
+    state.hf = 1 if (a & 0xF) < (value & 0xF) else 0
+    state.cf = 1 if a < value else 0
+    state._a = result & 0xFF
+"""
 
-@register_instruction(0x91, 0, 4)
-def handle_sub_a_c(logger, cpu, instruction):
-    handle_generic_sub_a(cpu._state, "C")
-
-
-@register_instruction(0x92, 0, 4)
-def handle_sub_a_d(logger, cpu, instruction):
-    handle_generic_sub_a(cpu._state, "D")
-
-
-@register_instruction(0x93, 0, 4)
-def handle_sub_a_e(logger, cpu, instruction):
-    handle_generic_sub_a(cpu._state, "E")
-
-
-@register_instruction(0x94, 0, 4)
-def handle_sub_a_h(logger, cpu, instruction):
-    handle_generic_sub_a(cpu._state, "H")
-
-
-@register_instruction(0x95, 0, 4)
-def handle_sub_a_l(logger, cpu, instruction):
-    handle_generic_sub_a(cpu._state, "L")
-
-
-@register_instruction(0x96, 0, 8)
-def handle_sub_a_hl_mem(logger, cpu, instruction):
-    handle_generic_sub_a(cpu._state, "(HL)")
-
-
-@register_instruction(0x97, 0, 4)
-def handle_sub_a_a(logger, cpu, instruction):
-    handle_generic_sub_a(cpu._state, "A")
+register_family(register_instruction, "handle_sub_a", SUB_A_TEMPLATE, range(0x90, 0x98), 4, 8)
 
 
 @register_instruction(0xD6, 1, 8)
@@ -615,39 +465,6 @@ def handle_sub_a_d8(logger, cpu, instruction):
     cpu._state.A = result & 0xFF
 
 
-@register_instruction(0xB7, 0, 4)
-def handle_or_a(logger, cpu, instruction):
-    cpu._state.zf = 1 if cpu._state.A == 0 else 0
-    cpu._state.nf = 0
-    cpu._state.hf = 0
-    cpu._state.cf = 0
-
-
-@register_instruction(0xB6, 0, 8)
-def handle_or_hl_mem(logger, cpu, instruction):
-    value = cpu._state.memory.read(cpu._state.HL)
-    cpu._state.A = cpu._state.A | value
-
-    cpu._state.zf = 1 if cpu._state.A == 0 else 0
-    cpu._state.nf = 0
-    cpu._state.hf = 0
-    cpu._state.cf = 0
-
-
-@register_instruction(0x35, 0, 12)
-def handle_dec_hl_mem(logger, cpu, instruction):
-    address = cpu._state.HL
-    value = cpu._state.memory.read(address)
-    old_value = value
-
-    value = (value - 1) & 0xFF
-    cpu._state.memory.write(address, value)
-
-    cpu._state.zf = 1 if value == 0 else 0
-    cpu._state.nf = 1
-    cpu._state.hf = 1 if (old_value & 0x0F) == 0 else 0
-
-
 @register_instruction(0xD2, 2, 16)
 def handle_jp_nc_a16(logger, cpu, instruction):
     address = instruction[1] | (instruction[2] << 8)
@@ -847,23 +664,17 @@ def handle_ld_h_d8(logger, cpu, instruction):
     cpu._state.H = value
 
 
-@register_instruction(0xAE, 0, 8)
-def handle_a_xor_hl_mem_address(logger, cpu, instruction):
-    value = cpu._state.memory.read(cpu._state.HL)
-    cpu._state.A ^= value
-    cpu._state.zf = 1 if cpu._state.A == 0 else 0
-    cpu._state.nf = 0
-    cpu._state.hf = 0
-    cpu._state.cf = 0
-
+XOR_A_TEMPLATE = """
+    result = state._a ^ {load}
+    state._a = result
 
-def handle_generic_xor_a(state, register_name):
-    value = getattr(state, register_name)
-    state.A = state.A ^ value
-    state.zf = 1 if state.A == 0 else 0
+    state.zf = 1 if result == 0 else 0
     state.nf = 0
     state.hf = 0
     state.cf = 0
+"""
+
+register_family(register_instruction, "handle_xor_a", XOR_A_TEMPLATE, range(0xA8, 0xB0), 4, 8)
 
 
 @register_instruction(0x17, 0, 4)
@@ -880,41 +691,6 @@ def handle_rla(logger, cpu, instruction):
     cpu._state.zf = 0  # CHATGPU SUGGESTION
 
 
-@register_instruction(0xAD, 0, 4)
-def handle_a_xor_l(logger, cpu, instruction):
-    handle_generic_xor_a(cpu._state, "L")
-
-
-@register_instruction(0xA8, 0, 4)
-def handle_a_xor_b(logger, cpu, instruction):
-    handle_generic_xor_a(cpu._state, "B")
-
-
-@register_instruction(0xA9, 0, 4)
-def handle_a_xor_c(logger, cpu, instruction):
-    handle_generic_xor_a(cpu._state, "C")
-
-
-@register_instruction(0xAF, 0, 4)
-def handle_xor_a(logger, cpu, instruction):
-    handle_generic_xor_a(cpu._state, "A")
-
-
-@register_instruction(0xAA, 0, 4)
-def handle_xor_d(logger, cpu, instruction):
-    handle_generic_xor_a(cpu._state, "D")
-
-
-@register_instruction(0xAB, 0, 4)
-def handle_xor_e(logger, cpu, instruction):
-    handle_generic_xor_a(cpu._state, "E")
-
-
-@register_instruction(0xAC, 0, 4)
-def handle_xor_h(logger, cpu, instruction):
-    handle_generic_xor_a(cpu._state, "H")
-
-
 @register_instruction(0xEE, 1, 8)
 def handle_a_xor_d8(logger, cpu, instruction):
     value = instruction[1] & 0xFF
@@ -925,21 +701,6 @@ def handle_a_xor_d8(logger, cpu, instruction):
     cpu._state.cf = 0
 
 
-@register_instruction(0x14, 0, 4)
-def handle_inc_d(logger, cpu, instruction):
-    handle_generic_inc(cpu._state, "D")
-
-
-@register_instruction(0x15, 0, 4)
-def handle_dec_d(logger, cpu, instruction):
-    handle_generic_dec(cpu._state, "D")
-
-
-@register_instruction(0x25, 0, 4)
-def handle_dec_h(logger, cpu, instruction):
-    handle_generic_dec(cpu._state, "H")
-
-
 @register_instruction(0x6F, 0, 4)
 def handle_ld_l_a(logger, cpu, instruction):
     cpu._state.L = cpu._state.A
@@ -1048,16 +809,6 @@ def handle_ld_e_hl_mem_address(logger, cpu, instruction):
     cpu._state.E = cpu._state.memory.read(cpu._state.HL)
 
 
-@register_instruction(0x2D, 0, 4)
-def handle_dec_l(logger, cpu, instruction):
-    handle_generic_dec(cpu._state, "L")
-
-
-@register_instruction(0x1D, 0, 4)
-def handle_dec_e(logger, cpu, instruction):
-    handle_generic_dec(cpu._state, "E")
-
-
 @register_instruction(0x0B, 0, 8)
 def handle_dec_bc(logger, cpu, instruction):
     cpu._state.BC = (cpu._state.BC - 1) & 0xFFFF
@@ -1078,21 +829,11 @@ def handle_dec_sp(logger, cpu, instruction):
     cpu._state.SP = (cpu._state.SP - 1) & 0xFFFF
 
 
-@register_instruction(0x0D, 0, 4)
-def handle_dec_c(logger, cpu, instruction):
-    handle_generic_dec(cpu._state, "C")
-
-
 @register_instruction(0xE9, 0, 4)
 def handle_jp_hl(logger, cpu, instruction):
     cpu._state.pc = cpu._state.HL
 
 
-@register_instruction(0x05, 0, 4)
-def handle_dec_b(logger, cpu, instruction):
-    handle_generic_dec(cpu._state, "B")
-
-
 @register_instruction(0x7E, 0, 8)
 def handle_ld_a_hl_mem_address(logger, cpu, instruction):
     cpu._state.A = cpu._state.memory.read(cpu._state.HL)
@@ -1183,6 +924,7 @@ def handle_ld_a_a16(logger, cpu, instruction):
 def handle_ei(logger, cpu, instruction):
     # cpu._state.enable_interrupts_after_next_instruction = True
     cpu._state._delay_enable_ime = True
+    cpu._scheduler.request_service()
     # logger.info('Setting delay_enable_ime to true!')
 
 
@@ -1213,14 +955,17 @@ def inc_bc(logger, cpu, instruction):
     cpu._state.BC = (cpu._state.BC + 1) & 0xFFFF
 
 
-def handle_generic_or(state, register_name):
-    or_value = getattr(state, register_name)
+OR_A_TEMPLATE = """
+    result = state._a | {load}
+    state._a = result
 
-    state.A |= or_value
-    state.zf = 1 if state.A == 0 else 0
+    state.zf = 1 if result == 0 else 0
     state.nf = 0
     state.hf = 0
     state.cf = 0
+"""
+
+register_family(register_instruction, "handle_or_a", OR_A_TEMPLATE, range(0xB0, 0xB8), 4, 8)
 
 
 @register_instruction(0xDE, 1, 8)
@@ -1249,31 +994,6 @@ def handle_or_d8(logger, cpu, instruction):
     cpu._state.cf = 0
 
 
-@register_instruction(0xB0, 0, 4)
-def handle_or_b(logger, cpu, instruction):
-    handle_generic_or(cpu._state, "B")
-
-
-@register_instruction(0xB2, 0, 4)
-def handle_or_d(logger, cpu, instruction):
-    handle_generic_or(cpu._state, "D")
-
-
-@register_instruction(0xB3, 0, 4)
-def handle_or_e(logger, cpu, instruction):
-    handle_generic_or(cpu._state, "E")
-
-
-@register_instruction(0xB4, 0, 4)
-def handle_or_h(logger, cpu, instruction):
-    handle_generic_or(cpu._state, "H")
-
-
-@register_instruction(0xB5, 0, 4)
-def handle_or_l(logger, cpu, instruction):
-    handle_generic_or(cpu._state, "L")
-
-
 @register_instruction(0xE8, 1, 16)
 def handle_add_sp_r8(logger, cpu, instruction):
     sp = cpu._state.SP
@@ -1306,15 +1026,6 @@ def handle_add_hl_sp(logger, cpu, instruction):
     cpu._state.HL = result & 0xFFFF
 
 
-@register_instruction(0xB1, 0, 4)
-def handle_or_c(logger, cpu, instruction):
-    cpu._state.A |= cpu._state.C
-    cpu._state.zf = 1 if cpu._state.A == 0 else 0
-    cpu._state.nf = 0
-    cpu._state.hf = 0
-    cpu._state.cf = 0
-
-
 @register_instruction(0x08, 2, 20)
 def handle_ld_a16_sp(logger, cpu, instruction):
     address = instruction[1] | (instruction[2] << 8)
@@ -1328,25 +1039,17 @@ def handle_ld_a16_a(logger, cpu, instruction):
     cpu._state.memory.write(address, cpu._state.A)
 
 
-def handle_generic_and_(state, destination_register_name, value_register_name):
-    value = getattr(state, value_register_name)
-    new_value = getattr(state, destination_register_name) & value
-    setattr(state, destination_register_name, new_value)
+AND_A_TEMPLATE = """
+    result = state._a & {load}
+    state._a = result
 
-    state.zf = 1 if new_value == 0 else 0
+    state.zf = 1 if result == 0 else 0
     state.nf = 0
     state.hf = 1
     state.cf = 0
+"""
 
-
-def handle_generic_and_a(state, register_name):
-    value = getattr(state, register_name)
-    state.A = state.A & value
-
-    state.zf = 1 if state.A == 0 else 0
-    state.nf = 0
-    state.hf = 1
-    state.cf = 0
+register_family(register_instruction, "handle_and_a", AND_A_TEMPLATE, range(0xA0, 0xA8), 4, 8)
 
 
 @register_instruction(0xE6, 1, 8)
@@ -1409,60 +1112,20 @@ def handle_adc_a_d8(logger, cpu, instruction):
     cpu._state.A = result & 0xFF
 
 
-def handle_generic_adc_a(state, register_name):
-    value = None
-    if register_name == "(HL)":
-        value = state.memory.read(state.HL)
-    else:
-        value = getattr(state, register_name)
+ADC_A_TEMPLATE = """
+    value = {load}
     carry = state.cf
-    result = state.A + value + carry
+    a = state._a
+    result = a + value + carry
 
     state.zf = 1 if (result & 0xFF) == 0 else 0
     state.nf = 0
-    state.hf = 1 if ((state.A & 0xF) + (value & 0xF) + carry) > 0xF else 0
+    state.hf = 1 if ((a & 0xF) + (value & 0xF) + carry) > 0xF else 0
     state.cf = 1 if result > 0xFF else 0
-    state.A = result & 0xFF
-
-
-@register_instruction(0x88, 0, 8)
-def handle_adc_a_b(logger, cpu, instruction):
-    handle_generic_adc_a(cpu._state, "B")
+    state._a = result & 0xFF
+"""
 
-
-@register_instruction(0x89, 0, 8)
-def handle_adc_a_c(logger, cpu, instruction):
-    handle_generic_adc_a(cpu._state, "C")
-
-
-@register_instruction(0x8A, 0, 8)
-def handle_adc_a_d(logger, cpu, instruction):
-    handle_generic_adc_a(cpu._state, "D")
-
-
-@register_instruction(0x8B, 0, 8)
-def handle_adc_a_e(logger, cpu, instruction):
-    handle_generic_adc_a(cpu._state, "E")
-
-
-@register_instruction(0x8C, 0, 8)
-def handle_adc_a_h(logger, cpu, instruction):
-    handle_generic_adc_a(cpu._state, "H")
-
-
-@register_instruction(0x8D, 0, 8)
-def handle_adc_a_l(logger, cpu, instruction):
-    handle_generic_adc_a(cpu._state, "L")
-
-
-@register_instruction(0x8E, 0, 8)
-def handle_adc_a_hl_mem(logger, cpu, instruction):
-    handle_generic_adc_a(cpu._state, "(HL)")
-
-
-@register_instruction(0x8F, 0, 8)
-def handle_adc_a_a(logger, cpu, instruction):
-    handle_generic_adc_a(cpu._state, "A")
+register_family(register_instruction, "handle_adc_a", ADC_A_TEMPLATE, range(0x88, 0x90), 8, 8)
 
 
 @register_instruction(0xD0, 0, 20)
@@ -1506,6 +1169,7 @@ def handle_reti(logger, cpu, instruction):
     address = (high << 8) | low
     cpu._state.pc = address
     cpu._state.ime = 1
+    cpu._scheduler.request_service()
 
 
 @register_instruction(0xC8, 0, 20)
@@ -1794,7 +1458,7 @@ def handle_jr_r8(logger, cpu, instruction):
     if value & 0x80:
         value = value - 0x100
 
-    cpu._state.pc += value
+    cpu._state.pc = (cpu._state.pc + value) & 0xFFFF
 
     (f"JR R8: ZF={cpu._state.zf}, value={value}")
 
@@ -1831,6 +1495,7 @@ def handle_push_de(logger, cpu, instruction):
 @register_instruction(0x76, 0, 4)
 def handle_hlt(logger, cpu, instruction):
     cpu._state._halted = True
+    cpu._scheduler.request_service()
 
 
 @register_instruction(0x56, 0, 8)
@@ -1991,124 +1656,33 @@ def handle_ld_hl_with_sp_plus_r8(logger, cpu, instruction):
     cpu._state.cf = 1 if ((cpu._state.SP & 0xFF) + (offset & 0xFF)) > 0xFF else 0
 
 
-def handle_cb_generic_swap(state, register_name):
-    result = None
-
-    if register_name == "(HL)":
-        value = state.memory.read(state.HL)
-        result = ((value & 0x0F) << 4) | ((value & 0xF0) >> 4)
-        state.memory.write(state.HL, result)
-    else:
-        value = getattr(state, register_name)
-        result = ((value & 0x0F) << 4) | ((value & 0xF0) >> 4)
-        setattr(state, register_name, result)
+CB_SWAP_TEMPLATE = """
+    value = {load}
+    result = ((value & 0x0F) << 4) | ((value & 0xF0) >> 4)
+    {store}
 
     state.zf = 1 if result == 0 else 0
     state.nf = 0
     state.hf = 0
     state.cf = 0
+"""
 
+register_family(register_cb_instruction, "handle_cb_swap", CB_SWAP_TEMPLATE, range(0x30, 0x38), 8, 16)
 
-@register_cb_instruction(0x30, 0, 8)
-def handle_cb_swap_b(logger, cpu, instruction):
-    handle_cb_generic_swap(cpu._state, "B")
-
-
-@register_cb_instruction(0x31, 0, 8)
-def handle_cb_swap_c(logger, cpu, instruction):
-    handle_cb_generic_swap(cpu._state, "C")
-
-
-@register_cb_instruction(0x32, 0, 8)
-def handle_cb_swap_d(logger, cpu, instruction):
-    handle_cb_generic_swap(cpu._state, "D")
-
-
-@register_cb_instruction(0x33, 0, 8)
-def handle_cb_swap_e(logger, cpu, instruction):
-    handle_cb_generic_swap(cpu._state, "E")
-
-
-@register_cb_instruction(0x34, 0, 8)
-def handle_cb_swap_h(logger, cpu, instruction):
-    handle_cb_generic_swap(cpu._state, "H")
-
-
-@register_cb_instruction(0x35, 0, 8)
-def handle_cb_swap_l(logger, cpu, instruction):
-    handle_cb_generic_swap(cpu._state, "L")
-
-
-@register_cb_instruction(0x36, 0, 16)
-def handle_cb_swap_hl_mem(logger, cpu, instruction):
-    handle_cb_generic_swap(cpu._state, "(HL)")
-
-
-@register_cb_instruction(0x37, 0, 8)
-def handle_cb_swap_a(logger, cpu, instruction):
-    handle_cb_generic_swap(cpu._state, "A")
-
-
-def handle_generic_rrc(state, register_name):
-    carry_out = None
-    result = None
 
-    if register_name == "(HL)":
-        value = state.memory.read(state.HL)
-        carry_out = value & 0x01
-        result = ((carry_out << 7) | (value >> 1)) & 0xFF
-        state.memory.write(state.HL, result)
-    else:
-        value = getattr(state, register_name)
-        carry_out = value & 0x01
-        result = ((carry_out << 7) | (value >> 1)) & 0xFF
-
-        setattr(state, register_name, result)
+CB_RRC_TEMPLATE = """
+    value = {load}
+    carry_out = value & 0x01
+    result = ((carry_out << 7) | (value >> 1)) & 0xFF
+    {store}
 
     state.cf = carry_out
     state.zf = 1 if result == 0 else 0  # för CB-prefixerade RRC
     state.nf = 0
     state.hf = 0
+"""
 
-
-@register_cb_instruction(0x08, 0, 8)
-def handle_rrc_b(logger, cpu, instruction):
-    handle_generic_rrc(cpu._state, "B")
-
-
-@register_cb_instruction(0x09, 0, 8)
-def handle_rrc_c(logger, cpu, instruction):
-    handle_generic_rrc(cpu._state, "C")
-
-
-@register_cb_instruction(0x0A, 0, 8)
-def handle_rrc_d(logger, cpu, instruction):
-    handle_generic_rrc(cpu._state, "D")
-
-
-@register_cb_instruction(0x0B, 0, 8)
-def handle_cb_rrc_e(logger, cpu, instruction):
-    handle_generic_rrc(cpu._state, "E")
-
-
-@register_cb_instruction(0x0C, 0, 8)
-def handle_cb_rrc_h(logger, cpu, instruction):
-    handle_generic_rrc(cpu._state, "H")
-
-
-@register_cb_instruction(0x0D, 0, 8)
-def handle_cb_rrc_l(logger, cpu, instruction):
-    handle_generic_rrc(cpu._state, "L")
-
-
-@register_cb_instruction(0x0E, 0, 16)
-def handle_cb_rrc_hl_mem(logger, cpu, instruction):
-    handle_generic_rrc(cpu._state, "(HL)")
-
-
-@register_cb_instruction(0x0F, 0, 8)
-def handle_cb_rrc_a(logger, cpu, instruction):
-    handle_generic_rrc(cpu._state, "A")
+register_family(register_cb_instruction, "handle_cb_rrc", CB_RRC_TEMPLATE, range(0x08, 0x10), 8, 16)
 
 
 @register_instruction(0x0F, 0, 4)
@@ -2125,1360 +1699,140 @@ def handle_rrca(logger, cpu, instruction):
     # OBS! cpu._state.zf påverkas INTE!
 
 
-def handle_cb_generic_rl(state, register_name):
-    new_carry = None
-    result = None
+CB_RL_TEMPLATE = """
+    value = {load}
+    new_carry = (value >> 7) & 0x01
+    result = ((value << 1) & 0xFF) | state.cf
+    {store}
 
-    if register_name == "(HL)":
-        value = state.memory.read(state.HL)
-        old_carry = state.cf
-        new_carry = (value >> 7) & 0x01
-        result = ((value << 1) & 0xFF) | old_carry
+    state.cf = new_carry
+    state.zf = 1 if result == 0 else 0
+    state.nf = 0
+    state.hf = 0
+"""
 
-        state.memory.write(state.HL, result)
-    else:
-        value = getattr(state, register_name)
-        old_carry = state.cf
-        new_carry = (value >> 7) & 0x01
-        result = ((value << 1) & 0xFF) | old_carry
+register_family(register_cb_instruction, "handle_cb_rl", CB_RL_TEMPLATE, range(0x10, 0x18), 8, 16)
 
-        setattr(state, register_name, result)
+
+CB_RR_TEMPLATE = """
+    value = {load}
+    new_carry = value & 0x01
+    result = (value >> 1) | (state.cf << 7)
+    {store}
 
     state.cf = new_carry
     state.zf = 1 if result == 0 else 0
     state.nf = 0
     state.hf = 0
+"""
 
+register_family(register_cb_instruction, "handle_cb_rr", CB_RR_TEMPLATE, range(0x18, 0x20), 8, 16)
 
-@register_cb_instruction(0x10, 0, 8)
-def handle_cb_rl_b(logger, cpu, instruction):
-    handle_cb_generic_rl(cpu._state, "B")
 
+CB_SLA_TEMPLATE = """
+    value = {load}
+    new_carry = (value >> 7) & 0x01
+    result = (value << 1) & 0xFF
+    {store}
 
-@register_cb_instruction(0x11, 0, 8)
-def handle_cb_rl_c(logger, cpu, instruction):
-    handle_cb_generic_rl(cpu._state, "C")
+    state.cf = new_carry
+    state.zf = 1 if result == 0 else 0
+    state.nf = 0
+    state.hf = 0
+"""
 
+register_family(register_cb_instruction, "handle_cb_sla", CB_SLA_TEMPLATE, range(0x20, 0x28), 8, 16)
 
-@register_cb_instruction(0x12, 0, 8)
-def handle_cb_rl_d(logger, cpu, instruction):
-    handle_cb_generic_rl(cpu._state, "D")
 
-
-@register_cb_instruction(0x13, 0, 8)
-def handle_cb_rl_e(logger, cpu, instruction):
-    handle_cb_generic_rl(cpu._state, "E")
-
-
-@register_cb_instruction(0x14, 0, 8)
-def handle_cb_rl_h(logger, cpu, instruction):
-    handle_cb_generic_rl(cpu._state, "H")
-
-
-@register_cb_instruction(0x15, 0, 8)
-def handle_cb_rl_l(logger, cpu, instruction):
-    handle_cb_generic_rl(cpu._state, "L")
-
-
-@register_cb_instruction(0x16, 0, 16)
-def handle_cb_rl_hl_mem(logger, cpu, instruction):
-    handle_cb_generic_rl(cpu._state, "(HL)")
-
-
-@register_cb_instruction(0x17, 0, 8)
-def handle_cb_rl_a(logger, cpu, instruction):
-    handle_cb_generic_rl(cpu._state, "A")
-
-
-def handle_cb_generic_rr(state, register_name):
-    new_carry = None
-    result = None
-
-    if register_name == "(HL)":
-        value = state.memory.read(state.HL)
-        old_carry = state.cf
-        new_carry = value & 0x01
-        result = (value >> 1) | (old_carry << 7)
-
-        state.memory.write(state.HL, result)
-    else:
-        value = getattr(state, register_name)
-        old_carry = state.cf
-        new_carry = value & 0x01
-        result = (value >> 1) | (old_carry << 7)
-
-        setattr(state, register_name, result)
-
-    state.cf = new_carry
-    state.zf = 1 if result == 0 else 0
-    state.nf = 0
-    state.hf = 0
-
-
-@register_cb_instruction(0x18, 0, 8)
-def handle_cb_rr_b(logger, cpu, instruction):
-    handle_cb_generic_rr(cpu._state, "B")
-
-
-@register_cb_instruction(0x19, 0, 8)
-def handle_cb_rr_c(logger, cpu, instruction):
-    handle_cb_generic_rr(cpu._state, "C")
-
-
-@register_cb_instruction(0x1A, 0, 8)
-def handle_cb_rr_d(logger, cpu, instruction):
-    handle_cb_generic_rr(cpu._state, "D")
-
-
-@register_cb_instruction(0x1B, 0, 8)
-def handle_cb_rr_e(logger, cpu, instruction):
-    handle_cb_generic_rr(cpu._state, "E")
-
-
-@register_cb_instruction(0x1C, 0, 8)
-def handle_cb_rr_h(logger, cpu, instruction):
-    handle_cb_generic_rr(cpu._state, "H")
-
-
-@register_cb_instruction(0x1D, 0, 8)
-def handle_cb_rr_l(logger, cpu, instruction):
-    handle_cb_generic_rr(cpu._state, "L")
-
-
-@register_cb_instruction(0x1E, 0, 16)
-def handle_cb_rr_hl_mem(logger, cpu, instruction):
-    handle_cb_generic_rr(cpu._state, "(HL)")
-
-
-@register_cb_instruction(0x1F, 0, 8)
-def handle_cb_rr_a(logger, cpu, instruction):
-    handle_cb_generic_rr(cpu._state, "A")
-
-
-def handle_cb_generic_sla(state, register_name):
-    new_carry = None
-    result = None
-
-    if register_name == "(HL)":
-        value = state.memory.read(state.HL)
-        new_carry = (value >> 7) & 0x01
-        result = (value << 1) & 0xFF
-
-        state.memory.write(state.HL, result)
-
-    else:
-        value = getattr(state, register_name)
-        new_carry = (value >> 7) & 0x01
-        result = (value << 1) & 0xFF
-
-        setattr(state, register_name, result)
-
-    state.cf = new_carry
-    state.zf = 1 if result == 0 else 0
-    state.nf = 0
-    state.hf = 0
-
-
-@register_cb_instruction(0x20, 0, 8)
-def handle_cb_sla_b(logger, cpu, instruction):
-    handle_cb_generic_sla(cpu._state, "B")
-
-
-@register_cb_instruction(0x21, 0, 8)
-def handle_cb_sla_c(logger, cpu, instruction):
-    handle_cb_generic_sla(cpu._state, "C")
-
-
-@register_cb_instruction(0x22, 0, 8)
-def handle_cb_sla_d(logger, cpu, instruction):
-    handle_cb_generic_sla(cpu._state, "D")
-
-
-@register_cb_instruction(0x23, 0, 8)
-def handle_cb_sla_e(logger, cpu, instruction):
-    handle_cb_generic_sla(cpu._state, "E")
-
-
-@register_cb_instruction(0x24, 0, 8)
-def handle_cb_sla_h(logger, cpu, instruction):
-    handle_cb_generic_sla(cpu._state, "H")
-
-
-@register_cb_instruction(0x25, 0, 8)
-def handle_cb_sla_l(logger, cpu, instruction):
-    handle_cb_generic_sla(cpu._state, "L")
-
-
-@register_cb_instruction(0x26, 0, 16)
-def handle_cb_sla_hl_mem(logger, cpu, instruction):
-    handle_cb_generic_sla(cpu._state, "(HL)")
-
-
-@register_cb_instruction(0x27, 0, 8)
-def handle_cb_sla_a(logger, cpu, instruction):
-    handle_cb_generic_sla(cpu._state, "A")
-
-
-def handle_cb_generic_sra(state, register_name):
-    new_carry = None
-    result = None
-
-    if register_name == "(HL)":
-        value = state.memory.read(state.HL)
-        new_carry = value & 0x01
-        bit7 = value & 0x80  # bevara sign-bit
-        result = (value >> 1) | bit7
-
-        state.memory.write(state.HL, result)
-    else:
-        value = getattr(state, register_name)
-        new_carry = value & 0x01
-        bit7 = value & 0x80  # bevara sign-bit
-        result = (value >> 1) | bit7
-
-        setattr(state, register_name, result)
+CB_SRA_TEMPLATE = """
+    value = {load}
+    new_carry = value & 0x01
+    result = (value >> 1) | (value & 0x80)  # bevara sign-bit
+    {store}
 
     state.cf = new_carry
     state.zf = 1 if result == 0 else 0
     state.nf = 0
     state.hf = 0
+"""
 
+register_family(register_cb_instruction, "handle_cb_sra", CB_SRA_TEMPLATE, range(0x28, 0x30), 8, 16)
 
-@register_cb_instruction(0x28, 0, 8)
-def handle_cb_sra_b(logger, cpu, instruction):
-    handle_cb_generic_sra(cpu._state, "B")
-
-
-@register_cb_instruction(0x29, 0, 8)
-def handle_cb_sra_c(logger, cpu, instruction):
-    handle_cb_generic_sra(cpu._state, "C")
-
-
-@register_cb_instruction(0x2A, 0, 8)
-def handle_cb_sra_d(logger, cpu, instruction):
-    handle_cb_generic_sra(cpu._state, "D")
-
-
-@register_cb_instruction(0x2B, 0, 8)
-def handle_cb_sra_e(logger, cpu, instruction):
-    handle_cb_generic_sra(cpu._state, "E")
 
-
-@register_cb_instruction(0x2C, 0, 8)
-def handle_cb_sra_h(logger, cpu, instruction):
-    handle_cb_generic_sra(cpu._state, "H")
-
-
-@register_cb_instruction(0x2D, 0, 8)
-def handle_cb_sra_l(logger, cpu, instruction):
-    handle_cb_generic_sra(cpu._state, "L")
-
-
-@register_cb_instruction(0x2E, 0, 16)
-def handle_cb_sra_hl_mem(logger, cpu, instruction):
-    handle_cb_generic_sra(cpu._state, "(HL)")
-
-
-@register_cb_instruction(0x2F, 0, 8)
-def handle_cb_sra_a(logger, cpu, instruction):
-    handle_cb_generic_sra(cpu._state, "A")
-
-
-def handle_cb_generic_srl(state, register_name):
-    carry = None
-    result = None
-
-    if register_name == "(HL)":
-        value = state.memory.read(state.HL)
-        carry = value & 0x01
-        result = (value >> 1) & 0x7F  # bit 7 blir alltid 0
-
-        state.memory.write(state.HL, result)
-    else:
-        value = getattr(state, register_name)
-        carry = value & 0x01
-        result = (value >> 1) & 0x7F  # bit 7 blir alltid 0
-
-        setattr(state, register_name, result)
+CB_SRL_TEMPLATE = """
+    value = {load}
+    carry = value & 0x01
+    result = (value >> 1) & 0x7F  # bit 7 blir alltid 0
+    {store}
 
     state.cf = carry
     state.zf = 1 if result == 0 else 0
     state.nf = 0
     state.hf = 0
+"""
 
+register_family(register_cb_instruction, "handle_cb_srl", CB_SRL_TEMPLATE, range(0x38, 0x40), 8, 16)
 
-@register_cb_instruction(0x38, 0, 8)
-def handle_cb_srl_b(logger, cpu, instruction):
-    handle_cb_generic_srl(cpu._state, "B")
-
-
-@register_cb_instruction(0x39, 0, 8)
-def handle_cb_srl_c(logger, cpu, instruction):
-    handle_cb_generic_srl(cpu._state, "C")
 
-
-@register_cb_instruction(0x3A, 0, 8)
-def handle_cb_srl_d(logger, cpu, instruction):
-    handle_cb_generic_srl(cpu._state, "D")
-
-
-@register_cb_instruction(0x3B, 0, 8)
-def handle_cb_srl_e(logger, cpu, instruction):
-    handle_cb_generic_srl(cpu._state, "E")
-
-
-@register_cb_instruction(0x3C, 0, 8)
-def handle_cb_srl_h(logger, cpu, instruction):
-    handle_cb_generic_srl(cpu._state, "H")
-
-
-@register_cb_instruction(0x3D, 0, 8)
-def handle_cb_srl_l(logger, cpu, instruction):
-    handle_cb_generic_srl(cpu._state, "L")
-
-
-@register_cb_instruction(0x3E, 0, 16)
-def handle_cb_srl_hl_mem(logger, cpu, instruction):
-    handle_cb_generic_srl(cpu._state, "(HL)")
-
-
-@register_cb_instruction(0x3F, 0, 8)
-def handle_cb_srl_a(logger, cpu, instruction):
-    handle_cb_generic_srl(cpu._state, "A")
-
-
-def handle_cb_generic_bit(state, bit, register_name):
-    value = None
-
-    if register_name == "(HL)":
-        value = state.memory.read(state.HL)
-    else:
-        value = getattr(state, register_name)
-
-    state.zf = 0 if (value & (1 << bit)) else 1
+CB_BIT_TEMPLATE = """
+    state.zf = 0 if ({load} & {mask}) else 1
     state.nf = 0
     state.hf = 1
+"""
 
-
-@register_cb_instruction(0x40, 0, 8)
-def handle_cb_bit_0_b(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 0, "B")
-
-
-@register_cb_instruction(0x41, 0, 8)
-def handle_cb_bit_0_c(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 0, "C")
-
-
-@register_cb_instruction(0x42, 0, 8)
-def handle_cb_bit_0_d(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 0, "D")
-
-
-@register_cb_instruction(0x43, 0, 8)
-def handle_cb_bit_0_e(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 0, "E")
-
-
-@register_cb_instruction(0x44, 0, 8)
-def handle_cb_bit_0_h(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 0, "H")
-
-
-@register_cb_instruction(0x45, 0, 8)
-def handle_cb_bit_0_l(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 0, "L")
-
-
-@register_cb_instruction(0x46, 0, 16)
-def handle_cb_bit_0_hl(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 0, "(HL)")
-
-
-@register_cb_instruction(0x47, 0, 8)
-def handle_cb_bit_0_a(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 0, "A")
+for bit in range(8):
+    register_family(
+        register_cb_instruction, f"handle_cb_bit_{bit}", CB_BIT_TEMPLATE,
+        range(0x40 + bit * 8, 0x48 + bit * 8), 8, 16, mask=hex(1 << bit)
+    )
 
 
-@register_cb_instruction(0x48, 0, 8)
-def handle_cb_bit_1_b(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 1, "B")
+CB_RES_TEMPLATE = """
+    result = {load} & {mask}
+    {store}
+"""
 
+for bit in range(8):
+    register_family(
+        register_cb_instruction, f"handle_cb_res_{bit}", CB_RES_TEMPLATE,
+        range(0x80 + bit * 8, 0x88 + bit * 8), 8, 16, mask=hex(0xFF & ~(1 << bit))
+    )
 
-@register_cb_instruction(0x49, 0, 8)
-def handle_cb_bit_1_c(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 1, "C")
 
+CB_SET_TEMPLATE = """
+    result = {load} | {mask}
+    {store}
+"""
 
-@register_cb_instruction(0x4A, 0, 8)
-def handle_cb_bit_1_d(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 1, "D")
+for bit in range(8):
+    register_family(
+        register_cb_instruction, f"handle_cb_set_{bit}", CB_SET_TEMPLATE,
+        range(0xC0 + bit * 8, 0xC8 + bit * 8), 8, 16, mask=hex(1 << bit)
+    )
 
 
-@register_cb_instruction(0x4B, 0, 8)
-def handle_cb_bit_1_e(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 1, "E")
-
-
-@register_cb_instruction(0x4C, 0, 8)
-def handle_cb_bit_1_h(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 1, "H")
-
-
-@register_cb_instruction(0x4D, 0, 8)
-def handle_cb_bit_1_l(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 1, "L")
-
-
-@register_cb_instruction(0x4E, 0, 16)
-def handle_cb_bit_1_hl(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 1, "(HL)")
-
-
-@register_cb_instruction(0x4F, 0, 8)
-def handle_cb_bit_1_a(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 1, "A")
-
-
-@register_cb_instruction(0x50, 0, 8)
-def handle_cb_bit_2_b(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 2, "B")
-
-
-@register_cb_instruction(0x51, 0, 8)
-def handle_cb_bit_2_c(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 2, "C")
-
-
-@register_cb_instruction(0x52, 0, 8)
-def handle_cb_bit_2_d(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 2, "D")
-
-
-@register_cb_instruction(0x53, 0, 8)
-def handle_cb_bit_2_e(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 2, "E")
-
-
-@register_cb_instruction(0x54, 0, 8)
-def handle_cb_bit_2_h(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 2, "H")
-
-
-@register_cb_instruction(0x55, 0, 8)
-def handle_cb_bit_2_l(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 2, "L")
-
-
-@register_cb_instruction(0x56, 0, 16)
-def handle_cb_bit_2_hl(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 2, "(HL)")
-
-
-@register_cb_instruction(0x57, 0, 8)
-def handle_cb_bit_2_a(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 2, "A")
-
-
-@register_cb_instruction(0x58, 0, 8)
-def handle_cb_bit_3_b(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 3, "B")
-
-
-@register_cb_instruction(0x59, 0, 8)
-def handle_cb_bit_3_c(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 3, "C")
-
-
-@register_cb_instruction(0x5A, 0, 8)
-def handle_cb_bit_3_d(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 3, "D")
-
-
-@register_cb_instruction(0x5B, 0, 8)
-def handle_cb_bit_3_e(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 3, "E")
-
-
-@register_cb_instruction(0x5C, 0, 8)
-def handle_cb_bit_3_h(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 3, "H")
-
-
-@register_cb_instruction(0x5D, 0, 8)
-def handle_cb_bit_3_l(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 3, "L")
-
-
-@register_cb_instruction(0x5E, 0, 16)
-def handle_cb_bit_3_hl(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 3, "(HL)")
-
-
-@register_cb_instruction(0x5F, 0, 8)
-def handle_cb_bit_3_a(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 3, "A")
-
-
-@register_cb_instruction(0x60, 0, 8)
-def handle_cb_bit_4_b(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 4, "B")
-
-
-@register_cb_instruction(0x61, 0, 8)
-def handle_cb_bit_4_c(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 4, "C")
-
-
-@register_cb_instruction(0x62, 0, 8)
-def handle_cb_bit_4_d(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 4, "D")
-
-
-@register_cb_instruction(0x63, 0, 8)
-def handle_cb_bit_4_e(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 4, "E")
-
-
-@register_cb_instruction(0x64, 0, 8)
-def handle_cb_bit_4_h(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 4, "H")
-
-
-@register_cb_instruction(0x65, 0, 8)
-def handle_cb_bit_4_l(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 4, "L")
-
-
-@register_cb_instruction(0x66, 0, 16)
-def handle_cb_bit_4_hl(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 4, "(HL)")
-
-
-@register_cb_instruction(0x67, 0, 8)
-def handle_cb_bit_4_a(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 4, "A")
-
-
-@register_cb_instruction(0x68, 0, 8)
-def handle_cb_bit_5_b(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 5, "B")
-
-
-@register_cb_instruction(0x69, 0, 8)
-def handle_cb_bit_5_c(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 5, "C")
-
-
-@register_cb_instruction(0x6A, 0, 8)
-def handle_cb_bit_5_d(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 5, "D")
-
-
-@register_cb_instruction(0x6B, 0, 8)
-def handle_cb_bit_5_e(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 5, "E")
-
-
-@register_cb_instruction(0x6C, 0, 8)
-def handle_cb_bit_5_h(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 5, "H")
-
-
-@register_cb_instruction(0x6D, 0, 8)
-def handle_cb_bit_5_l(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 5, "L")
-
-
-@register_cb_instruction(0x6E, 0, 16)
-def handle_cb_bit_5_hl(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 5, "(HL)")
-
-
-@register_cb_instruction(0x6F, 0, 8)
-def handle_cb_bit_5_a(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 5, "A")
-
-
-@register_cb_instruction(0x70, 0, 8)
-def handle_cb_bit_6_b(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 6, "B")
-
-
-@register_cb_instruction(0x71, 0, 8)
-def handle_cb_bit_6_c(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 6, "C")
-
-
-@register_cb_instruction(0x72, 0, 8)
-def handle_cb_bit_6_d(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 6, "D")
-
-
-@register_cb_instruction(0x73, 0, 8)
-def handle_cb_bit_6_e(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 6, "E")
-
-
-@register_cb_instruction(0x74, 0, 8)
-def handle_cb_bit_6_h(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 6, "H")
-
-
-@register_cb_instruction(0x75, 0, 8)
-def handle_cb_bit_6_l(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 6, "L")
-
-
-@register_cb_instruction(0x76, 0, 16)
-def handle_cb_bit_6_hl(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 6, "(HL)")
-
-
-@register_cb_instruction(0x77, 0, 8)
-def handle_cb_bit_6_a(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 6, "A")
-
-
-@register_cb_instruction(0x78, 0, 8)
-def handle_cb_bit_7_b(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 7, "B")
-
-
-@register_cb_instruction(0x79, 0, 8)
-def handle_cb_bit_7_c(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 7, "C")
-
-
-@register_cb_instruction(0x7A, 0, 8)
-def handle_cb_bit_7_d(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 7, "D")
-
-
-@register_cb_instruction(0x7B, 0, 8)
-def handle_cb_bit_7_e(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 7, "E")
-
-
-@register_cb_instruction(0x7C, 0, 8)
-def handle_cb_bit_7_h(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 7, "H")
-
-
-@register_cb_instruction(0x7D, 0, 8)
-def handle_cb_bit_7_l(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 7, "L")
-
-
-@register_cb_instruction(0x7E, 0, 16)
-def handle_cb_bit_7_hl(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 7, "(HL)")
-
-
-@register_cb_instruction(0x7F, 0, 8)
-def handle_cb_bit_7_a(logger, cpu, instruction):
-    handle_cb_generic_bit(cpu._state, 7, "A")
-
-
-def handle_cb_generic_res(state, bit, register_name):
-    if register_name == "(HL)":
-        value = state.memory.read(state.HL)
-        state.memory.write(state.HL, value & ~(1 << bit))
-    else:
-        value = getattr(state, register_name) & ~(1 << bit)
-        setattr(state, register_name, value)
-
-
-@register_cb_instruction(0x80, 0, 8)
-def handle_cb_res_0_b(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 0, "B")
-
-
-@register_cb_instruction(0x81, 0, 8)
-def handle_cb_res_0_c(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 0, "C")
-
-
-@register_cb_instruction(0x82, 0, 8)
-def handle_cb_res_0_d(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 0, "D")
-
-
-@register_cb_instruction(0x83, 0, 8)
-def handle_cb_res_0_e(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 0, "E")
-
-
-@register_cb_instruction(0x84, 0, 8)
-def handle_cb_res_0_h(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 0, "H")
-
-
-@register_cb_instruction(0x85, 0, 8)
-def handle_cb_res_0_l(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 0, "L")
-
-
-@register_cb_instruction(0x86, 0, 16)
-def handle_cb_res_0_hl(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 0, "(HL)")
-
-
-@register_cb_instruction(0x87, 0, 8)
-def handle_cb_res_0_a(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 0, "A")
-
-
-@register_cb_instruction(0x88, 0, 8)
-def handle_cb_res_1_b(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 1, "B")
+def handle_unknown_opcode(logger, cpu, instruction):
+    if instruction[0] == 0xCB:
+        raise Exception(f"Unknown cb opcode {instruction[1]:01X}")
+    raise Exception(f"Unknown opcode {instruction[0]:04X}")
+
+
+def compile_dispatch_table(table: Dict[int, Instruction]) -> Tuple[Tuple[Callable, int, int], ...]:
+    """
+    Flattens a registration table into a tuple indexed by opcode, holding
+    (handler, operand_count, cycle_count). Unregistered opcodes trap in
+    handle_unknown_opcode.
+    """
+    dispatch_table = []
+    for opcode in range(0x100):
+        entry = table.get(opcode)
+        if entry is None:
+            dispatch_table.append((handle_unknown_opcode, 0, 4))
+        else:
+            dispatch_table.append((entry.handler, entry.operand_count, entry.cycle_count))
 
-
-@register_cb_instruction(0x89, 0, 8)
-def handle_cb_res_1_c(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 1, "C")
-
-
-@register_cb_instruction(0x8A, 0, 8)
-def handle_cb_res_1_d(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 1, "D")
-
-
-@register_cb_instruction(0x8B, 0, 8)
-def handle_cb_res_1_e(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 1, "E")
-
-
-@register_cb_instruction(0x8C, 0, 8)
-def handle_cb_res_1_h(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 1, "H")
-
-
-@register_cb_instruction(0x8D, 0, 8)
-def handle_cb_res_1_l(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 1, "L")
-
-
-@register_cb_instruction(0x8E, 0, 16)
-def handle_cb_res_1_hl(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 1, "(HL)")
-
-
-@register_cb_instruction(0x8F, 0, 8)
-def handle_cb_res_1_a(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 1, "A")
-
-
-@register_cb_instruction(0x90, 0, 8)
-def handle_cb_res_2_b(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 2, "B")
-
-
-@register_cb_instruction(0x91, 0, 8)
-def handle_cb_res_2_c(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 2, "C")
-
-
-@register_cb_instruction(0x92, 0, 8)
-def handle_cb_res_2_d(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 2, "D")
-
-
-@register_cb_instruction(0x93, 0, 8)
-def handle_cb_res_2_e(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 2, "E")
-
-
-@register_cb_instruction(0x94, 0, 8)
-def handle_cb_res_2_h(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 2, "H")
-
-
-@register_cb_instruction(0x95, 0, 8)
-def handle_cb_res_2_l(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 2, "L")
-
-
-@register_cb_instruction(0x96, 0, 16)
-def handle_cb_res_2_hl(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 2, "(HL)")
-
-
-@register_cb_instruction(0x97, 0, 8)
-def handle_cb_res_2_a(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 2, "A")
-
-
-@register_cb_instruction(0x98, 0, 8)
-def handle_cb_res_3_b(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 3, "B")
-
-
-@register_cb_instruction(0x99, 0, 8)
-def handle_cb_res_3_c(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 3, "C")
-
-
-@register_cb_instruction(0x9A, 0, 8)
-def handle_cb_res_3_d(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 3, "D")
-
-
-@register_cb_instruction(0x9B, 0, 8)
-def handle_cb_res_3_e(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 3, "E")
-
-
-@register_cb_instruction(0x9C, 0, 8)
-def handle_cb_res_3_h(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 3, "H")
-
-
-@register_cb_instruction(0x9D, 0, 8)
-def handle_cb_res_3_l(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 3, "L")
-
-
-@register_cb_instruction(0x9E, 0, 16)
-def handle_cb_res_3_hl(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 3, "(HL)")
-
-
-@register_cb_instruction(0x9F, 0, 8)
-def handle_cb_res_3_a(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 3, "A")
-
-
-@register_cb_instruction(0xA0, 0, 8)
-def handle_cb_res_4_b(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 4, "B")
-
-
-@register_cb_instruction(0xA1, 0, 8)
-def handle_cb_res_4_c(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 4, "C")
-
-
-@register_cb_instruction(0xA2, 0, 8)
-def handle_cb_res_4_d(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 4, "D")
-
-
-@register_cb_instruction(0xA3, 0, 8)
-def handle_cb_res_4_e(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 4, "E")
-
-
-@register_cb_instruction(0xA4, 0, 8)
-def handle_cb_res_4_h(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 4, "H")
-
-
-@register_cb_instruction(0xA5, 0, 8)
-def handle_cb_res_4_l(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 4, "L")
-
-
-@register_cb_instruction(0xA6, 0, 16)
-def handle_cb_res_4_hl(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 4, "(HL)")
-
-
-@register_cb_instruction(0xA7, 0, 8)
-def handle_cb_res_4_a(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 4, "A")
-
-
-@register_cb_instruction(0xA8, 0, 8)
-def handle_cb_res_5_b(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 5, "B")
-
-
-@register_cb_instruction(0xA9, 0, 8)
-def handle_cb_res_5_c(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 5, "C")
-
-
-@register_cb_instruction(0xAA, 0, 8)
-def handle_cb_res_5_d(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 5, "D")
-
-
-@register_cb_instruction(0xAB, 0, 8)
-def handle_cb_res_5_e(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 5, "E")
-
-
-@register_cb_instruction(0xAC, 0, 8)
-def handle_cb_res_5_h(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 5, "H")
-
-
-@register_cb_instruction(0xAD, 0, 8)
-def handle_cb_res_5_l(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 5, "L")
-
-
-@register_cb_instruction(0xAE, 0, 16)
-def handle_cb_res_5_hl(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 5, "(HL)")
-
-
-@register_cb_instruction(0xAF, 0, 8)
-def handle_cb_res_5_a(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 5, "A")
-
-
-@register_cb_instruction(0xB0, 0, 8)
-def handle_cb_res_6_b(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 6, "B")
-
-
-@register_cb_instruction(0xB1, 0, 8)
-def handle_cb_res_6_c(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 6, "C")
-
-
-@register_cb_instruction(0xB2, 0, 8)
-def handle_cb_res_6_d(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 6, "D")
-
-
-@register_cb_instruction(0xB3, 0, 8)
-def handle_cb_res_6_e(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 6, "E")
-
-
-@register_cb_instruction(0xB4, 0, 8)
-def handle_cb_res_6_h(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 6, "H")
-
-
-@register_cb_instruction(0xB5, 0, 8)
-def handle_cb_res_6_l(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 6, "L")
-
-
-@register_cb_instruction(0xB6, 0, 16)
-def handle_cb_res_6_hl(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 6, "(HL)")
-
-
-@register_cb_instruction(0xB7, 0, 8)
-def handle_cb_res_6_a(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 6, "A")
-
-
-@register_cb_instruction(0xB8, 0, 8)
-def handle_cb_res_7_b(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 7, "B")
-
-
-@register_cb_instruction(0xB9, 0, 8)
-def handle_cb_res_7_c(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 7, "C")
-
-
-@register_cb_instruction(0xBA, 0, 8)
-def handle_cb_res_7_d(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 7, "D")
-
-
-@register_cb_instruction(0xBB, 0, 8)
-def handle_cb_res_7_e(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 7, "E")
-
-
-@register_cb_instruction(0xBC, 0, 8)
-def handle_cb_res_7_h(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 7, "H")
-
-
-@register_cb_instruction(0xBD, 0, 8)
-def handle_cb_res_7_l(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 7, "L")
-
-
-@register_cb_instruction(0xBE, 0, 16)
-def handle_cb_res_7_hl(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 7, "(HL)")
-
-
-@register_cb_instruction(0xBF, 0, 8)
-def handle_cb_res_7_a(logger, cpu, instruction):
-    handle_cb_generic_res(cpu._state, 7, "A")
-
-
-def handle_cb_generic_set(state, bit, register_name):
-    if register_name == "(HL)":
-        value = state.memory.read(state.HL)
-        state.memory.write(state.HL, value | (1 << bit))
-    else:
-        value = getattr(state, register_name) | (1 << bit)
-        setattr(state, register_name, value)
-
-
-@register_cb_instruction(0xC0, 0, 8)
-def handle_cb_set_0_b(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 0, "B")
-
-
-@register_cb_instruction(0xC1, 0, 8)
-def handle_cb_set_0_c(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 0, "C")
-
-
-@register_cb_instruction(0xC2, 0, 8)
-def handle_cb_set_0_d(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 0, "D")
-
-
-@register_cb_instruction(0xC3, 0, 8)
-def handle_cb_set_0_e(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 0, "E")
-
-
-@register_cb_instruction(0xC4, 0, 8)
-def handle_cb_set_0_h(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 0, "H")
-
-
-@register_cb_instruction(0xC5, 0, 8)
-def handle_cb_set_0_l(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 0, "L")
-
-
-@register_cb_instruction(0xC6, 0, 16)
-def handle_cb_set_0_hl(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 0, "(HL)")
-
-
-@register_cb_instruction(0xC7, 0, 8)
-def handle_cb_set_0_a(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 0, "A")
-
-
-@register_cb_instruction(0xC8, 0, 8)
-def handle_cb_set_1_b(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 1, "B")
-
-
-@register_cb_instruction(0xC9, 0, 8)
-def handle_cb_set_1_c(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 1, "C")
-
-
-@register_cb_instruction(0xCA, 0, 8)
-def handle_cb_set_1_d(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 1, "D")
-
-
-@register_cb_instruction(0xCB, 0, 8)
-def handle_cb_set_1_e(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 1, "E")
-
-
-@register_cb_instruction(0xCC, 0, 8)
-def handle_cb_set_1_h(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 1, "H")
-
-
-@register_cb_instruction(0xCD, 0, 8)
-def handle_cb_set_1_l(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 1, "L")
-
-
-@register_cb_instruction(0xCE, 0, 16)
-def handle_cb_set_1_hl(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 1, "(HL)")
-
-
-@register_cb_instruction(0xCF, 0, 8)
-def handle_cb_set_1_a(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 1, "A")
-
-
-@register_cb_instruction(0xD0, 0, 8)
-def handle_cb_set_2_b(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 2, "B")
-
-
-@register_cb_instruction(0xD1, 0, 8)
-def handle_cb_set_2_c(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 2, "C")
-
-
-@register_cb_instruction(0xD2, 0, 8)
-def handle_cb_set_2_d(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 2, "D")
-
-
-@register_cb_instruction(0xD3, 0, 8)
-def handle_cb_set_2_e(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 2, "E")
-
-
-@register_cb_instruction(0xD4, 0, 8)
-def handle_cb_set_2_h(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 2, "H")
-
-
-@register_cb_instruction(0xD5, 0, 8)
-def handle_cb_set_2_l(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 2, "L")
-
-
-@register_cb_instruction(0xD6, 0, 16)
-def handle_cb_set_2_hl(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 2, "(HL)")
-
-
-@register_cb_instruction(0xD7, 0, 8)
-def handle_cb_set_2_a(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 2, "A")
-
-
-@register_cb_instruction(0xD8, 0, 8)
-def handle_cb_set_3_b(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 3, "B")
-
-
-@register_cb_instruction(0xD9, 0, 8)
-def handle_cb_set_3_c(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 3, "C")
-
-
-@register_cb_instruction(0xDA, 0, 8)
-def handle_cb_set_3_d(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 3, "D")
-
-
-@register_cb_instruction(0xDB, 0, 8)
-def handle_cb_set_3_e(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 3, "E")
-
-
-@register_cb_instruction(0xDC, 0, 8)
-def handle_cb_set_3_h(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 3, "H")
-
-
-@register_cb_instruction(0xDD, 0, 8)
-def handle_cb_set_3_l(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 3, "L")
-
-
-@register_cb_instruction(0xDE, 0, 16)
-def handle_cb_set_3_hl(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 3, "(HL)")
-
-
-@register_cb_instruction(0xDF, 0, 8)
-def handle_cb_set_3_a(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 3, "A")
-
-
-@register_cb_instruction(0xE0, 0, 8)
-def handle_cb_set_4_b(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 4, "B")
-
-
-@register_cb_instruction(0xE1, 0, 8)
-def handle_cb_set_4_c(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 4, "C")
-
-
-@register_cb_instruction(0xE2, 0, 8)
-def handle_cb_set_4_d(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 4, "D")
-
-
-@register_cb_instruction(0xE3, 0, 8)
-def handle_cb_set_4_e(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 4, "E")
-
-
-@register_cb_instruction(0xE4, 0, 8)
-def handle_cb_set_4_h(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 4, "H")
-
-
-@register_cb_instruction(0xE5, 0, 8)
-def handle_cb_set_4_l(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 4, "L")
-
-
-@register_cb_instruction(0xE6, 0, 16)
-def handle_cb_set_4_hl(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 4, "(HL)")
-
-
-@register_cb_instruction(0xE7, 0, 8)
-def handle_cb_set_4_a(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 4, "A")
-
-
-@register_cb_instruction(0xE8, 0, 8)
-def handle_cb_set_5_b(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 5, "B")
-
-
-@register_cb_instruction(0xE9, 0, 8)
-def handle_cb_set_5_c(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 5, "C")
-
-
-@register_cb_instruction(0xEA, 0, 8)
-def handle_cb_set_5_d(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 5, "D")
-
-
-@register_cb_instruction(0xEB, 0, 8)
-def handle_cb_set_5_e(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 5, "E")
-
-
-@register_cb_instruction(0xEC, 0, 8)
-def handle_cb_set_5_h(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 5, "H")
-
-
-@register_cb_instruction(0xED, 0, 8)
-def handle_cb_set_5_l(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 5, "L")
-
-
-@register_cb_instruction(0xEE, 0, 16)
-def handle_cb_set_5_hl(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 5, "(HL)")
-
-
-@register_cb_instruction(0xEF, 0, 8)
-def handle_cb_set_5_a(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 5, "A")
-
-
-@register_cb_instruction(0xF0, 0, 8)
-def handle_cb_set_6_b(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 6, "B")
-
-
-@register_cb_instruction(0xF1, 0, 8)
-def handle_cb_set_6_c(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 6, "C")
-
-
-@register_cb_instruction(0xF2, 0, 8)
-def handle_cb_set_6_d(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 6, "D")
-
-
-@register_cb_instruction(0xF3, 0, 8)
-def handle_cb_set_6_e(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 6, "E")
-
-
-@register_cb_instruction(0xF4, 0, 8)
-def handle_cb_set_6_h(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 6, "H")
-
-
-@register_cb_instruction(0xF5, 0, 8)
-def handle_cb_set_6_l(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 6, "L")
-
-
-@register_cb_instruction(0xF6, 0, 16)
-def handle_cb_set_6_hl(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 6, "(HL)")
-
-
-@register_cb_instruction(0xF7, 0, 8)
-def handle_cb_set_6_a(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 6, "A")
-
-
-@register_cb_instruction(0xF8, 0, 8)
-def handle_cb_set_7_b(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 7, "B")
-
-
-@register_cb_instruction(0xF9, 0, 8)
-def handle_cb_set_7_c(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 7, "C")
-
-
-@register_cb_instruction(0xFA, 0, 8)
-def handle_cb_set_7_d(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 7, "D")
-
-
-@register_cb_instruction(0xFB, 0, 8)
-def handle_cb_set_7_e(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 7, "E")
-
-
-@register_cb_instruction(0xFC, 0, 8)
-def handle_cb_set_7_h(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 7, "H")
-
-
-@register_cb_instruction(0xFD, 0, 8)
-def handle_cb_set_7_l(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 7, "L")
-
-
-@register_cb_instruction(0xFE, 0, 16)
-def handle_cb_set_7_hl(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 7, "(HL)")
-
-
-@register_cb_instruction(0xFF, 0, 8)
-def handle_cb_set_7_a(logger, cpu, instruction):
-    handle_cb_generic_set(cpu._state, 7, "A")
-
-
-@register_instruction(0xA0, 0, 4)
-def handle_and_a_b(logger, cpu, instruction):
-    handle_generic_and_(cpu._state, "A", "B")
-
-
-@register_instruction(0xA1, 0, 4)
-def handle_and_a_c(logger, cpu, instruction):
-    handle_generic_and_(cpu._state, "A", "C")
-
-
-@register_instruction(0xA2, 0, 4)
-def handle_and_a_d(logger, cpu, instruction):
-    handle_generic_and_(cpu._state, "A", "D")
-
-
-@register_instruction(0xA3, 0, 4)
-def handle_and_a_e(logger, cpu, instruction):
-    handle_generic_and_(cpu._state, "A", "E")
-
-
-@register_instruction(0xA4, 0, 4)
-def handle_and_a_h(logger, cpu, instruction):
-    handle_generic_and_(cpu._state, "A", "H")
-
-
-@register_instruction(0xA5, 0, 4)
-def handle_and_a_l(logger, cpu, instruction):
-    handle_generic_and_(cpu._state, "A", "L")
-
-
-@register_instruction(0xA6, 0, 8)
-def handle_and_a_hl_mem(logger, cpu, instruction):
-    value = cpu._state.memory.read(cpu._state.HL)
-    a = cpu._state.A & value
-    cpu._state.A = a
-    cpu._state.zf = 1 if a == 0 else 0
-    cpu._state.nf = 0
-    cpu._state.hf = 1
-    cpu._state.cf = 0
+    return tuple(dispatch_table)
 
 
-@register_instruction(0xA7, 0, 4)
-def handle_and_a_a(logger, cpu, instruction):
-    handle_generic_and_(cpu._state, "A", "A")
+instruction_dispatch = compile_dispatch_table(instruction_table)
+cb_instruction_dispatch = compile_dispatch_table(cb_instruction_table)
@@ -0,0 +1,378 @@
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from pyboy.renderer import SCREEN_HEIGHT, SCREEN_WIDTH, TILE_COUNT, decode_tiles
+from pyboy.scheduler import Scheduler
+
+# Number of cycles it takes to draw one scanline
+CYCLES_PER_LINE = 456
+# Number of lines per frame, 144 visible lines plus 10 lines of VBlank
+LINES_PER_FRAME = 154
+
+# Modes as reported in the low bits of STAT
+MODE_HBLANK = 0
+MODE_VBLANK = 1
+MODE_OAM_SCAN = 2
+MODE_DRAWING = 3
+
+# Cycles into a visible line at which drawing starts and HBlank starts
+DRAWING_START = 80
+HBLANK_START = DRAWING_START + 172
+
+# Most sprites drawn on one line
+SPRITES_PER_LINE = 10
+
+# SCY, SCX, BGP, OBP0, OBP1, WY and WX, which only change what's drawn
+DRAWING_REGISTERS = (0xFF42, 0xFF43, 0xFF47, 0xFF48, 0xFF49, 0xFF4A, 0xFF4B)
+
+# Palette register value -> the shades of color ids 0-3
+PALETTES = np.array([[(value >> (color * 2)) & 0x03 for color in range(4)] for value in range(256)], dtype=np.uint8)
+# SCX -> the 160 columns of the 256 wide background that are on screen
+SCROLL_COLUMNS = (np.arange(256)[:, None] + np.arange(SCREEN_WIDTH)) & 0xFF
+# Tile id -> tile number with signed tile ids relative to 0x9000 (LCDC bit 4
+# clear), i.e. ids 0-127 use tiles 256-383
+SIGNED_TILES = np.array([id + 0x100 if id < 0x80 else id for id in range(256)], dtype=np.intp)
+# Priority flag, palette register value -> sprite pixels of color ids 0-3 as
+# drawn into the sprite layer: the shade, 0x04 for drawn and 0x08 for behind
+# the background
+SPRITE_PIXELS = np.array([PALETTES | 0x04, PALETTES | 0x0C], dtype=np.uint8)
+
+
+class PPU:
+    """
+    Runs the scanline timeline of the LCD and draws the screen one line at a
+    time.
+
+    Every visible line goes through OAM scan (mode 2), drawing (mode 3) and
+    HBlank (mode 0), followed by 10 lines of VBlank (mode 1). When drawing
+    starts, the line is rendered into framebuffer, a (144, 160) uint8 array
+    of shades (0 is white, 3 is black), from the background, window and
+    sprites as they are at that point.
+
+    The mode reported in STAT follows from how far into the line the clock
+    is, like the timer's DIV, so the only events are the end of each line,
+    the start of drawing while the LCD is on and the start of HBlank while
+    its STAT interrupt is enabled. The VBlank interrupt is raised when LY
+    reaches 144 and the STAT interrupt on the rising edge of any of the
+    conditions enabled in STAT.
+
+    While the LCD is off LY stays 0 and there are no events at all, turning
+    it on starts the timeline over at line 0.
+    """
+    framebuffer: np.ndarray
+    ly: int
+    line_start: int
+    lcdc: int
+    stat: int
+    dirty_tiles: bytearray
+
+    def __init__(self, memory, scheduler: Scheduler, request_interrupt: Callable[[int], None],
+                 framebuffer: Optional[np.ndarray] = None):
+        self._memory = memory
+        self._scheduler = scheduler
+        self._request_interrupt = request_interrupt
+        if framebuffer is None:
+            framebuffer = np.zeros((SCREEN_HEIGHT, SCREEN_WIDTH), dtype=np.uint8)
+        self.framebuffer = framebuffer
+        self._blank_line = np.zeros(SCREEN_WIDTH, dtype=np.uint8)
+
+        # Decoded tiles, redone for the tiles flagged in dirty_tiles, which
+        # Memory sets on writes to tile data
+        self._tiles = np.zeros((TILE_COUNT, 8, 8), dtype=np.uint8)
+        self.dirty_tiles = bytearray(b'\x01' * TILE_COUNT)
+        # Sprites to draw per line, see _index_sprites, for the OAM and sprite
+        # height they were indexed from
+        self._sprite_lines: List[Optional[tuple]] = []
+        self._sprite_oam = None
+        self._sprite_height = 0
+        self._sprite_layer = np.zeros(SCREEN_WIDTH, dtype=np.uint8)
+        # OBP0, OBP1 -> the SPRITE_PIXELS of both priorities and palettes, flattened
+        self._sprite_palettes: Dict[Tuple[int, int], np.ndarray] = {}
+
+        # As left by the boot ROM
+        self.lcdc = 0x91
+        # Only the interrupt enable bits 3-6, mode and coincidence are added on read
+        self.stat = 0
+        self._stat_line = False
+        # Lines of the window drawn so far this frame
+        self._window_line = 0
+        # Whether VRAM, OAM or a register that changes what's drawn has been
+        # written to since the last end_frame, and before that
+        self.frame_changed = True
+        self._changed_before = True
+        self.set_line(0, scheduler.cycles)
+
+    @property
+    def mode(self) -> int:
+        if self.ly >= SCREEN_HEIGHT:
+            return MODE_VBLANK
+        line_cycles = self._scheduler.cycles - self.line_start
+        if line_cycles < DRAWING_START:
+            return MODE_OAM_SCAN
+        if line_cycles < HBLANK_START:
+            return MODE_DRAWING
+        return MODE_HBLANK
+
+    def set_line(self, ly: int, line_start: int):
+        """Puts the timeline at line ly, which started at cycle line_start, and schedules what's next."""
+        self.ly = ly
+        self.line_start = line_start
+        self._stat_line = self._stat_condition()
+        self._schedule_line_events()
+        if self.lcdc & 0x80:
+            self._scheduler.schedule("ly", line_start + CYCLES_PER_LINE, self._on_line_end)
+        else:
+            self._scheduler.cancel("ly")
+
+    def next_vblank(self) -> int:
+        """
+        Returns the cycle at which LY next becomes 144, the start of VBlank.
+        While the LCD is off, frames are counted from when it was turned off.
+        """
+        if not self.lcdc & 0x80:
+            frame = CYCLES_PER_LINE * LINES_PER_FRAME
+            return self._scheduler.cycles + frame - (self._scheduler.cycles - self.line_start) % frame
+        lines = (SCREEN_HEIGHT - 1 - self.ly) % LINES_PER_FRAME + 1
+        return self.line_start + lines * CYCLES_PER_LINE
+
+    def end_frame(self) -> bool:
+        """
+        Returns whether the frame that just ended may differ from the one
+        before. A write during a frame changes the lines of the next frame
+        that were already drawn, so it counts for both.
+        """
+        changed = self.frame_changed or self._changed_before
+        self._changed_before = self.frame_changed
+        self.frame_changed = False
+        return changed
+
+    def read_stat(self) -> int:
+        if not self.lcdc & 0x80:
+            return 0x80 | self.stat
+        return 0x80 | self.stat | (self._coincidence() << 2) | self.mode
+
+    def write_stat(self, value: int):
+        self.stat = value & 0x78
+        self._schedule_line_events()
+        self._update_stat_line()
+
+    def write_lcdc(self, value: int):
+        was_on = self.lcdc & 0x80
+        if value != self.lcdc:
+            self.frame_changed = True
+        self.lcdc = value
+        if was_on and not value & 0x80:
+            # The screen goes blank and the timeline stops at line 0
+            self.framebuffer.fill(0)
+            self.ly = 0
+            self.line_start = self._scheduler.cycles
+            self._stat_line = False
+            for event in ("ly", "drawing", "hblank"):
+                self._scheduler.cancel(event)
+        elif not was_on and value & 0x80:
+            self._window_line = 0
+            self.set_line(0, self._scheduler.cycles)
+            # The STAT line was low while the LCD was off
+            self._stat_line = False
+            self._update_stat_line()
+        else:
+            self._schedule_line_events()
+            self._update_stat_line()
+
+    def write_ly(self, _):
+        self.ly = 0
+        self._update_stat_line()
+
+    def write_drawing_register(self, address: int, value: int):
+        registers = self._memory._address_space
+        if registers[address] != value:
+            registers[address] = value
+            self.frame_changed = True
+
+    def write_lyc(self, value: int):
+        self._memory._address_space[0xFF45] = value
+        self._update_stat_line()
+
+    def _schedule_line_events(self):
+        scheduler = self._scheduler
+        line_cycles = scheduler.cycles - self.line_start
+        visible = self.lcdc & 0x80 and self.ly < SCREEN_HEIGHT
+
+        if visible and line_cycles < DRAWING_START:
+            scheduler.schedule("drawing", self.line_start + DRAWING_START, self._on_drawing)
+        else:
+            scheduler.cancel("drawing")
+
+        if visible and self.stat & 0x08 and line_cycles < HBLANK_START:
+            scheduler.schedule("hblank", self.line_start + HBLANK_START, self._update_stat_line)
+        else:
+            scheduler.cancel("hblank")
+
+    def _coincidence(self) -> int:
+        return 1 if self.ly == self._memory._address_space[0xFF45] else 0
+
+    def _stat_condition(self) -> bool:
+        if not self.lcdc & 0x80:
+            return False
+        stat = self.stat
+        mode = self.mode
+        return bool(
+            (stat & 0x40 and self._coincidence())
+            or (stat & 0x20 and mode == MODE_OAM_SCAN)
+            or (stat & 0x10 and mode == MODE_VBLANK)
+            or (stat & 0x08 and mode == MODE_HBLANK)
+        )
+
+    def _update_stat_line(self):
+        # The STAT interrupt fires when the OR of all its conditions goes high
+        stat_line = self._stat_condition()
+        if stat_line and not self._stat_line:
+            self._request_interrupt(0x02)
+        self._stat_line = stat_line
+
+    def _on_line_end(self):
+        self.line_start += CYCLES_PER_LINE
+        self.ly = (self.ly + 1) % LINES_PER_FRAME
+
+        if self.ly == SCREEN_HEIGHT:
+            self._window_line = 0
+            self._request_interrupt(0x01)
+        self._update_stat_line()
+        self._schedule_line_events()
+
+        self._scheduler.schedule("ly", self.line_start + CYCLES_PER_LINE, self._on_line_end)
+
+    def _on_drawing(self):
+        # Ends OAM scan, which may lower the STAT line
+        self._update_stat_line()
+        self._render_line(self.ly)
+
+    def _render_line(self, ly: int):
+        memory = self._memory
+        registers = memory._address_space
+        lcdc = self.lcdc
+        vram = np.frombuffer(memory._read_vram(), dtype=np.uint8)
+
+        if self.dirty_tiles.find(1) != -1:
+            dirty_tiles = np.flatnonzero(np.frombuffer(self.dirty_tiles, dtype=np.uint8))
+            self._tiles[dirty_tiles] = decode_tiles(vram, dirty_tiles)
+            self.dirty_tiles[:] = bytes(TILE_COUNT)
+
+        # Color ids before the palette, sprites need them for priority
+        if lcdc & 0x01:
+            y = (ly + registers[0xFF42]) & 0xFF
+            colors = self._tilemap_row(vram, 0x1C00 if lcdc & 0x08 else 0x1800, y)[SCROLL_COLUMNS[registers[0xFF43]]]
+
+            wx = registers[0xFF4B] - 7
+            if lcdc & 0x20 and ly >= registers[0xFF4A] and wx < SCREEN_WIDTH:
+                row = self._tilemap_row(vram, 0x1C00 if lcdc & 0x40 else 0x1800, self._window_line)
+                start = max(wx, 0)
+                colors[start:] = row[start - wx:SCREEN_WIDTH - wx]
+                self._window_line += 1
+        else:
+            colors = self._blank_line
+
+        line = self.framebuffer[ly]
+        np.take(PALETTES[registers[0xFF47]], colors, out=line)
+
+        if lcdc & 0x02:
+            self._render_sprites(ly, registers, colors, line)
+
+    def _tilemap_row(self, vram: np.ndarray, tilemap: int, y: int) -> np.ndarray:
+        """Returns the 256 color ids of pixel row y of the tilemap at tilemap."""
+        start = tilemap + (y >> 3) * 32
+        tile_ids = vram[start:start + 32]
+        tiles = tile_ids if self.lcdc & 0x10 else SIGNED_TILES[tile_ids]
+        return self._tiles[tiles, y & 7].reshape(256)
+
+    def _render_sprites(self, ly: int, registers, colors: np.ndarray, line: np.ndarray):
+        oam = bytes(self._memory._oam)
+        height = 16 if self.lcdc & 0x04 else 8
+        if oam != self._sprite_oam or height != self._sprite_height:
+            self._index_sprites(oam, height)
+
+        sprite_line = self._sprite_lines[ly]
+        if sprite_line is None:
+            return
+        indices, selects, spans, behind = sprite_line
+
+        # The visible pixels of all sprites on the line at once, flips included
+        pixels = self._tiles.take(indices)
+        opaque = pixels != 0
+        obp = (registers[0xFF48], registers[0xFF49])
+        palettes = self._sprite_palettes.get(obp)
+        if palettes is None:
+            palettes = self._sprite_palettes[obp] = SPRITE_PIXELS[:, obp].reshape(16)
+        shades = palettes.take(selects + pixels)
+        if not behind:
+            shades &= 0x03
+            for start, end, first, last in spans:
+                np.copyto(line[start:end], shades[first:last], where=opaque[first:last])
+            return
+
+        # A sprite behind the background still hides the sprites below it, so
+        # draw all of them into a layer of SPRITE_PIXELS values first and let
+        # the winner of every pixel decide
+        layer = self._sprite_layer
+        layer.fill(0)
+        for start, end, first, last in spans:
+            np.copyto(layer[start:end], shades[first:last], where=opaque[first:last])
+
+        shown = (layer & 0x04) != 0
+        shown &= (layer < 0x08) | (colors == 0)
+        np.copyto(line, layer & 0x03, where=shown)
+
+    def _index_sprites(self, oam: bytes, height: int):
+        """
+        Finds the sprites on every line, the first 10 on the line in OAM order,
+        and keeps, in drawing order, where their visible pixels are in the
+        decoded tiles, which palette they use and where they go on the line.
+        """
+        lines: List[List[int]] = [[] for _ in range(SCREEN_HEIGHT)]
+        for index in range(40):
+            top = oam[index * 4] - 16
+            for ly in range(max(top, 0), min(top + height, SCREEN_HEIGHT)):
+                if len(lines[ly]) < SPRITES_PER_LINE:
+                    lines[ly].append(index)
+
+        self._sprite_lines = []
+        for ly, sprites in enumerate(lines):
+            # Lower X wins and then lower OAM index, so draw in the opposite order
+            sprites.sort(key=lambda index: (oam[index * 4 + 1], index), reverse=True)
+            indices: List[int] = []
+            selects: List[int] = []
+            spans = []
+            for index in sprites:
+                y, x, tile, flags = oam[index * 4:index * 4 + 4]
+                x -= 8
+                if x <= -8 or x >= SCREEN_WIDTH:
+                    continue
+
+                row = ly - (y - 16)
+                if flags & 0x40:
+                    row = height - 1 - row
+                if height == 16:
+                    tile &= 0xFE
+                start, end = max(x, 0), min(x + 8, SCREEN_WIDTH)
+                columns = range(start - x, end - x)
+                if flags & 0x20:
+                    columns = [7 - column for column in columns]
+
+                # Index into the flattened (384, 8, 8) tiles
+                base = (tile + (row >> 3)) * 64 + (row & 7) * 8
+                spans.append((start, end, len(indices), len(indices) + end - start))
+                indices.extend(base + column for column in columns)
+                # Offset of the four SPRITE_PIXELS values for the priority flag
+                # and OBP0 or OBP1 in the palettes used by _render_sprites
+                selects.extend([((flags >> 7) * 2 + ((flags >> 4) & 1)) * 4] * (end - start))
+
+            if not spans:
+                self._sprite_lines.append(None)
+                continue
+            selects_array = np.array(selects, dtype=np.intp)
+            self._sprite_lines.append((np.array(indices, dtype=np.intp), selects_array, spans,
+                                       bool((selects_array >= 8).any())))
+
+        self._sprite_oam = oam
+        self._sprite_height = height
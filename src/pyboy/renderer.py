@@ -0,0 +1,27 @@
+from typing import Optional
+
+import numpy as np
+
+SCREEN_WIDTH = 160
+SCREEN_HEIGHT = 144
+
+# Tile data covers 0x8000-0x97FF, 16 bytes per tile
+TILE_COUNT = 384
+
+
+def decode_tiles(vram, tiles: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Decodes tiles in VRAM into an (N, 8, 8) array of color ids, either all 384
+    of them or only the tile numbers given in tiles.
+
+    Each tile row is two bytes, the low and high bit planes, with the leftmost
+    pixel in the most significant bit, which is exactly the order
+    np.unpackbits produces.
+    """
+    planes = np.frombuffer(vram, dtype=np.uint8, count=TILE_COUNT * 16).reshape(TILE_COUNT, 8, 2)
+    if tiles is not None:
+        planes = planes[tiles]
+    low = np.unpackbits(planes[:, :, 0:1], axis=2)
+    high = np.unpackbits(planes[:, :, 1:2], axis=2)
+    return (high << 1) | low
+
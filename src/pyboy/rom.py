@@ -0,0 +1,42 @@
+"""
+Loading ROM files.
+
+ROM files are mapped into memory read-only instead of read, and only once
+per process for the same content: every emulator that loads a ROM gets a
+memoryview of the same mapping, so many instances on one host share its
+pages rather than each holding a copy.
+"""
+import hashlib
+import mmap
+import os
+from typing import Dict, Union
+
+# A ROM as it is handed to Memory, any buffer that can't change
+RomData = Union[bytes, memoryview]
+
+# Mapped ROMs by the SHA-1 of their content
+_roms: Dict[str, memoryview] = {}
+
+
+def load_rom(path: str) -> memoryview:
+    """Returns the content of the ROM file at path as a read-only memoryview."""
+    with open(path, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            # Empty files can't be mapped
+            return memoryview(b'')
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    digest = hashlib.sha1(mapping).hexdigest()
+    rom = _roms.get(digest)
+    if rom is None:
+        rom = _roms[digest] = memoryview(mapping)
+    else:
+        mapping.close()
+    return rom
+
+
+def as_rom(data) -> RomData:
+    """Returns data as a buffer that can't change, only copying it if it could."""
+    if isinstance(data, bytes) or (isinstance(data, memoryview) and data.readonly):
+        return data
+    return bytes(data)
@@ -0,0 +1,126 @@
+import struct
+
+MAGIC = b'PBST'
+VERSION = 5
+
+# Everything but the memory regions, which follow as raw buffers:
+#   magic, version,
+#   pc, sp, a, b, c, d, e, h, l, flags, ime, halted, delay_enable_ime, enable_interrupts_after_next_instruction,
+#   cycles, ly, cycles into the current line, lcdc, stat, window line, cycles left of OAM DMA,
+#   div counter, tima, tma, tac,
+#   MBC registers: ram enabled, bank1, bank2, mode,
+#   clock: registers, cycles into the second, latched registers, last latch write
+HEADER = struct.Struct('<4sH' 'HH8B4B' 'QBHBBBH' 'HBBB' 'BHBB' '5sI5sB')
+
+# Clock state of cartridges without a clock
+NO_RTC = (bytes(5), 0, bytes(5), 0)
+
+ADDRESS_SPACE_SIZE = 0x10000
+
+
+def save_state(cpu) -> bytes:
+    """Serializes the CPU, memory and timer into a versioned binary blob."""
+    state = cpu._state
+    memory = state.memory
+    timer = memory._timer
+    ppu = memory._ppu
+    scheduler = cpu._scheduler
+
+    # Bring the timer up to date so only its counters need to be stored
+    timer._sync()
+
+    header = HEADER.pack(
+        MAGIC, VERSION,
+        state.pc, state._sp & 0xFFFF, state._a, state._b, state._c, state._d, state._e, state._h, state._l,
+        state.get_flags_byte(), int(state.ime), int(state._halted),
+        int(state._delay_enable_ime), int(state.enable_interrupts_after_next_instruction),
+        scheduler.cycles, ppu.ly, scheduler.cycles - ppu.line_start, ppu.lcdc, ppu.stat, ppu._window_line,
+        max(memory._dma_end - scheduler.cycles, 0),
+        timer._div_counter, timer._tima, timer._tma, timer._tac,
+        *memory._cartridge.registers,
+        *(memory._cartridge.rtc.state if memory._cartridge.rtc is not None else NO_RTC),
+    )
+    address_space = memoryview(memory._address_space)
+    return b''.join((
+        header, address_space[:0x8000], *_pages(memory, 0x80, 0xA0), address_space[0xA000:0xC000],
+        *_pages(memory, 0xC0, 0xE0), address_space[0xE000:], memory._external_ram,
+    ))
+
+
+def _pages(memory, start: int, end: int) -> list:
+    # Reads the pages through the page tables like Memory._read_vram, so VRAM
+    # and WRAM still shared with a fork stay shared
+    return [buffer[(page << 8) - base:(page + 1 << 8) - base]
+            for page, (buffer, base) in zip(range(start, end), memory._read_pages[start:end])]
+
+
+def load_state(cpu, data: bytes):
+    """Restores a blob created by save_state into a CPU that has a program loaded."""
+    memory = cpu._state.memory
+    # Cartridge RAM comes last and its size depends on the cartridge
+    state_size = HEADER.size + ADDRESS_SPACE_SIZE + len(memory._external_ram)
+    if len(data) != state_size:
+        raise Exception(f'Invalid save state size {len(data)}, expected {state_size}!')
+
+    (
+        magic, version,
+        pc, sp, a, b, c, d, e, h, l, flags, ime, halted, delay_enable_ime, enable_interrupts_after_next_instruction,
+        cycles, ly, line_cycles, lcdc, stat, window_line, dma_cycles,
+        div_counter, tima, tma, tac,
+        ram_enabled, bank1, bank2, mode,
+        rtc_registers, rtc_fraction, rtc_latched, rtc_latch,
+    ) = HEADER.unpack_from(data)
+
+    if magic != MAGIC:
+        raise Exception('Not a save state!')
+    if version != VERSION:
+        raise Exception(f'Unsupported save state version {version}!')
+
+    state = cpu._state
+    state.pc = pc
+    state._sp = sp
+    state._a, state._b, state._c, state._d, state._e, state._h, state._l = a, b, c, d, e, h, l
+    state.set_flags_from_byte(flags)
+    state.ime = bool(ime)
+    state._halted = bool(halted)
+    state._delay_enable_ime = bool(delay_enable_ime)
+    state.enable_interrupts_after_next_instruction = bool(enable_interrupts_after_next_instruction)
+    # Compiled blocks are a cache and aren't saved, the PC may be anywhere
+    cpu._resuming_block = False
+
+    memory._unshare_pages()
+    view = memoryview(data)
+    offset = HEADER.size
+    memory._address_space[:] = view[offset:offset + ADDRESS_SPACE_SIZE]
+    offset += ADDRESS_SPACE_SIZE
+    memory._external_ram[:] = view[offset:]
+    memory._cartridge.registers = (ram_enabled, bank1, bank2, mode)
+    memory._cartridge.dirty = memory._cartridge.has_save_file
+    memory._map_cartridge()
+
+    scheduler = cpu._scheduler
+    scheduler.reset(cycles)
+    memory._dma_end = cycles + dma_cycles
+
+    if memory._cartridge.rtc is not None:
+        memory._cartridge.rtc.state = (rtc_registers, rtc_fraction, rtc_latched, rtc_latch)
+
+    # VRAM was replaced wholesale, so all tiles have to be decoded again
+    ppu = memory._ppu
+    ppu.dirty_tiles[:] = b'\x01' * len(ppu.dirty_tiles)
+    ppu.frame_changed = ppu._changed_before = True
+    ppu.lcdc = lcdc
+    ppu.stat = stat
+    ppu._window_line = window_line
+    # The mode follows from how far into the line it is
+    ppu.set_line(ly, cycles - line_cycles)
+
+    timer = memory._timer
+    timer._div_counter = div_counter
+    timer._tima = tima
+    timer._tma = tma
+    timer._synced_cycles = cycles
+    # Sets up the divider bit and schedules the next overflow
+    timer.TAC = tac
+
+    scheduler.request_service()
@@ -0,0 +1,72 @@
+from typing import Callable, Dict, Tuple
+
+# Deadline used when nothing is scheduled
+NEVER = 1 << 62
+# Number of cycles per second
+CPU_FREQUENCY = 4194304
+
+
+class Scheduler:
+    """
+    Cycle-stamped event queue shared by the CPU and the components on the bus.
+
+    Components register the cycle at which they next need attention (a timer
+    overflow, the end of a scanline, ...) and the CPU runs instructions
+    back to back until the earliest of those deadlines, only then servicing
+    the due events and checking for interrupts.
+    """
+    cycles: int
+    next_deadline: int
+    _events: Dict[str, Tuple[int, Callable]]
+    _service_requested: bool
+
+    def __init__(self):
+        self.cycles = 0
+        self.next_deadline = NEVER
+        self._events = {}
+        self._service_requested = False
+
+    def reset(self, cycles: int = 0):
+        """Drops all pending events and moves the clock to cycles."""
+        self.cycles = cycles
+        self._events = {}
+        self._service_requested = False
+        self.next_deadline = NEVER
+
+    def schedule(self, name: str, deadline: int, callback: Callable):
+        """Schedules callback to run at cycle deadline, replacing any pending event called name."""
+        self._events[name] = (deadline, callback)
+        self._update_next_deadline()
+
+    def cancel(self, name: str):
+        if self._events.pop(name, None) is not None:
+            self._update_next_deadline()
+
+    def deadline(self, name: str) -> int:
+        event = self._events.get(name)
+        return NEVER if event is None else event[0]
+
+    def request_service(self):
+        """Makes the CPU stop after the current instruction to service events and interrupts."""
+        self._service_requested = True
+        self.next_deadline = self.cycles
+
+    def service(self):
+        """Runs all events that are due, in deadline order."""
+        events = self._events
+        while events:
+            name, (deadline, callback) = min(events.items(), key=lambda event: event[1][0])
+            if deadline > self.cycles:
+                break
+
+            del events[name]
+            callback()
+
+        self._service_requested = False
+        self._update_next_deadline()
+
+    def _update_next_deadline(self):
+        if self._service_requested:
+            self.next_deadline = self.cycles
+        else:
+            self.next_deadline = min((deadline for deadline, _ in self._events.values()), default=NEVER)
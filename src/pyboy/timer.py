@@ -1,4 +1,6 @@
-from typing import Callable
+from typing import Callable, Optional
+
+from pyboy.scheduler import Scheduler
 
 
 class Timer:
@@ -8,14 +10,18 @@ class Timer:
     _tima: int
     _tac_div_bit: int
     _tac: int
+    _synced_cycles: int
 
     @property
     def TIMA(self):
+        self._sync()
         return self._tima
     
     @TIMA.setter
     def TIMA(self, value: int):
+        self._sync()
         self._tima = value
+        self._schedule_overflow()
 
     @property
     def TMA(self):
@@ -23,15 +29,19 @@ class Timer:
     
     @TMA.setter
     def TMA(self, value: int):
+        self._sync()
         self._tma = value
 
     @property
     def DIV(self):
+        self._sync()
         return self._div_counter >> 8
 
     @DIV.setter
     def DIV(self, _):
+        self._sync()
         self._div_counter = 0
+        self._schedule_overflow()
 
     @property
     def TAC(self):
@@ -39,6 +49,7 @@ class Timer:
 
     @TAC.setter
     def TAC(self, value: int):
+        self._sync()
         self._tac = value
         self._tac_enabled = (value & 0x4) != 0
 
@@ -52,29 +63,61 @@ class Timer:
             case 3:
                 self._tac_div_bit = 7
 
-    def add_cycles(self, count: int):
-        for _ in range(count):
-            new_div_counter = (self._div_counter + 1) & 0xFFFF
-
-
-            if self._tac_enabled:
-                old_bit = (self._div_counter >> self._tac_div_bit) & 1
-                new_bit = (new_div_counter >> self._tac_div_bit) & 1
+        self._schedule_overflow()
 
-                if old_bit == 1 and new_bit == 0:
-                    self._tima += 1
-                    # OVERFLOW
-                    if self._tima > 0xFF:
-                        self._tima = self._tma
-                        self._overflow_callback()
-
-            self._div_counter = new_div_counter
-
-    def __init__(self, overflow_callback: Callable):
+    def add_cycles(self, count: int):
+        old_div_counter = self._div_counter
+        new_div_counter = old_div_counter + count
+
+        if self._tac_enabled:
+            # TIMA is increased on every falling edge of the selected DIV bit,
+            # which happens each time the counter passes a multiple of 2^(bit + 1)
+            shift = self._tac_div_bit + 1
+            increments = (new_div_counter >> shift) - (old_div_counter >> shift)
+
+            if increments:
+                tima = self._tima + increments
+                if tima > 0xFF:
+                    # OVERFLOW, TIMA is reloaded from TMA and keeps counting
+                    # from there, overflowing again every 0x100 - TMA
+                    # increments. The callback only raises the interrupt, so
+                    # once is enough however many times it overflowed
+                    tima = self._tma + (tima - 0x100) % (0x100 - self._tma)
+                    self._overflow_callback()
+
+                self._tima = tima
+
+        self._div_counter = new_div_counter & 0xFFFF
+
+    def _sync(self):
+        # The timer is only brought up to date when it is accessed or its
+        # overflow deadline is reached, not on every instruction
+        cycles = self._scheduler.cycles
+        if cycles != self._synced_cycles:
+            self.add_cycles(cycles - self._synced_cycles)
+            self._synced_cycles = cycles
+
+    def _schedule_overflow(self):
+        if not self._tac_enabled:
+            self._scheduler.cancel("timer")
+            return
+
+        period = 1 << (self._tac_div_bit + 1)
+        cycles_to_first_increment = period - (self._div_counter & (period - 1))
+        cycles_to_overflow = cycles_to_first_increment + (0xFF - self._tima) * period
+        self._scheduler.schedule("timer", self._synced_cycles + cycles_to_overflow, self._on_overflow_deadline)
+
+    def _on_overflow_deadline(self):
+        self._sync()
+        self._schedule_overflow()
+
+    def __init__(self, overflow_callback: Callable, scheduler: Optional[Scheduler] = None):
         self._tac_enabled = False
         self._tac = 0
+        self._tac_div_bit = 9
         self._tima = 0
         self._tma = 0
         self._div_counter = 0
         self._overflow_callback = overflow_callback
-
+        self._scheduler = scheduler or Scheduler()
+        self._synced_cycles = self._scheduler.cycles
@@ -0,0 +1,89 @@
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+from pyboy.cpu import CPU
+from pyboy.renderer import SCREEN_HEIGHT, SCREEN_WIDTH
+from pyboy.rom import as_rom
+
+# Column order of the registers array
+REGISTERS = ('pc', 'sp', 'a', 'f', 'b', 'c', 'd', 'e', 'h', 'l')
+
+
+class VectorEmulator:
+    """
+    Runs count headless instances of the same ROM in lockstep.
+
+    The memory of every instance is a row of one (count, 65536) uint8 array
+    and every framebuffer a slice of one (count, 144, 160) array, so
+    observations for all instances are read without any copying or per
+    instance calls. The arrays are updated in place by step and reset.
+
+    Instances are still stepped one by one with CPU.run_n_cycles, and
+    registers live in each CPUState, where the instruction handlers need
+    them; the registers property gathers them into one array on demand.
+    """
+    memory: np.ndarray
+    framebuffers: np.ndarray
+
+    def __init__(self, logger, rom_data: bytes, count: int, pc: int = 0x0100, sp: int = 0xFFFE):
+        self._logger = logger
+        self.memory = np.zeros((count, 0x10000), dtype=np.uint8)
+        self.framebuffers = np.zeros((count, SCREEN_HEIGHT, SCREEN_WIDTH), dtype=np.uint8)
+
+        # One ROM buffer shared by every instance
+        rom_data = as_rom(rom_data)
+        self._cpus = []
+        for index in range(count):
+            cpu = CPU(logger)
+            cpu.load_program(rom_data, address_space=memoryview(self.memory[index]))
+            cpu.set_addresses(pc, sp)
+            cpu._state.memory._ppu.framebuffer = self.framebuffers[index]
+            self._cpus.append(cpu)
+
+        # Every instance starts from the same state; keep it around for reset
+        self._initial_state = self._cpus[0].save_state()
+
+    def __len__(self) -> int:
+        return len(self._cpus)
+
+    @property
+    def ram(self) -> np.ndarray:
+        """The (count, 8192) WRAM of all instances, a view into memory."""
+        return self.memory[:, 0xC000:0xE000]
+
+    @property
+    def registers(self) -> np.ndarray:
+        """The registers of all instances as a (count, 10) array, columns in the order of REGISTERS."""
+        registers = np.empty((len(self._cpus), len(REGISTERS)), dtype=np.uint16)
+        for index, cpu in enumerate(self._cpus):
+            state = cpu._state
+            registers[index] = (state.pc, state._sp, state._a, state.get_flags_byte(),
+                                state._b, state._c, state._d, state._e, state._h, state._l)
+        return registers
+
+    def reset(self, state: Optional[bytes] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Puts every instance back in state, a save state, or the initial state by default."""
+        state = state or self._initial_state
+        for cpu in self._cpus:
+            cpu.load_state(state)
+        # Save states don't include the screen, it is drawn again from the next frame on
+        self.framebuffers.fill(0)
+        return self.framebuffers, self.ram
+
+    def step(self, actions: Optional[Sequence[int]] = None, frames: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Holds the buttons in actions, one JOYPAD_BUTTONS bit mask per instance,
+        runs every instance for frames frames and returns the framebuffers and
+        RAM of all instances.
+        """
+        if actions is not None and len(actions) != len(self._cpus):
+            raise Exception(f'Expected {len(self._cpus)} actions, got {len(actions)}!')
+
+        for index, cpu in enumerate(self._cpus):
+            if actions is not None:
+                cpu._state.memory.set_joypad(int(actions[index]))
+            for _ in range(frames):
+                cpu.run_frame()
+
+        return self.framebuffers, self.ram
@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+from pyboy.batch import BatchJob, main, run_batch
+
+
+@pytest.fixture
+def rom(tmp_path):
+    # Count into 0xC000 as long as the start button is held, forever:
+    # LDH A,(00); BIT 3,A; JR NZ,-6; LD HL,C000; INC (HL); JR -12
+    program = bytearray(0x8000)
+    program[0x100:0x111] = bytes([
+        0x3E, 0x10, 0xE0, 0x00,  # LD A,0x10; LDH (00),A - select buttons
+        0xF0, 0x00,              # LDH A,(00)
+        0xCB, 0x5F,              # BIT 3,A
+        0x20, 0xFA,              # JR NZ,-6
+        0x21, 0x00, 0xC0,        # LD HL,0xC000
+        0x34,                    # INC (HL)
+        0x18, 0xF4,              # JR -12
+    ])
+    path = tmp_path / 'test.gb'
+    path.write_bytes(bytes(program))
+    return str(path)
+
+
+def test_run_batch_is_deterministic(rom):
+    jobs = [BatchJob(rom), BatchJob(rom, seed=1), BatchJob(rom, seed=1), BatchJob(rom, seed=2)]
+    results = run_batch(jobs, frames=3, processes=2)
+
+    assert [result.error for result in results] == [None] * 4
+    assert [result.seed for result in results] == [None, 1, 1, 2]
+    # The first frame ends at the first VBlank, 144 lines in
+    assert all(result.cycles >= 144 * 456 + 2 * 70224 for result in results)
+    assert results[1].state_hash == results[2].state_hash
+    assert len({results[0].state_hash, results[1].state_hash, results[3].state_hash}) == 3
+
+
+def test_run_batch_input_scripts(rom):
+    idle, pressed = run_batch([BatchJob(rom), BatchJob(rom, inputs={1: ['start']})], frames=2, framebuffers=True, processes=2)
+
+    assert idle.registers['h'] == 0x00
+    assert pressed.registers['h'] == 0xC0
+    assert len(pressed.framebuffer) == 160 * 144
+
+
+def test_run_batch_reports_errors(rom, tmp_path):
+    broken = tmp_path / 'broken.gb'
+    broken.write_bytes(bytes([0x00] * 0x100 + [0xDD]))
+
+    results = run_batch([BatchJob(str(broken)), BatchJob(rom)], cycles=1000, processes=1)
+    assert results[0].error is not None
+    assert results[1].error is None
+
+
+def test_main_prints_one_line_per_job(rom, capsys):
+    main([rom, '--cycles', '1000', '--seeds', '2', '--processes', '1'])
+
+    lines = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [line['seed'] for line in lines] == [0, 1]
@@ -0,0 +1,33 @@
+import json
+
+from benchmarks.run import compare, main
+
+
+def _report(**values):
+    return {'results': {name: {'name': name, 'value': value, 'unit': unit, 'higher_is_better': unit != 'ns'}
+                        for name, (value, unit) in values.items()}}
+
+
+def test_compare_reports_only_what_got_slower_than_the_threshold():
+    baseline = _report(fps=(100, 'frames/s'), mips=(2.0, 'MIPS'), add=(100, 'ns'), sub=(100, 'ns'))
+    report = _report(fps=(80, 'frames/s'), mips=(1.9, 'MIPS'), add=(150, 'ns'), sub=(50, 'ns'), new=(1, 'ns'))
+
+    regressions = compare(report, baseline, 0.1)
+    assert [regression.split(':')[0] for regression in regressions] == ['fps', 'add']
+
+
+def test_main_writes_and_compares_results(tmp_path):
+    output = tmp_path / 'results.json'
+    arguments = ['-b', 'cpu', '-b', 'frames', '--cycles', '20000', '--frames', '1', '--repeat', '1']
+    assert main(arguments + ['-o', str(output)]) == 0
+
+    results = json.loads(output.read_text())['results']
+    assert set(results) == {'cpu.interpreter.cycles_per_second', 'cpu.interpreter.mips', 'cpu.blocks.cycles_per_second',
+                            'cpu.blocks.mips', 'frames.headless.fps'}
+    assert results['cpu.blocks.mips']['value'] > 0
+
+    # Anything is a regression against a baseline a thousand times faster
+    for result in results.values():
+        result['value'] *= 1000
+    output.write_text(json.dumps({'results': results}))
+    assert main(arguments + ['-c', str(output)]) == 1
@@ -0,0 +1,117 @@
+import logging
+
+import pytest
+
+import pyboy.cpu
+from pyboy.blocks import compile_block
+from pyboy.cpu import CPU
+
+
+def _program() -> bytes:
+    # A timer interrupt handler counting into 0xC000, a main loop calling a
+    # copy loop and an ALU loop, and the ALU loop itself mixing in CB opcodes
+    program = bytearray(0x8000)
+    program[0x50:0x58] = bytes([0xFA, 0x00, 0xC0, 0x3C, 0xEA, 0x00, 0xC0, 0xD9])
+    program[0x100:0x10B] = bytes([0x31, 0xF0, 0xDF, 0x3E, 0x05, 0xE0, 0x07, 0x3E, 0x04, 0xE0, 0xFF])
+    program[0x10B:0x11E] = bytes([0xFB, 0x21, 0x00, 0xC0, 0x11, 0x00, 0xC1, 0x0E, 0x00,
+                                  0xCD, 0x00, 0x02, 0xCD, 0x00, 0x03, 0xC3, 0x0B, 0x01])
+    program[0x200:0x207] = bytes([0x2A, 0x12, 0x13, 0x0D, 0x20, 0xFA, 0xC9])
+    program[0x300:0x311] = bytes([0x06, 100, 0x80, 0xA9, 0x07, 0xCB, 0x37, 0x0C, 0xD6, 3,
+                                  0xE6, 0x7F, 0xB2, 0x05, 0x20, 0xF1, 0xC9])
+    return bytes(program)
+
+
+def _cpu() -> CPU:
+    cpu = CPU(logging.getLogger())
+    cpu.load_program(_program())
+    cpu.set_addresses()
+    return cpu
+
+
+def test_block_ends_at_jump():
+    cpu = _cpu()
+    block = compile_block(cpu._state.memory, 0x300)
+
+    assert block is not None
+    assert '0300: 06 64' in block.source
+    assert '030E: 20 F1' in block.source
+    assert '# 0310' not in block.source
+
+
+def test_nothing_to_compile_at_unknown_opcode():
+    cpu = CPU(logging.getLogger())
+    cpu.load_program(b'\xD3' + _program()[1:])
+
+    assert compile_block(cpu._state.memory, 0x0000) is None
+
+
+@pytest.mark.parametrize("threshold", [0, 3, 16])
+def test_blocks_match_interpreter(monkeypatch, threshold):
+    monkeypatch.setattr(pyboy.cpu, 'BLOCK_COMPILE_THRESHOLD', 1 << 30)
+    interpreted = _cpu()
+    interpreted.run_n_cycles(300000)
+
+    monkeypatch.setattr(pyboy.cpu, 'BLOCK_COMPILE_THRESHOLD', threshold)
+    compiled = _cpu()
+    compiled.run_n_cycles(300000)
+
+    assert any(compiled._fixed_blocks)
+    assert compiled._scheduler.cycles == interpreted._scheduler.cycles
+    assert compiled.save_state() == interpreted.save_state()
+
+
+def test_block_stops_at_deadline():
+    cpu = _cpu()
+    state = cpu._state
+    state.pc = 0x300
+    block = compile_block(state.memory, 0x300)
+
+    start = cpu._scheduler.cycles
+    assert block(cpu, state, cpu._scheduler, start + 1) is True
+    assert state.pc == 0x302
+    assert state.B == 100
+    assert cpu._scheduler.cycles == start + 8
+
+
+def _polling_program() -> bytes:
+    # Wait for LY to reach 0x90, count the frames into 0xC000 and wait for
+    # LY to leave 0x90 again
+    program = bytearray(0x8000)
+    program[0x100:0x116] = bytes([0xF0, 0x44, 0xFE, 0x90, 0x20, 0xFA,
+                                  0xFA, 0x00, 0xC0, 0x3C, 0xEA, 0x00, 0xC0,
+                                  0xF0, 0x44, 0xFE, 0x90, 0x28, 0xFA, 0xC3, 0x00, 0x01])
+    return bytes(program)
+
+
+def test_polling_loop_is_detected():
+    cpu = CPU(logging.getLogger())
+    cpu.load_program(_polling_program())
+
+    assert '_period' in compile_block(cpu._state.memory, 0x100).source
+    # Not a loop
+    assert '_period' not in compile_block(cpu._state.memory, 0x106).source
+
+
+def test_polling_loop_of_timer_is_not_skipped():
+    program = bytearray(_polling_program())
+    program[0x101] = 0x04
+    cpu = CPU(logging.getLogger())
+    cpu.load_program(bytes(program))
+
+    assert '_period' not in compile_block(cpu._state.memory, 0x100).source
+
+
+@pytest.mark.parametrize("threshold", [0, 16])
+def test_polling_loop_matches_interpreter(monkeypatch, threshold):
+    cpus = []
+    for compile_threshold in (1 << 30, threshold):
+        monkeypatch.setattr(pyboy.cpu, 'BLOCK_COMPILE_THRESHOLD', compile_threshold)
+        cpu = CPU(logging.getLogger())
+        cpu.load_program(_polling_program())
+        cpu.set_addresses()
+        cpu.run_n_cycles(5 * 70224 + 123)
+        cpus.append(cpu)
+
+    interpreted, compiled = cpus
+    assert interpreted._state.memory.read(0xC000) == 5
+    assert compiled.save_state() == interpreted.save_state()
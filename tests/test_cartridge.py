@@ -0,0 +1,319 @@
+import logging
+
+import pytest
+
+from pyboy.cartridge import MBC1, MBC3, MBC5, Cartridge
+from pyboy.cpu import CPU, Memory
+from pyboy.emulator import Emulator
+from pyboy.scheduler import CPU_FREQUENCY
+
+
+def _rom(cartridge_type: int, banks: int, ram_size: int = 0x00) -> bytearray:
+    # Every bank is filled with its number
+    rom = bytearray()
+    for bank in range(banks):
+        rom += bytes([bank & 0xFF]) * 0x4000
+    rom[0x147] = cartridge_type
+    rom[0x149] = ram_size
+    return rom
+
+
+@pytest.mark.parametrize("cartridge_type, mbc", [(0x00, Cartridge), (0x03, MBC1), (0x13, MBC3), (0x1B, MBC5), (0xFC, Cartridge)])
+def test_mbc_is_picked_from_the_header(cartridge_type, mbc):
+    memory = Memory(logging.getLogger(), _rom(cartridge_type, 4))
+    assert type(memory._cartridge) is mbc
+
+
+def test_mbc1_switches_rom_banks():
+    memory = Memory(logging.getLogger(), _rom(0x01, 64))
+    assert memory.read(0x4000) == 1
+
+    memory.write(0x2000, 0x05)
+    assert memory.read(0x4000) == 5
+    assert memory.read(0x7FFF) == 5
+    # Bank 0 becomes 1, as does 0x20 -> 0x21
+    memory.write(0x2000, 0x00)
+    assert memory.read(0x4000) == 1
+    memory.write(0x4000, 0x01)
+    assert memory.read(0x4000) == 0x21
+    # Mode 1 maps the upper bits at 0x0000 too
+    assert memory.read(0x0000) == 0
+    memory.write(0x6000, 0x01)
+    assert memory.read(0x0000) == 0x20
+
+
+def test_mbc1_ram_is_banked_and_disabled_by_default():
+    memory = Memory(logging.getLogger(), _rom(0x03, 4, 0x03))
+    assert memory.read(0xA000) == 0xFF
+    memory.write(0xA000, 0x12)
+
+    memory.write(0x0000, 0x0A)
+    assert memory.read(0xA000) == 0x00
+    memory.write(0xA000, 0x12)
+    memory.write(0x6000, 0x01)
+    memory.write(0x4000, 0x02)
+    memory.write(0xBFFF, 0x34)
+
+    assert memory._external_ram[0x0000] == 0x12
+    assert memory._external_ram[0x5FFF] == 0x34
+    memory.write(0x0000, 0x00)
+    assert memory.read(0xBFFF) == 0xFF
+
+
+def test_mbc3_selects_ram_banks_and_clock_registers():
+    memory = Memory(logging.getLogger(), _rom(0x13, 128, 0x03))
+    memory.write(0x2000, 0x7F)
+    assert memory.read(0x4000) == 0x7F
+
+    memory.write(0x0000, 0x0A)
+    memory.write(0x4000, 0x03)
+    memory.write(0xA000, 0x56)
+    assert memory._external_ram[0x6000] == 0x56
+    memory.write(0x4000, 0x08)
+    assert memory.read(0xA000) == 0xFF
+
+
+def test_mbc5_has_a_9_bit_rom_bank_that_can_be_0():
+    memory = Memory(logging.getLogger(), _rom(0x19, 512))
+    memory.write(0x2000, 0x00)
+    assert memory.read(0x4000) == 0
+    memory.write(0x3000, 0x01)
+    memory.write(0x2000, 0x02)
+    assert memory._cartridge.rom_bank == 0x102
+    assert memory.read(0x4000) == 0x02
+
+
+def test_code_runs_from_the_mapped_bank():
+    # 0x100: LD A,1; LD (0x2000),A; CALL 0x4000; LD B,A; LD A,2; LD (0x2000),A; CALL 0x4000; HALT
+    rom = _rom(0x01, 4)
+    rom[0x100:0x112] = bytes([0x3E, 0x01, 0xEA, 0x00, 0x20, 0xCD, 0x00, 0x40, 0x47,
+                              0x3E, 0x02, 0xEA, 0x00, 0x20, 0xCD, 0x00, 0x40, 0x76])
+    # Every bank returns 0x10 + its number in A: LD A,n; RET
+    for bank in range(1, 4):
+        rom[bank * 0x4000:bank * 0x4000 + 3] = bytes([0x3E, 0x10 + bank, 0xC9])
+
+    cpu = CPU(logging.getLogger())
+    cpu.load_program(bytes(rom))
+    for _ in range(20):
+        # Often enough for the code to get compiled into blocks as well
+        cpu.set_addresses()
+        cpu._state._halted = False
+        cpu.run_n_cycles(400)
+        assert (cpu._state.B, cpu._state.A) == (0x11, 0x12)
+    assert callable(cpu._banked_blocks[(2, 1)][0])
+
+
+def test_blocks_are_kept_apart_per_region_a_bank_is_mapped_at():
+    # 0x100: Call 0x0200 32 times, with bank 0 at 0x0000, which switches
+    # to bank 1 and returns. Then map bank 0 at 0x4000 and call it there as
+    # 0x4200, now the switch makes 0x4205 store 0xBB from bank 1 and halt.
+    # If it returned instead, 0xAA is stored.
+    rom = _rom(0x19, 4)
+    rom[0x100:0x118] = bytes([0x0E, 0x20, 0x3E, 0x01, 0xCD, 0x00, 0x02, 0x0D, 0x20, 0xF8,
+                              0xAF, 0xEA, 0x00, 0x20, 0x3C, 0xCD, 0x00, 0x42,
+                              0x3E, 0xAA, 0xEA, 0x00, 0xC0, 0x76])
+    # LD (0x2000),A; JR +0; RET
+    rom[0x200:0x206] = bytes([0xEA, 0x00, 0x20, 0x18, 0x00, 0xC9])
+    # JR +0; LD A,0xBB; LD (0xC000),A; HALT
+    rom[0x4203:0x420B] = bytes([0x18, 0x00, 0x3E, 0xBB, 0xEA, 0x00, 0xC0, 0x76])
+
+    cpu = CPU(logging.getLogger())
+    cpu.load_program(bytes(rom))
+    cpu.set_addresses()
+    cpu.run_n_cycles(4000)
+    assert callable(cpu._banked_blocks[(0, 0)][0x200])
+    assert cpu._state.memory.read(0xC000) == 0xBB
+    assert cpu._state.pc == 0x420B
+
+
+def test_save_state_restores_the_mbc():
+    cpu = CPU(logging.getLogger())
+    cpu.load_program(bytes(_rom(0x03, 8, 0x03)))
+    memory = cpu._state.memory
+    memory.write(0x2000, 0x06)
+    memory.write(0x0000, 0x0A)
+    memory.write(0xA000, 0x99)
+    state = cpu.save_state()
+
+    memory.write(0x2000, 0x02)
+    memory.write(0x0000, 0x00)
+    cpu.load_state(state)
+    assert memory.read(0x4000) == 6
+    assert memory.read(0xA000) == 0x99
+
+    fork = cpu.fork()
+    assert fork._state.memory.read(0x4000) == 6
+    assert fork._state.memory.read(0xA000) == 0x99
+
+
+def test_battery_backed_ram_is_kept_in_a_save_file(tmp_path):
+    rom = tmp_path / 'game.gb'
+    rom.write_bytes(_rom(0x03, 4, 0x02))
+    emulator = Emulator(logging.getLogger(), headless=True)
+    emulator.load_rom_file(str(rom))
+    memory = emulator._cpu._state.memory
+    assert not memory._cartridge.dirty
+
+    memory.write(0x0000, 0x0A)
+    memory.write(0xA123, 0x42)
+    memory.write(0x0000, 0x00)
+    assert memory._cartridge.dirty
+    emulator.step_frame()
+    assert not memory._cartridge.dirty
+
+    assert (tmp_path / 'game.sav').read_bytes()[0x123] == 0x42
+    emulator = Emulator(logging.getLogger(), headless=True)
+    emulator.load_rom_file(str(rom))
+    memory = emulator._cpu._state.memory
+    memory.write(0x0000, 0x0A)
+    assert memory.read(0xA123) == 0x42
+
+
+def test_save_file_is_only_flushed_after_writes(tmp_path):
+    rom = tmp_path / 'game.gb'
+    program = _rom(0x1B, 4, 0x03)
+    # JR -2
+    program[0x100:0x102] = bytes([0x18, 0xFE])
+    rom.write_bytes(program)
+    emulator = Emulator(logging.getLogger(), headless=True)
+    emulator.load_rom_file(str(rom))
+    memory = emulator._cpu._state.memory
+
+    # RAM that is left enabled isn't dirty until written to
+    memory.write(0x0000, 0x0A)
+    emulator.step_frame()
+    assert not memory._cartridge.dirty
+    assert memory.read(0xA000) == 0x00
+
+    for value in (0x11, 0x22):
+        memory.write(0xA000, value)
+        assert memory._cartridge.dirty
+        emulator.step_frame()
+        assert not memory._cartridge.dirty
+        assert (tmp_path / 'game.sav').read_bytes()[0] == value
+
+    memory.write(0xB000, 0x33)
+    emulator.close()
+    assert (tmp_path / 'game.sav').read_bytes()[0x1000] == 0x33
+
+
+def test_ram_without_a_battery_is_not_saved(tmp_path):
+    rom = tmp_path / 'game.gb'
+    rom.write_bytes(_rom(0x02, 4, 0x02))
+    emulator = Emulator(logging.getLogger(), headless=True)
+    emulator.load_rom_file(str(rom))
+    emulator.step_frame()
+
+    assert not (tmp_path / 'game.sav').exists()
+
+
+def _clock(memory):
+    # Latches the clock and reads seconds, minutes, hours, DL and DH
+    memory.write(0x6000, 0x00)
+    memory.write(0x6000, 0x01)
+    registers = []
+    for register in range(0x08, 0x0D):
+        memory.write(0x4000, register)
+        registers.append(memory.read(0xA000))
+    return registers
+
+
+@pytest.fixture
+def rtc_memory():
+    memory = Memory(logging.getLogger(), _rom(0x10, 4, 0x03))
+    memory.write(0x0000, 0x0A)
+    return memory
+
+
+def test_rtc_follows_the_cycle_count(rtc_memory):
+    scheduler = rtc_memory._scheduler
+    scheduler.cycles += (((300 * 24 + 5) * 60 + 4) * 60 + 3) * CPU_FREQUENCY
+    assert _clock(rtc_memory) == [3, 4, 5, 300 & 0xFF, 0x01]
+
+    # Nothing changes until latched again
+    scheduler.cycles += CPU_FREQUENCY
+    rtc_memory.write(0x4000, 0x08)
+    assert rtc_memory.read(0xA000) == 3
+    assert _clock(rtc_memory)[0] == 4
+
+
+def test_rtc_can_be_halted_and_written(rtc_memory):
+    scheduler = rtc_memory._scheduler
+    rtc_memory.write(0x4000, 0x0C)
+    rtc_memory.write(0xA000, 0x40)
+    scheduler.cycles += 100 * CPU_FREQUENCY
+    assert _clock(rtc_memory) == [0, 0, 0, 0, 0x40]
+
+    for register, value in ((0x0A, 23), (0x09, 59), (0x08, 59)):
+        rtc_memory.write(0x4000, register)
+        rtc_memory.write(0xA000, value)
+    rtc_memory.write(0x4000, 0x0C)
+    rtc_memory.write(0xA000, 0x00)
+    scheduler.cycles += CPU_FREQUENCY
+    assert _clock(rtc_memory) == [0, 0, 0, 1, 0x00]
+
+
+def test_rtc_registers_are_masked_and_kept_as_written(rtc_memory):
+    scheduler = rtc_memory._scheduler
+    for register, value in ((0x08, 0xFF), (0x09, 0x7C), (0x0A, 0xFF), (0x0B, 0xFF), (0x0C, 0xFF)):
+        rtc_memory.write(0x4000, register)
+        rtc_memory.write(0xA000, value)
+    assert _clock(rtc_memory) == [0x3F, 0x3C, 0x1F, 0xFF, 0xC1]
+
+    # Out of range values count up to the limit of their bits and wrap
+    # around without carrying into the next register
+    rtc_memory.write(0x4000, 0x0C)
+    rtc_memory.write(0xA000, 0x01)
+    scheduler.cycles += CPU_FREQUENCY
+    assert _clock(rtc_memory) == [0, 0x3C, 0x1F, 0xFF, 0x01]
+    scheduler.cycles += 4 * 60 * CPU_FREQUENCY
+    assert _clock(rtc_memory) == [0, 0, 0x1F, 0xFF, 0x01]
+    scheduler.cycles += 3600 * CPU_FREQUENCY
+    assert _clock(rtc_memory) == [0, 0, 0, 0xFF, 0x01]
+
+
+def test_rtc_day_counter_carries(rtc_memory):
+    rtc = rtc_memory._cartridge.rtc
+    rtc.advance(511 * 86400 + 86399)
+    assert _clock(rtc_memory) == [59, 59, 23, 0xFF, 0x01]
+
+    rtc.advance(2)
+    assert _clock(rtc_memory) == [1, 0, 0, 0, 0x80]
+    # The carry stays until cleared
+    rtc.advance(86400)
+    assert _clock(rtc_memory)[3:] == [1, 0x80]
+    rtc_memory.write(0x4000, 0x0C)
+    rtc_memory.write(0xA000, 0x00)
+    assert _clock(rtc_memory)[3:] == [1, 0x00]
+
+
+def test_rtc_is_saved_and_advanced_from_the_emulator(tmp_path):
+    rom = tmp_path / 'clock.gb'
+    rom.write_bytes(_rom(0x0F, 4))
+    emulator = Emulator(logging.getLogger(), headless=True)
+    emulator.load_rom_file(str(rom))
+    memory = emulator._cpu._state.memory
+    memory.write(0x0000, 0x0A)
+
+    emulator.advance_clock(3600)
+    state = emulator.save_state()
+    emulator.advance_clock(60)
+    assert _clock(memory)[:3] == [0, 1, 1]
+
+    emulator.load_state(state)
+    assert _clock(memory)[:3] == [0, 0, 1]
+    assert _clock(emulator.fork()._cpu._state.memory)[:3] == [0, 0, 1]
+
+
+@pytest.mark.parametrize("cartridge_type", [0x01, 0x03])
+def test_dma_from_cartridge_ram_that_is_not_mapped(cartridge_type):
+    memory = Memory(logging.getLogger(), _rom(cartridge_type, 4, 0x02))
+    memory.write(0xFF46, 0xA0)
+    memory._scheduler.cycles += 640
+    assert bytes(memory._oam) == b'\xFF' * 0xA0
+
+    # And from the RAM once it is enabled
+    memory.write(0x0000, 0x0A)
+    memory.write(0xFF46, 0xA0)
+    memory._scheduler.cycles += 640
+    assert bytes(memory._oam) == (bytes(0xA0) if cartridge_type == 0x03 else b'\xFF' * 0xA0)
@@ -16,9 +16,11 @@ from .test_helpers import assert_cpu_flags, assert_cpu_register
 def test_cb_rlc_register(cpu, register_name, opcode):
     cpu.load_program(bytes([0xCB, opcode]))
     setattr(cpu._state, register_name, 0x80)
-    cpu.run_next_instruction()
+    cycles = cpu.run_next_instruction()
 
     assert_cpu_flags(cpu._state, cf=1, zf=0)
+    # Like every CB instruction on a register, including B-E
+    assert cycles == 8
 
 def test_cb_rlc_memory_variant(cpu):
     pytest.fail('Not implemented yet')
@@ -0,0 +1,84 @@
+import logging
+import subprocess
+import sys
+
+from pyboy.cpu import CYCLES_PER_FRAME
+from pyboy.emulator import Emulator
+
+
+def _headless_emulator(program: bytes) -> Emulator:
+    emulator = Emulator(logging.getLogger(), headless=True)
+    emulator._cpu.load_program(program + bytes(0x8000 - len(program)))
+    return emulator
+
+
+def test_step_frame_stops_at_vblank():
+    # JR -2
+    emulator = _headless_emulator(bytes([0x18, 0xFE]))
+    emulator._cpu.set_addresses(pc=0x0000)
+    memory = emulator._cpu._state.memory
+    vblank = memory.next_vblank()
+
+    for _ in range(5):
+        emulator.step_frame()
+        assert memory.read(0xFF44) == 144
+        # The 12 cycle JR overshoots the end of the frame, which is carried
+        # over instead of adding up
+        assert 0 <= emulator._cpu._scheduler.cycles - vblank < 12
+        vblank += CYCLES_PER_FRAME
+
+
+def test_framebuffer_is_updated_in_place():
+    emulator = _headless_emulator(bytes([0x18, 0xFE]))
+    emulator._cpu.set_addresses(pc=0x0000)
+    framebuffer = emulator.framebuffer
+    assert framebuffer.shape == (144, 160)
+    assert framebuffer.dtype.name == 'uint8'
+
+    memory = emulator._cpu._state.memory
+    memory.write(0x8000, 0xFF)
+    memory.write(0x8001, 0xFF)
+    memory.write(0xFF47, 0b11100100)
+    memory.write(0xFF40, 0x91)
+    emulator.step_frame()
+
+    assert emulator.framebuffer is framebuffer
+    assert framebuffer[0, 0] == 3
+    assert framebuffer[1, 0] == 0
+
+
+def test_headless_does_not_import_pygame():
+    code = (
+        "import logging, sys\n"
+        "from pyboy.emulator import Emulator\n"
+        "emulator = Emulator(logging.getLogger(), headless=True)\n"
+        "emulator._cpu.load_program(bytes([0x18, 0xFE]) + bytes(0x7FFE))\n"
+        "emulator._cpu.set_addresses(pc=0x0000)\n"
+        "emulator.step_frame()\n"
+        "assert 'pygame' not in sys.modules\n"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+
+def test_frame_changed_follows_writes_to_what_is_drawn():
+    emulator = _headless_emulator(bytes([0x18, 0xFE]))
+    emulator._cpu.set_addresses(pc=0x0000)
+    memory = emulator._cpu._state.memory
+
+    def changed_frames():
+        changed = []
+        for _ in range(3):
+            emulator.step_frame()
+            changed.append(emulator.frame_changed)
+        return changed
+
+    assert changed_frames() == [True, True, False]
+    # Writes count for the frame they happen in and the next one
+    for address, value in ((0x8000, 0xFF), (0x9800, 1), (0xFE00, 16), (0xFF43, 4), (0xFF47, 0xE4), (0xFF40, 0x93)):
+        memory.write(address, value)
+        assert changed_frames() == [True, True, False]
+
+    # Writing what's already there changes nothing
+    for address, value in ((0x8000, 0xFF), (0xFE00, 16), (0xFF43, 4)):
+        memory.write(address, value)
+    assert changed_frames() == [False, False, False]
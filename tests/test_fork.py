@@ -0,0 +1,136 @@
+import logging
+
+import pytest
+
+from pyboy.cpu import CPU, Memory
+from pyboy.emulator import Emulator
+from pyboy.scheduler import Scheduler
+
+
+def _program() -> bytes:
+    # Enable the timer interrupt with a handler that counts into 0xC000, then
+    # spin in a loop that keeps writing changing values to WRAM
+    program = bytearray(0x8000)
+    program[0x50:0x58] = bytes([0xFA, 0x00, 0xC0, 0x3C, 0xEA, 0x00, 0xC0, 0xD9])
+    program[0x100:0x10C] = bytes([0x3E, 0x05, 0xE0, 0x07, 0x3E, 0x04, 0xE0, 0xFF, 0xFB, 0x21, 0x10, 0xC0])
+    program[0x10C:0x110] = bytes([0x3C, 0x22, 0x18, 0xFC])
+    return bytes(program)
+
+
+@pytest.fixture
+def memory():
+    memory = Memory(logging.getLogger(), bytes(0x8000))
+    for address in range(0xC000, 0xE000, 0x100):
+        memory.write(address, address >> 8)
+    memory.write(0x8000, 0x12)
+    memory.write(0xA000, 0x34)
+    memory.write(0xFF80, 0x56)
+    return memory
+
+
+def test_fork_sees_parent_memory(memory):
+    fork = memory.fork(Scheduler())
+
+    assert fork._rom_data is memory._rom_data
+    assert fork.read(0xC100) == 0xC1
+    assert fork.read(0xE100) == 0xC1
+    assert fork.read(0x8000) == 0x12
+    assert fork.read(0xA000) == 0x34
+    assert fork.read(0xFF80) == 0x56
+
+
+@pytest.mark.parametrize("address", [0x8000, 0xA000, 0xC100, 0xE200, 0xFF80])
+def test_writes_are_not_shared(memory, address):
+    fork = memory.fork(Scheduler())
+    before = memory.read(address)
+
+    fork.write(address, 0xAA)
+    assert fork.read(address) == 0xAA
+    assert memory.read(address) == before
+
+    memory.write(address, 0xBB)
+    assert memory.read(address) == 0xBB
+    assert fork.read(address) == 0xAA
+
+
+def test_pages_are_copied_on_first_write(memory):
+    fork = memory.fork(Scheduler())
+    assert fork._shared_pages[0xC1] is not None
+
+    fork.write(0xE105, 0x99)
+    assert fork._shared_pages[0xC1] is None
+    assert fork._shared_pages[0xC2] is not None
+    assert fork.read(0xC100) == 0xC1
+    assert fork.read(0xC105) == 0x99
+    assert fork._ram[0x105] == 0x99
+    assert memory.read(0xC105) == 0x00
+
+
+def test_forks_of_forks(memory):
+    first = memory.fork(Scheduler())
+    first.write(0xC200, 0x01)
+    second = first.fork(Scheduler())
+    second.write(0xC300, 0x02)
+
+    assert (memory.read(0xC200), memory.read(0xC300)) == (0xC2, 0xC3)
+    assert (first.read(0xC200), first.read(0xC300)) == (0x01, 0xC3)
+    assert (second.read(0xC200), second.read(0xC300)) == (0x01, 0x02)
+
+
+def test_forked_cpu_continues_identically():
+    cpu = CPU(logging.getLogger())
+    cpu.load_program(_program())
+    cpu.set_addresses(pc=0x100, sp=0xDFF0)
+    cpu.run_n_cycles(12345)
+
+    fork = cpu.fork()
+    cpu.run_n_cycles(50000)
+    fork.run_n_cycles(50000)
+
+    assert cpu._state.memory.read(0xC000) > 0
+    assert fork.save_state() == cpu.save_state()
+
+
+def test_drawing_frames_keeps_vram_shared():
+    # Draws tile 1, whose top row is black, in the top left corner and spins
+    program = bytearray(0x8000)
+    program[0x100:0x117] = bytes([0x3E, 0xFF, 0xEA, 0x10, 0x80, 0xEA, 0x11, 0x80, 0x3E, 0x01, 0xEA, 0x00, 0x98,
+                                  0x3E, 0xE4, 0xE0, 0x47, 0x3E, 0x91, 0xE0, 0x40, 0x18, 0xFE])
+    emulator = Emulator(logging.getLogger(), headless=True)
+    emulator._cpu.load_program(bytes(program))
+    emulator.step_frame()
+    emulator.step_frame()
+
+    fork = emulator.fork()
+    fork.step_frame()
+    emulator.step_frame()
+    for memory in (emulator._cpu._state.memory, fork._cpu._state.memory):
+        assert None not in memory._shared_pages[0x80:0xA0]
+    assert list(fork.framebuffer[0, :16]) == [3] * 8 + [0] * 8
+
+    # A page written to in the fork is its own, the rest stays shared
+    fork._cpu._state.memory.write(0x9801, 0x01)
+    fork.step_frame()
+    emulator.step_frame()
+    assert fork._cpu._state.memory._shared_pages[0x80:0xA0].count(None) == 1
+    assert list(fork.framebuffer[0, :16]) == [3] * 16
+    assert list(emulator.framebuffer[0, :16]) == [3] * 8 + [0] * 8
+
+
+def test_save_state_keeps_pages_shared():
+    cpu = CPU(logging.getLogger())
+    cpu.load_program(_program())
+    cpu.set_addresses(pc=0x100, sp=0xDFF0)
+    cpu.run_n_cycles(12345)
+
+    fork = cpu.fork()
+    memory = fork._state.memory
+    shared = memory._shared_pages[:]
+    state = fork.save_state()
+    assert memory._shared_pages == shared
+    assert state == cpu.save_state()
+
+    other = CPU(logging.getLogger())
+    other.load_program(_program())
+    other.load_state(state)
+    assert other.save_state() == state
@@ -0,0 +1,121 @@
+import logging
+
+import pytest
+
+from pyboy.cpu import CPU, Memory
+
+
+@pytest.fixture
+def memory():
+    return Memory(logging.getLogger(), bytes(range(0x100)) * 0x80)
+
+
+@pytest.mark.parametrize("address", [0x8000, 0x9FFF, 0xA000, 0xBFFF, 0xC000, 0xDFFF, 0xFE00, 0xFE9F, 0xFF80, 0xFFFE, 0xFFFF])
+def test_write_then_read(memory, address):
+    memory.write(address, 0x1AB)
+    assert memory.read(address) == 0xAB
+
+
+def test_rom_is_read_only(memory):
+    assert memory.read(0x1234) == 0x34
+    memory.write(0x1234, 0x00)
+    memory.write(0x2000, 0x01)
+    assert memory.read(0x1234) == 0x34
+
+
+def test_echo_ram_mirrors_work_ram(memory):
+    memory.write(0xE123, 0x42)
+    assert memory.read(0xC123) == 0x42
+    memory.write(0xD000, 0x24)
+    assert memory.read(0xF000) == 0x24
+
+
+def test_unusable_area_reads_zero_and_ignores_writes(memory):
+    memory.write(0xFEA0, 0x12)
+    assert memory.read(0xFEA0) == 0
+
+
+def test_io_registers_go_through_handlers(memory):
+    memory.write(0xFF07, 0x05)
+    assert memory.read(0xFF07) == 0x05
+    assert memory.read(0xFF00) == 0b11011111
+    memory.write(0xFF10, 0x80)
+    assert memory.read(0xFF10) == 0x80
+
+
+def test_regions_share_one_address_space(memory):
+    memory.write(0x8010, 0x11)
+    memory.write(0xC020, 0x22)
+    memory.write(0xFE30, 0x33)
+    memory.write(0xFF90, 0x44)
+    memory.write(0xFFFF, 0x1F)
+
+    snapshot = bytes(memory._address_space)
+    assert snapshot[0x8010] == 0x11
+    assert snapshot[0xC020] == 0x22
+    assert snapshot[0xFE30] == 0x33
+    assert snapshot[0xFF90] == 0x44
+    assert snapshot[0xFFFF] == 0x1F
+    assert memory._ram[0x20] == 0x22
+
+
+def test_joypad_reads_selected_buttons(memory):
+    assert memory.read(0xFF00) == 0b11011111
+
+    memory.set_joypad(0b10000101)  # start, up and right
+    assert memory.read(0xFF0F) & 0x10
+
+    memory.write(0xFF00, 0x10)
+    assert memory.read(0xFF00) == 0b11010111
+    memory.write(0xFF00, 0x20)
+    assert memory.read(0xFF00) == 0b11101010
+    memory.write(0xFF00, 0x30)
+    assert memory.read(0xFF00) == 0b11111111
+
+
+@pytest.mark.parametrize("source", [0x12, 0xC1, 0xE1])
+def test_dma_copies_into_oam(memory, source):
+    for offset in range(0xA0):
+        memory.write(0xC100 + offset, offset ^ 0x5A)
+    memory.write(0xFE00, 0x99)
+
+    memory.write(0xFF46, source)
+    assert memory.read(0xFF46) == source
+    # OAM is blocked until the transfer is done
+    assert memory.read(0xFE00) == 0xFF
+    memory.write(0xFE00, 0x00)
+
+    memory._scheduler.cycles += 640
+    expected = bytes(range(0x00, 0xA0)) if source == 0x12 else bytes(offset ^ 0x5A for offset in range(0xA0))
+    assert bytes(memory._oam) == expected
+    assert memory.read(0xFE00) == expected[0]
+
+
+def test_sp_wraps_past_0xffff():
+    # POP BC; POP DE from 0xFFFE, the second one reads 0x0000 and 0x0001
+    program = bytearray(0x8000)
+    program[0x0000:0x0002] = bytes([0x12, 0x34])
+    program[0x0100:0x0102] = bytes([0xC1, 0xD1])
+    cpu = CPU(logging.getLogger())
+    cpu.load_program(bytes(program))
+    cpu.set_addresses(sp=0xFFFE)
+    cpu._state.memory.write(0xFFFE, 0x56)
+    cpu._state.memory.write(0xFFFF, 0x78)
+    cpu.run_next_instruction()
+    cpu.run_next_instruction()
+
+    assert (cpu._state.BC, cpu._state.DE) == (0x7856, 0x3412)
+    assert cpu._state.memory.read(0x10001) == 0x34
+    assert cpu._state.memory.read(-1) == 0x78
+
+
+def test_jr_wraps_pc_below_0x0000():
+    # JR -4 at 0x0000
+    program = bytearray(0x8000)
+    program[0x0000:0x0002] = bytes([0x18, 0xFC])
+    cpu = CPU(logging.getLogger())
+    cpu.load_program(bytes(program))
+    cpu.set_addresses(pc=0x0000)
+    cpu.run_next_instruction()
+
+    assert cpu._state.pc == 0xFFFE
@@ -0,0 +1,214 @@
+import logging
+
+import pytest
+
+from pyboy.cpu import Memory
+from pyboy.scheduler import Scheduler
+
+
+@pytest.fixture
+def memory():
+    memory = Memory(logging.getLogger(), bytes(0x8000), Scheduler())
+    memory.write(0xFF40, 0x80)
+    return memory
+
+
+def _run_until(memory, cycles):
+    scheduler = memory._scheduler
+    while scheduler.next_deadline <= cycles:
+        scheduler.cycles = scheduler.next_deadline
+        scheduler.service()
+    scheduler.cycles = cycles
+
+
+@pytest.mark.parametrize("cycles, ly, mode", [
+    (0, 0, 2), (79, 0, 2), (80, 0, 3), (251, 0, 3), (252, 0, 0), (455, 0, 0),
+    (456, 1, 2), (144 * 456, 144, 1), (153 * 456 + 455, 153, 1), (154 * 456 + 80, 0, 3),
+])
+def test_modes_follow_the_line_timeline(memory, cycles, ly, mode):
+    _run_until(memory, cycles)
+
+    assert memory.read(0xFF44) == ly
+    assert memory.read(0xFF41) & 0x03 == mode
+
+
+def test_stat_reads_mode_0_while_lcd_is_off(memory):
+    memory.write(0xFF40, 0x00)
+    _run_until(memory, 100)
+
+    assert memory.read(0xFF41) & 0x03 == 0
+
+
+def test_lcd_off_stops_ly_and_vblank(memory):
+    _run_until(memory, 10 * 456)
+    memory.write(0xFF40, 0x00)
+    memory.write(0xFF0F, 0)
+    _run_until(memory, 10 * 456 + 154 * 456 * 3 // 2)
+
+    assert memory.read(0xFF44) == 0
+    assert memory.read(0xFF0F) & 0x1F == 0
+
+
+def test_turning_the_lcd_on_starts_at_line_0(memory):
+    memory.write(0xFF40, 0x00)
+    _run_until(memory, 1000)
+    memory.write(0xFF40, 0x80)
+
+    _run_until(memory, 1000 + 79)
+    assert memory.read(0xFF44) == 0
+    assert memory.read(0xFF41) & 0x03 == 2
+    _run_until(memory, 1000 + 456)
+    assert memory.read(0xFF44) == 1
+    _run_until(memory, 1000 + 144 * 456)
+    assert memory.read(0xFF44) == 144
+    assert memory.read(0xFF0F) & 0x01
+
+
+def test_lcd_starts_as_left_by_the_boot_rom():
+    memory = Memory(logging.getLogger(), bytes(0x8000), Scheduler())
+    assert memory.read(0xFF40) == 0x91
+    assert memory.read(0xFF47) == 0xFC
+
+    # Tile 0 in color 3 in the background, drawn black without touching any register
+    for address in range(0x8000, 0x8010):
+        memory.write(address, 0xFF)
+    _run_until(memory, 456)
+    assert list(memory._ppu.framebuffer[0, :8]) == [3] * 8
+
+
+def test_lyc_coincidence_raises_stat_interrupt(memory):
+    memory.write(0xFF45, 5)
+    memory.write(0xFF41, 0x40)
+    _run_until(memory, 5 * 456 - 1)
+    assert memory.read(0xFF0F) & 0x02 == 0
+    assert memory.read(0xFF41) & 0x04 == 0
+
+    _run_until(memory, 5 * 456)
+    assert memory.read(0xFF0F) & 0x02
+    assert memory.read(0xFF41) & 0x04
+
+
+def test_hblank_raises_stat_interrupt_once_per_line(memory):
+    memory.write(0xFF41, 0x08)
+    _run_until(memory, 252)
+    assert memory.read(0xFF0F) & 0x02
+
+    memory.write(0xFF0F, 0)
+    _run_until(memory, 455)
+    assert memory.read(0xFF0F) & 0x02 == 0
+    _run_until(memory, 456 + 252)
+    assert memory.read(0xFF0F) & 0x02
+
+
+def _tile(memory, tile, color):
+    # Every pixel of the tile in color
+    for row in range(8):
+        memory.write(0x8000 + tile * 16 + row * 2, 0xFF if color & 1 else 0x00)
+        memory.write(0x8000 + tile * 16 + row * 2 + 1, 0xFF if color & 2 else 0x00)
+
+
+def test_lines_are_drawn_with_background_window_and_sprites(memory):
+    _tile(memory, 1, 1)
+    _tile(memory, 2, 2)
+    _tile(memory, 3, 3)
+    # Background: tile 1 at the top left of the 0x9800 tilemap, scrolled 4
+    # pixels left, and the window showing the 0x9C00 tilemap of tile 2 from
+    # line 16, column 100 on
+    memory.write(0x9800, 1)
+    memory.write(0xFF43, 4)
+    for offset in range(0x400):
+        memory.write(0x9C00 + offset, 2)
+    memory.write(0xFF4A, 16)
+    memory.write(0xFF4B, 107)
+    # A sprite of tile 3 at (20, 2) and one behind the background at (0, 20)
+    memory.write(0xFE00, 2 + 16)
+    memory.write(0xFE01, 20 + 8)
+    memory.write(0xFE02, 3)
+    memory.write(0xFE04, 20 + 16)
+    memory.write(0xFE05, 0 + 8)
+    memory.write(0xFE06, 3)
+    memory.write(0xFE07, 0x80)
+    memory.write(0xFF47, 0b11100100)
+    memory.write(0xFF48, 0b11100100)
+    memory.write(0xFF40, 0x80 | 0x40 | 0x20 | 0x02 | 0x10 | 0x01)
+
+    _run_until(memory, 144 * 456)
+    framebuffer = memory._ppu.framebuffer
+
+    assert list(framebuffer[0, 0:6]) == [1, 1, 1, 1, 0, 0]
+    assert list(framebuffer[2, 18:30]) == [0, 0] + [3] * 8 + [0, 0]
+    assert framebuffer[3, 0] == 1
+    assert list(framebuffer[16, 98:102]) == [0, 0, 2, 2]
+    assert framebuffer[15, 100] == 0
+    # Behind the background, so only drawn where the background is color 0
+    assert list(framebuffer[20, 0:8]) == [3] * 8
+    _tile(memory, 0, 1)
+    _run_until(memory, 154 * 456 + 144 * 456)
+    assert list(framebuffer[20, 0:8]) == [1] * 8
+
+
+def test_turning_the_lcd_off_blanks_the_screen(memory):
+    _tile(memory, 0, 3)
+    memory.write(0xFF47, 0b11100100)
+    memory.write(0xFF40, 0x91)
+    _run_until(memory, 144 * 456)
+    assert memory._ppu.framebuffer.all()
+
+    memory.write(0xFF40, 0x11)
+    assert not memory._ppu.framebuffer.any()
+
+
+def _sprite(memory, index, x, y, tile, flags=0):
+    memory.write(0xFE00 + index * 4, y + 16)
+    memory.write(0xFE01 + index * 4, x + 8)
+    memory.write(0xFE02 + index * 4, tile)
+    memory.write(0xFE03 + index * 4, flags)
+
+
+def test_overlapping_sprites_follow_priority(memory):
+    _tile(memory, 1, 1)
+    _tile(memory, 2, 2)
+    _tile(memory, 3, 3)
+    memory.write(0x9800 + 32, 1)
+    # Line 0: lower X wins over lower OAM index, on equal X lower OAM index wins
+    _sprite(memory, 0, 4, 0, 2)
+    _sprite(memory, 1, 0, 0, 3)
+    _sprite(memory, 2, 20, 0, 2)
+    _sprite(memory, 3, 20, 0, 3)
+    # Line 8: the winner is behind background color 1, which hides the sprite below it too
+    _sprite(memory, 4, 0, 8, 2, 0x80)
+    _sprite(memory, 5, 4, 8, 3)
+    # Line 16: only the first 10 sprites in OAM order are drawn
+    for index in range(6, 17):
+        _sprite(memory, index, (index - 6) * 8, 16, 3)
+    memory.write(0xFF47, 0b11100100)
+    memory.write(0xFF48, 0b11100100)
+    memory.write(0xFF40, 0x80 | 0x10 | 0x02 | 0x01)
+
+    _run_until(memory, 144 * 456)
+    framebuffer = memory._ppu.framebuffer
+
+    assert list(framebuffer[0, 0:12]) == [3] * 8 + [2] * 4
+    assert list(framebuffer[0, 20:28]) == [2] * 8
+    assert list(framebuffer[8, 0:12]) == [1] * 8 + [3] * 4
+    assert list(framebuffer[16, 72:88]) == [3] * 8 + [0] * 8
+
+
+def test_sprites_are_flipped(memory):
+    # Tile 4 has only its top left pixel set, tile 5 is empty
+    memory.write(0x8000 + 4 * 16, 0x80)
+    _sprite(memory, 0, 0, 0, 4)
+    _sprite(memory, 1, 8, 0, 4, 0x20)
+    # 8x16 sprites use tile 4 & 0xFE on top, flipped vertically the pixel ends up on the bottom row
+    _sprite(memory, 2, 16, 0, 5, 0x40)
+    _sprite(memory, 3, 24, 0, 5, 0x40 | 0x20)
+    memory.write(0xFF48, 0b11100100)
+    memory.write(0xFF40, 0x80 | 0x04 | 0x02)
+
+    _run_until(memory, 144 * 456)
+    framebuffer = memory._ppu.framebuffer
+
+    assert list(framebuffer[0, 0:16]) == [1] + [0] * 14 + [1]
+    assert list(framebuffer[15, 16:32]) == [1] + [0] * 14 + [1]
+    assert not framebuffer[0, 16:32].any()
+    assert framebuffer[1:15].sum() == 0
@@ -0,0 +1,11 @@
+from pyboy.renderer import decode_tiles
+
+
+def test_decode_tiles():
+    vram = bytearray(0x2000)
+    vram[16:18] = bytes([0b10100101, 0b11000011])
+    tiles = decode_tiles(vram)
+
+    assert tiles.shape == (384, 8, 8)
+    assert list(tiles[1, 0]) == [3, 2, 1, 0, 0, 1, 2, 3]
+    assert not tiles[0].any()
@@ -0,0 +1,41 @@
+import logging
+
+from pyboy.cpu import Memory
+from pyboy.emulator import Emulator
+from pyboy.rom import as_rom, load_rom
+
+
+def test_roms_with_the_same_content_share_one_mapping(tmp_path):
+    content = bytes(range(0x100)) * 0x80
+    for name in ('a.gb', 'b.gb'):
+        (tmp_path / name).write_bytes(content)
+    (tmp_path / 'c.gb').write_bytes(content[::-1])
+
+    rom = load_rom(str(tmp_path / 'a.gb'))
+    assert rom.readonly
+    assert rom == content
+    assert load_rom(str(tmp_path / 'a.gb')) is rom
+    assert load_rom(str(tmp_path / 'b.gb')) is rom
+    assert load_rom(str(tmp_path / 'c.gb')) is not rom
+
+
+def test_roms_are_not_copied(tmp_path):
+    (tmp_path / 'rom.gb').write_bytes(bytes(range(0x100)) * 0x80)
+    emulators = [Emulator(logging.getLogger(), headless=True) for _ in range(2)]
+    for emulator in emulators:
+        emulator.load_rom_file(str(tmp_path / 'rom.gb'))
+
+    first, second = (emulator._cpu._state.memory for emulator in emulators)
+    assert first._rom_data is second._rom_data
+    assert first.read(0x1234) == 0x34
+
+
+def test_mutable_buffers_are_copied():
+    data = bytearray(0x8000)
+    memory = Memory(logging.getLogger(), data)
+    data[0x100] = 0xFF
+    assert memory.read(0x100) == 0x00
+
+    rom = bytes(0x8000)
+    assert as_rom(rom) is rom
+    assert Memory(logging.getLogger(), rom)._rom_data is rom
@@ -0,0 +1,88 @@
+import logging
+import random
+
+import pytest
+
+from pyboy.cpu import CPU
+
+
+def _state_of(cpu):
+    state = cpu._state
+    memory = state.memory
+    registers = (state.pc, state._sp, state.A, state.B, state.C, state.D, state.E, state.H, state.L,
+                 state.get_flags_byte(), state.ime, state._halted)
+    io = tuple(memory.read(address) for address in (0xFF04, 0xFF05, 0xFF06, 0xFF07, 0xFF0F, 0xFF44, 0xFFFF))
+    return registers, io, cpu._scheduler.cycles, bytes(memory._address_space[0xC000:0xE000])
+
+
+@pytest.fixture
+def cpu():
+    rng = random.Random(11)
+    # Enable the timer interrupt with a handler that counts into 0xC000, then
+    # spin in a loop that keeps writing changing values to WRAM
+    program = bytearray(0x8000)
+    program[0x50:0x55] = bytes([0xFA, 0x00, 0xC0, 0x3C, 0xEA])      # LD A,(C000); INC A; LD (nn),A
+    program[0x55:0x58] = bytes([0x00, 0xC0, 0xD9])                  # ... C000; RETI
+    program[0x100:0x10A] = bytes([0x3E, 0x05, 0xE0, 0x07, 0x3E, 0x04, 0xE0, 0xFF, 0xFB, 0x21])
+    program[0x10A:0x10C] = bytes([0x10, 0xC0])                      # LD HL,C010
+    program[0x10C:0x110] = bytes([0x3C, 0x22, 0x18, 0xFC, ])        # INC A; LD (HL+),A; JR -4
+    program[0x200:0x240] = bytes(rng.randrange(0x100) for _ in range(0x40))
+
+    cpu = CPU(logging.getLogger())
+    cpu.load_program(bytes(program))
+    cpu.set_addresses(pc=0x100, sp=0xDFF0)
+    return cpu
+
+
+def test_load_state_resumes_identically(cpu):
+    cpu.run_n_cycles(12345)
+    snapshot = cpu.save_state()
+
+    cpu.run_n_cycles(50000)
+    expected = _state_of(cpu)
+    assert cpu._state.memory.read(0xC000) > 0
+
+    cpu.load_state(snapshot)
+    cpu.run_n_cycles(50000)
+    assert _state_of(cpu) == expected
+
+
+def test_load_state_into_another_cpu(cpu):
+    cpu.run_n_cycles(20000)
+    snapshot = cpu.save_state()
+    expected = _state_of(cpu)
+
+    other = CPU(logging.getLogger())
+    other.load_program(cpu._state.memory._rom_data)
+    other.load_state(snapshot)
+    assert _state_of(other) == expected
+
+    cpu.run_n_cycles(30000)
+    other.run_n_cycles(30000)
+    assert _state_of(other) == _state_of(cpu)
+
+
+def test_load_state_rejects_other_versions(cpu):
+    snapshot = bytearray(cpu.save_state())
+    snapshot[4] = 0xFF
+
+    with pytest.raises(Exception, match='version'):
+        cpu.load_state(bytes(snapshot))
+
+
+def test_load_state_restores_dma_and_window_line(cpu):
+    cpu.run_n_cycles(20000)
+    memory = cpu._state.memory
+    memory.write(0xFF46, 0xC0)
+    memory._ppu._window_line = 42
+    cpu._state.SP = 0x10001
+    snapshot = cpu.save_state()
+
+    other = CPU(logging.getLogger())
+    other.load_program(memory._rom_data)
+    other.load_state(snapshot)
+    other_memory = other._state.memory
+    assert other_memory.read(0xFE00) == 0xFF
+    assert other_memory._dma_end == memory._dma_end
+    assert other_memory._ppu._window_line == 42
+    assert other._state.SP == 0x0001
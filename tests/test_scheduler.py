@@ -0,0 +1,71 @@
+import logging
+
+from pyboy.cpu import CPU
+from pyboy.scheduler import NEVER, Scheduler
+
+
+def test_events_run_in_deadline_order_when_due():
+    scheduler = Scheduler()
+    calls = []
+    scheduler.schedule("b", 20, lambda: calls.append("b"))
+    scheduler.schedule("a", 10, lambda: calls.append("a"))
+    assert scheduler.next_deadline == 10
+
+    scheduler.cycles = 15
+    scheduler.service()
+    assert calls == ["a"]
+    assert scheduler.next_deadline == 20
+
+    scheduler.cycles = 25
+    scheduler.service()
+    assert calls == ["a", "b"]
+    assert scheduler.next_deadline == NEVER
+
+
+def test_request_service_survives_rescheduling():
+    scheduler = Scheduler()
+    scheduler.cycles = 100
+    scheduler.schedule("timer", 500, lambda: None)
+
+    scheduler.request_service()
+    scheduler.schedule("timer", 600, lambda: None)
+    assert scheduler.next_deadline == 100
+
+    scheduler.service()
+    assert scheduler.next_deadline == 600
+
+
+def test_timer_interrupt_is_raised_at_overflow_deadline():
+    cpu = CPU(logging.getLogger())
+    cpu.load_program(bytes([0x00] * 0x8000))
+    mem = cpu._state.memory
+
+    mem.write(0xFF07, 0x05)  # 16 cycles per TIMA increment
+    mem.write(0xFF05, 0xFE)
+    assert cpu._scheduler.deadline("timer") == 32
+
+    cpu.run_n_cycles(28)
+    assert mem.read(0xFF0F) & 0x04 == 0
+    cpu.run_n_cycles(4)
+    assert mem.read(0xFF0F) & 0x04
+
+
+def test_halt_skips_to_next_event():
+    # Enable the timer interrupt, HALT until it fires and count into 0xC000
+    program = bytearray(0x8000)
+    program[0x50:0x58] = bytes([0xFA, 0x00, 0xC0, 0x3C, 0xEA, 0x00, 0xC0, 0xD9])
+    program[0x100:0x10D] = bytes([0x3E, 0x05, 0xE0, 0x07, 0x3E, 0x04, 0xE0, 0xFF, 0xFB, 0x76, 0x18, 0xFD])
+    cpus = []
+    for _ in range(2):
+        cpu = CPU(logging.getLogger())
+        cpu.load_program(bytes(program))
+        cpu.set_addresses()
+        cpus.append(cpu)
+
+    stepped, skipped = cpus
+    while stepped._scheduler.cycles < 100000:
+        stepped.run_n_cycles(4)
+    skipped.run_n_cycles(100000)
+
+    assert skipped._state.memory.read(0xC000) == stepped._state.memory.read(0xC000) > 0
+    assert skipped.save_state() == stepped.save_state()
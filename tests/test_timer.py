@@ -1,3 +1,8 @@
+import random
+
+import pytest
+
+
 def test_timer_overflow_and_interrupt():
     import logging
     from pyboy.cpu import CPU  # byt ut mot din modul
@@ -27,6 +32,48 @@ def test_timer_overflow_and_interrupt():
 
     print("Test passed!")
 
+
+def _reference_add_cycles(div_counter, tima, tma, tac, count):
+    """Steps the timer one T-cycle at a time, returns (div_counter, tima, overflows)."""
+    div_bit = {0: 9, 1: 3, 2: 5, 3: 7}[tac & 0x3]
+    overflows = 0
+    for _ in range(count):
+        new_div_counter = (div_counter + 1) & 0xFFFF
+        if tac & 0x4:
+            if (div_counter >> div_bit) & 1 and not (new_div_counter >> div_bit) & 1:
+                tima += 1
+                if tima > 0xFF:
+                    tima = tma
+                    overflows += 1
+        div_counter = new_div_counter
+
+    return div_counter, tima, overflows
+
+
+@pytest.mark.parametrize("tma", [0x00, 0xFC, 0xFF])
+@pytest.mark.parametrize("tac", [0x00, 0x03, 0x04, 0x05, 0x06, 0x07])
+def test_timer_add_cycles_matches_per_cycle_stepping(tac, tma):
+    from pyboy.timer import Timer
+
+    rng = random.Random(tac)
+    overflows = []
+    timer = Timer(lambda: overflows.append(1))
+    timer.TAC = tac
+    timer.TMA = tma
+    timer.TIMA = 0xF0
+
+    div_counter, tima = 0, 0xF0
+    for _ in range(2000):
+        count = rng.choice([4, 8, 12, 16, 20, 24, rng.randrange(1, 5000)])
+        div_counter, tima, expected_overflows = _reference_add_cycles(div_counter, tima, tma, tac, count)
+        del overflows[:]
+        timer.add_cycles(count)
+
+        assert timer._div_counter == div_counter
+        assert timer.TIMA == tima
+        # The interrupt is raised once, however many times TIMA overflowed
+        assert len(overflows) == min(expected_overflows, 1)
+
 """
 def test_timer_interrupt_timing():
     import logging
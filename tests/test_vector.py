@@ -0,0 +1,66 @@
+import logging
+
+import numpy as np
+import pytest
+
+from pyboy.cpu import CPU
+from pyboy.vector import REGISTERS, VectorEmulator
+
+START = 0x80
+
+
+@pytest.fixture
+def rom():
+    # Increment 0xC000 for as long as start is held
+    program = bytearray(0x8000)
+    program[0x100:0x110] = bytes([
+        0x3E, 0x10, 0xE0, 0x00,  # LD A,0x10; LDH (00),A - select buttons
+        0xF0, 0x00,              # LDH A,(00)
+        0xCB, 0x5F,              # BIT 3,A
+        0x20, 0xFA,              # JR NZ,-6
+        0x21, 0x00, 0xC0,        # LD HL,0xC000
+        0x34,                    # INC (HL)
+        0x18, 0xF4,              # JR -12
+    ])
+    return bytes(program)
+
+
+def test_step_shares_one_memory_array(rom):
+    vector = VectorEmulator(logging.getLogger(), rom, 4)
+    assert vector.memory.shape == (4, 0x10000)
+
+    framebuffers, ram = vector.step([0, START, 0, START])
+    assert framebuffers.shape == (4, 144, 160)
+    assert ram.shape == (4, 0x2000)
+    assert ram[0, 0] == 0 and ram[2, 0] == 0
+    assert ram[1, 0] > 0 and ram[1, 0] == ram[3, 0]
+    assert np.shares_memory(ram, vector.memory)
+
+    registers = vector.registers
+    assert registers.shape == (4, len(REGISTERS))
+    assert list(registers[:, REGISTERS.index('h')]) == [0x00, 0xC0, 0x00, 0xC0]
+
+
+def test_instances_match_a_single_cpu(rom):
+    vector = VectorEmulator(logging.getLogger(), rom, 2)
+    vector.step([START, 0], frames=3)
+
+    cpu = CPU(logging.getLogger())
+    cpu.load_program(rom)
+    cpu.set_addresses()
+    cpu._state.memory.set_joypad(START)
+    for _ in range(3):
+        cpu.run_frame()
+
+    assert bytes(vector.memory[0]) == bytes(cpu._state.memory._address_space)
+
+
+def test_reset_restores_the_initial_state(rom):
+    vector = VectorEmulator(logging.getLogger(), rom, 2)
+    initial = vector.memory.copy()
+    vector.step([START, START], frames=2)
+    assert not np.array_equal(vector.memory, initial)
+
+    vector.reset()
+    assert np.array_equal(vector.memory, initial)
+    assert list(vector.registers[:, 0]) == [0x100, 0x100]